@@ -1,82 +1,44 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
 from pathlib import Path
-from uuid import uuid4
-import shutil
 
+from app.core.acl import require_admin, require_staff
+from app.core.files import save_upload
+from app.core.metrics import metrics
+from app.core.response_cache import catalog_cache
 from app.models import get_db
 from app.schemas.user import User
 from app.schemas.book import Book, BookCreate, BookUpdate
 from app.services.book import get_books, create_book, update_book, delete_book
 from app.services.auth import get_users
+from app.services.principal import invalidate_principal
+from app.services.system_counters import get_system_counters
+from app.services.search import refresh_for_author, refresh_for_category
+from app.services.search_index import catalog_index
 from app.models.user import User as UserModel
-from app.models.book import Book as BookModel, Review, ReadingSession, Author as AuthorModel, Category as CategoryModel
+from app.models.book import Book as BookModel, Review, Author as AuthorModel, Category as CategoryModel
 
 router = APIRouter(tags=["admin"])
 
-# Простая проверка через request.state.user
-def check_admin(request: Request):
-    """Проверка, что пользователь — администратор."""
-    user = request.state.user
-    print(f"🔍 Проверка администратора: user={user}")
-
-    if not user or not user.get("is_authenticated"):
-        print("❌ Пользователь не авторизован")
-        raise HTTPException(status_code=401, detail="Не авторизован")
-
-    if user.get("role") != "admin":
-        print(f"❌ Недостаточно прав. Роль: {user.get('role')}")
-        raise HTTPException(status_code=403, detail="Требуются права администратора")
-
-    print(f"✅ Администратор подтвержден: {user.get('username')}")
-    return True
-
-
-def check_admin_or_librarian(request: Request):
-    """Проверка, что пользователь — админ или библиотекарь.
-
-    Используем для операций с книгами и загрузки файлов.
-    """
-    user = request.state.user
-    print(f"🔍 Проверка staff (admin/librarian): user={user}")
-
-    if not user or not user.get("is_authenticated"):
-        print("❌ Пользователь не авторизован")
-        raise HTTPException(status_code=401, detail="Не авторизован")
-
-    if user.get("role") not in ("admin", "librarian"):
-        print(f"❌ Недостаточно прав. Роль: {user.get('role')}")
-        raise HTTPException(status_code=403, detail="Требуются права администратора или библиотекаря")
-
-    print(f"✅ Доступ staff подтверждён: {user.get('username')} ({user.get('role')})")
-    return True
-
-@router.get("/stats")
+@router.get("/stats", dependencies=[Depends(require_staff)])
 def admin_get_stats(
-    request: Request,
     db: Session = Depends(get_db)
 ):
     """Получить статистику системы (админ/библиотекарь)"""
-    check_admin_or_librarian(request)
+    counters = get_system_counters(db)
     
-    total_users = db.query(UserModel).count()
-    total_books = db.query(BookModel).filter(BookModel.is_active == True).count()
-    total_reviews = db.query(Review).count()
-    total_reading_sessions = db.query(ReadingSession).count()
-    
-    # Самые популярные книги
+    # Самые популярные книги (индекс ix_books_active_popularity)
     popular_books = db.query(BookModel).filter(
         BookModel.is_active == True
-    ).order_by(BookModel.view_count.desc()).limit(5).all()
+    ).order_by(BookModel.popularity_score.desc(), BookModel.id.desc()).limit(5).all()
     
     return {
-        "total_users": total_users,
-        "total_books": total_books,
-        "total_reviews": total_reviews,
-        "total_reading_sessions": total_reading_sessions,
+        "total_users": counters["users"],
+        "total_books": counters["books"],
+        "total_reviews": counters["reviews"],
+        "total_reading_sessions": counters["reading_sessions"],
         "popular_books": [
             {
                 "id": book.id,
@@ -88,24 +50,24 @@ def admin_get_stats(
         ]
     }
 
-@router.get("/users", response_model=List[User])
+@router.get("/metrics", dependencies=[Depends(require_admin)])
+def admin_get_metrics():
+    """Метрики текущего процесса: кэши, тайминги, счётчики (админ)."""
+    return metrics.snapshot()
+
+@router.get("/users", response_model=List[User], dependencies=[Depends(require_admin)])
 def admin_get_users(
-    request: Request,
     db: Session = Depends(get_db)
 ):
     """Список всех пользователей (только для админа, для админ-панели)"""
-    check_admin(request)
     return get_users(db, skip=0, limit=100)
 
-@router.post("/books", response_model=Book)
+@router.post("/books", response_model=Book, dependencies=[Depends(require_staff)])
 def admin_create_book(
-    request: Request,
     book: BookCreate,
     db: Session = Depends(get_db)
 ):
     """Создать книгу (админ/библиотекарь). Любые ошибки БД заворачиваем в понятный JSON-ответ."""
-    check_admin_or_librarian(request)
-
     try:
         created = create_book(db, book)
         return created
@@ -126,19 +88,17 @@ def admin_create_book(
         )
 
 
-@router.post("/authors")
+@router.post("/authors", dependencies=[Depends(require_admin)])
 def admin_create_author(
-    request: Request,
     first_name: str,
     last_name: str,
     db: Session = Depends(get_db)
 ):
     """Создать автора (админ)."""
-    check_admin(request)
-
     author = AuthorModel(first_name=first_name, last_name=last_name)
     db.add(author)
     db.commit()
+    catalog_cache.bump()
     db.refresh(author)
     return {
         "id": author.id,
@@ -147,15 +107,38 @@ def admin_create_author(
     }
 
 
-@router.delete("/authors/{author_id}")
+@router.put("/authors/{author_id}", dependencies=[Depends(require_admin)])
+def admin_update_author(
+    author_id: int,
+    first_name: str,
+    last_name: str,
+    db: Session = Depends(get_db)
+):
+    """Переименовать автора (админ). Поисковый индекс его книг обновляется."""
+    author = db.query(AuthorModel).filter(AuthorModel.id == author_id).first()
+    if not author:
+        raise HTTPException(status_code=404, detail="Author not found")
+
+    author.first_name = first_name
+    author.last_name = last_name
+    db.flush()
+    book_ids = refresh_for_author(db, author_id)
+    db.commit()
+    catalog_cache.bump()
+    catalog_index.refresh_books(db, book_ids)
+    return {
+        "id": author.id,
+        "first_name": author.first_name,
+        "last_name": author.last_name,
+    }
+
+
+@router.delete("/authors/{author_id}", dependencies=[Depends(require_admin)])
 def admin_delete_author(
-    request: Request,
     author_id: int,
     db: Session = Depends(get_db)
 ):
     """Удалить автора (админ). Нельзя удалить, если к нему привязаны книги."""
-    check_admin(request)
-
     author = db.query(AuthorModel).filter(AuthorModel.id == author_id).first()
     if not author:
         raise HTTPException(status_code=404, detail="Author not found")
@@ -167,24 +150,25 @@ def admin_delete_author(
             detail="Нельзя удалить автора, который привязан к книгам. Сначала отвяжите книги."
         )
 
+    book_ids = [book.id for book in author.books]
     db.delete(author)
     db.commit()
+    catalog_cache.bump()
+    catalog_index.refresh_books(db, book_ids)
     return {"detail": "Автор удалён"}
 
 
-@router.post("/categories")
+@router.post("/categories", dependencies=[Depends(require_admin)])
 def admin_create_category(
-    request: Request,
     name: str,
     description: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Создать категорию (админ)."""
-    check_admin(request)
-
     category = CategoryModel(name=name, description=description)
     db.add(category)
     db.commit()
+    catalog_cache.bump()
     db.refresh(category)
     return {
         "id": category.id,
@@ -193,15 +177,39 @@ def admin_create_category(
     }
 
 
-@router.delete("/categories/{category_id}")
+@router.put("/categories/{category_id}", dependencies=[Depends(require_admin)])
+def admin_update_category(
+    category_id: int,
+    name: str,
+    description: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Переименовать категорию (админ). Поисковый индекс её книг обновляется."""
+    category = db.query(CategoryModel).filter(CategoryModel.id == category_id).first()
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+
+    category.name = name
+    if description is not None:
+        category.description = description
+    db.flush()
+    book_ids = refresh_for_category(db, category_id)
+    db.commit()
+    catalog_cache.bump()
+    catalog_index.refresh_books(db, book_ids)
+    return {
+        "id": category.id,
+        "name": category.name,
+        "description": category.description,
+    }
+
+
+@router.delete("/categories/{category_id}", dependencies=[Depends(require_admin)])
 def admin_delete_category(
-    request: Request,
     category_id: int,
     db: Session = Depends(get_db)
 ):
     """Удалить категорию (админ). Нельзя удалить, если к ней привязаны книги."""
-    check_admin(request)
-
     category = db.query(CategoryModel).filter(CategoryModel.id == category_id).first()
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
@@ -212,128 +220,104 @@ def admin_delete_category(
             detail="Нельзя удалить категорию, которая привязана к книгам. Сначала отвяжите книги."
         )
 
+    book_ids = [book.id for book in category.books]
     db.delete(category)
     db.commit()
+    catalog_cache.bump()
+    catalog_index.refresh_books(db, book_ids)
     return {"detail": "Категория удалена"}
 
 
-@router.post("/upload/book-file")
+@router.post("/upload/book-file", dependencies=[Depends(require_staff)])
 async def admin_upload_book_file(
-    request: Request,
     file: UploadFile = File(...)
 ):
     """Загрузить файл книги (PDF/EPUB и т.п.). Только для staff.
 
     Возвращает URL, который можно сохранить в поле file_url книги.
     """
-    check_admin_or_librarian(request)
-
-    books_dir = Path("static") / "books"
-    books_dir.mkdir(parents=True, exist_ok=True)
-
-    suffix = Path(file.filename).suffix or ".pdf"
-    filename = f"{uuid4().hex}{suffix}"
-    dest_path = books_dir / filename
-
-    with dest_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
+    filename = await save_upload(file, Path("static") / "books", ".pdf")
     return {"url": f"/static/books/{filename}"}
 
 
-@router.post("/upload/cover")
+@router.post("/upload/cover", dependencies=[Depends(require_staff)])
 async def admin_upload_cover(
-    request: Request,
     file: UploadFile = File(...)
 ):
     """Загрузить обложку книги (изображение). Только для staff.
 
     Возвращает URL, который можно сохранить в поле cover_url книги.
     """
-    check_admin_or_librarian(request)
-
-    covers_dir = Path("static") / "covers"
-    covers_dir.mkdir(parents=True, exist_ok=True)
-
-    suffix = Path(file.filename).suffix or ".jpg"
-    filename = f"{uuid4().hex}{suffix}"
-    dest_path = covers_dir / filename
-
-    with dest_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
+    filename = await save_upload(file, Path("static") / "covers", ".jpg")
     return {"url": f"/static/covers/{filename}"}
 
 
-@router.put("/books/{book_id}", response_model=Book)
+@router.put("/books/{book_id}", response_model=Book, dependencies=[Depends(require_staff)])
 def admin_update_book(
-    request: Request,
     book_id: int,
     book: BookUpdate,
     db: Session = Depends(get_db)
 ):
     """Обновить книгу (админ/библиотекарь)"""
-    check_admin_or_librarian(request)
     updated_book = update_book(db, book_id, book)
     if not updated_book:
         raise HTTPException(status_code=404, detail="Book not found")
     return updated_book
 
-@router.delete("/books/{book_id}")
+@router.delete("/books/{book_id}", dependencies=[Depends(require_staff)])
 def admin_delete_book(
-    request: Request,
     book_id: int,
     db: Session = Depends(get_db)
 ):
     """Удалить книгу (админ/библиотекарь)"""
-    check_admin_or_librarian(request)
     if not delete_book(db, book_id):
         raise HTTPException(status_code=404, detail="Book not found")
     return {"message": "Book deleted successfully"}
 
 
-@router.delete("/reviews/{review_id}")
+@router.delete("/reviews/{review_id}", dependencies=[Depends(require_admin)])
 def admin_delete_review(
-    request: Request,
     review_id: int,
     db: Session = Depends(get_db)
 ):
     """Удалить рецензию (только админ) и пересчитать рейтинг книги."""
-    check_admin(request)
-
     review = db.query(Review).filter(Review.id == review_id).first()
     if not review:
         raise HTTPException(status_code=404, detail="Review not found")
 
-    book_id = review.book_id
-
+    # Рейтинг книги пересчитывается инкрементально при flush (app/services/ratings.py)
     db.delete(review)
     db.commit()
 
-    # Пересчитываем средний рейтинг книги после удаления рецензии
-    if book_id:
-        book = db.query(BookModel).filter(BookModel.id == book_id).first()
-        if book:
-            avg_rating = db.query(func.avg(Review.rating)).filter(
-                Review.book_id == book_id,
-                Review.is_approved == True
-            ).scalar()
-            book.rating = avg_rating or 0.0
-            db.commit()
-
+    catalog_cache.bump()
     return {"detail": "Review deleted"}
 
 
-@router.patch("/users/{user_id}/role", response_model=User)
+@router.patch("/reviews/{review_id}/approval", dependencies=[Depends(require_admin)])
+def admin_approve_review(
+    review_id: int,
+    is_approved: bool = True,
+    db: Session = Depends(get_db)
+):
+    """Одобрить рецензию или снять одобрение (только админ)."""
+    review = db.query(Review).filter(Review.id == review_id).first()
+    if not review:
+        raise HTTPException(status_code=404, detail="Review not found")
+
+    review.is_approved = is_approved
+    db.commit()
+
+    catalog_cache.bump()
+    return {"id": review.id, "is_approved": review.is_approved}
+
+
+@router.patch("/users/{user_id}/role", response_model=User, dependencies=[Depends(require_admin)])
 def admin_update_user_role(
-    request: Request,
     user_id: int,
     new_role: str,
     db: Session = Depends(get_db)
 ):
     """Изменить роль пользователя (только админ)."""
-    check_admin(request)
-
     user_obj = db.query(UserModel).filter(UserModel.id == user_id).first()
     if not user_obj:
         raise HTTPException(status_code=404, detail="User not found")
@@ -341,26 +325,28 @@ def admin_update_user_role(
     user_obj.role = new_role
     db.commit()
     db.refresh(user_obj)
+    invalidate_principal(user_obj.id, user_obj.username)
     return user_obj
 
 
-@router.patch("/users/{user_id}/status", response_model=User)
+@router.patch("/users/{user_id}/status", response_model=User, dependencies=[Depends(require_admin)])
 def admin_update_user_status(
-    request: Request,
     user_id: int,
     is_active: bool,
     db: Session = Depends(get_db)
 ):
     """Активировать/деактивировать пользователя (только админ)."""
-    check_admin(request)
-
     user_obj = db.query(UserModel).filter(UserModel.id == user_id).first()
     if not user_obj:
         raise HTTPException(status_code=404, detail="User not found")
 
+    if user_obj.is_active and not is_active:
+        # Блокировка отзывает все ранее выданные токены пользователя
+        user_obj.token_version = (user_obj.token_version or 0) + 1
     user_obj.is_active = is_active
     db.commit()
     db.refresh(user_obj)
+    invalidate_principal(user_obj.id, user_obj.username)
     return user_obj
 
 # Отладочный эндпоинт
@@ -1,54 +1,78 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Optional
-from app.models import get_db
-from app.schemas.user import UserCreate, UserLogin, Token, User
+from app.models import get_db, get_read_db
+from app.models.user import User as UserModel
+from app.schemas.user import UserCreate, UserLogin, Token, User, Principal
 from app.services.auth import create_user, get_user_by_username, get_user_by_email
-from app.core.security import verify_token, create_access_token, verify_password
+from app.services.principal import resolve_principal, resolve_principal_async, token_claims
+from app.core.middleware import LazyUserState
+from app.core.hashing import password_hasher
+from app.core.security import create_access_token, password_needs_rehash
 
 router = APIRouter(tags=["authentication"])
 
+def _bearer_token(request: Request) -> Optional[str]:
+    # Токен из заголовка Authorization
+    auth_header = request.headers.get("Authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        return auth_header.replace("Bearer ", "")
+    return None
+
+
 def get_current_user(
     request: Request,
     db: Session = Depends(get_db)
-) -> Optional[User]:
+) -> Optional[Principal]:
     """Получаем текущего пользователя из токена"""
     try:
-        # Получаем токен из заголовка или куки
-        token = None
-        
         # 1. Из заголовка Authorization
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.replace("Bearer ", "")
+        token = _bearer_token(request)
         
-        # 2. Из куки
+        # 2. Из куки (через ленивое состояние, созданное middleware)
         if not token:
+            user_state = getattr(request.state, "user", None)
+            if isinstance(user_state, LazyUserState):
+                return user_state.resolve(db)
             token = request.cookies.get("access_token")
         
         if not token:
             return None
         
-        # Проверяем токен
-        payload = verify_token(token)
-        username = payload.get("sub")
+        return resolve_principal(token, db)
+        
+    except Exception as e:
+        print(f"⚠️  Ошибка при получении пользователя: {e}")
+        return None
+
+async def get_current_user_async(
+    request: Request,
+    db=Depends(get_read_db)
+) -> Optional[Principal]:
+    """get_current_user для async-обработчиков на сессии из get_read_db"""
+    if not isinstance(db, AsyncSession):
+        # При промахе кэша пользователь загружается синхронно — в пуле потоков
+        return await run_in_threadpool(get_current_user, request, db)
+    try:
+        token = _bearer_token(request)
+        if not token:
+            user_state = getattr(request.state, "user", None)
+            if isinstance(user_state, LazyUserState):
+                return await user_state.resolve_async(db)
+            token = request.cookies.get("access_token")
         
-        if not username:
+        if not token:
             return None
         
-        # Получаем пользователя из базы
-        user = get_user_by_username(db, username=username)
-        return user
+        return await resolve_principal_async(token, db)
         
-    except HTTPException:
-        # Если токен невалиден, возвращаем None
-        return None
     except Exception as e:
         print(f"⚠️  Ошибка при получении пользователя: {e}")
         return None
 
-def get_current_active_user(current_user: Optional[User] = Depends(get_current_user)) -> User:
-    """Получаем активного пользователя"""
+def _require_active(current_user: Optional[Principal]) -> Principal:
     if not current_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -63,8 +87,18 @@ def get_current_active_user(current_user: Optional[User] = Depends(get_current_u
     
     return current_user
 
+def get_current_active_user(current_user: Optional[Principal] = Depends(get_current_user)) -> Principal:
+    """Получаем активного пользователя"""
+    return _require_active(current_user)
+
+async def get_current_active_user_async(
+    current_user: Optional[Principal] = Depends(get_current_user_async)
+) -> Principal:
+    """Активный пользователь для async-обработчиков"""
+    return _require_active(current_user)
+
 @router.get("/me")
-def read_users_me(current_user: User = Depends(get_current_active_user)):
+def read_users_me(current_user: Principal = Depends(get_current_active_user)):
     """Получить информацию о текущем пользователе"""
     return {
         "id": current_user.id,
@@ -77,18 +111,26 @@ def read_users_me(current_user: User = Depends(get_current_active_user)):
         "created_at": current_user.created_at,
     }
 
+def _find_login_user(db: Session, login: str) -> Optional[UserModel]:
+    # Получаем пользователя по email или username
+    return get_user_by_username(db, login) or get_user_by_email(db, login)
+
+
+def _store_password_hash(db: Session, user: UserModel, hashed_password: str) -> None:
+    user.hashed_password = hashed_password
+    db.commit()
+
+
 @router.post("/login", response_model=Token)
-def login(
+async def login(
     user_login: UserLogin, 
     db: Session = Depends(get_db),
     response: Response = None
 ):
     """Вход в систему"""
     try:
-        # Получаем пользователя по email или username
-        user = get_user_by_username(db, user_login.username)
-        if not user:
-            user = get_user_by_email(db, user_login.username)
+        # Запросы к БД выполняем в пуле потоков, KDF — в отдельном пуле хеширования
+        user = await run_in_threadpool(_find_login_user, db, user_login.username)
         
         if not user:
             raise HTTPException(
@@ -96,8 +138,7 @@ def login(
                 detail="Неверное имя пользователя или пароль"
             )
         
-        # Проверяем пароль - ИСПРАВЛЕНО: используем hashed_password вместо password_hash
-        if not verify_password(user_login.password, user.hashed_password):  # <-- ИСПРАВЛЕНО
+        if not await password_hasher.verify(user_login.password, user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Неверное имя пользователя или пароль"
@@ -109,10 +150,19 @@ def login(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Пользователь неактивен"
             )
+
+        # Claims собираем до commit: после него атрибуты user истекают,
+        # и их чтение стало бы блокирующим SELECT в event loop
+        claims = token_claims(user)
+
+        # Прозрачно переводим старые хеши на текущий алгоритм и число итераций
+        if password_needs_rehash(user.hashed_password):
+            new_hash = await password_hasher.hash(user_login.password)
+            await run_in_threadpool(_store_password_hash, db, user, new_hash)
         
         # Создаем токен
         access_token = create_access_token(
-            data={"sub": user.username}
+            data=claims
         )
         
         # Устанавливаем токен в cookie
@@ -148,17 +198,7 @@ def logout(response: Response):
     response.delete_cookie(key="access_token", path="/")
     return {"message": "Успешно вышли из системы"}
 
-@router.post("/register", response_model=User)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    """Регистрация нового пользователя"""
-    # Проверяем email
-    if '@' not in user.email:
-        raise HTTPException(
-            status_code=400,
-            detail="Неверный формат email"
-        )
-    
-    # Проверяем существование пользователя
+def _check_registration(db: Session, user: UserCreate) -> None:
     db_user = get_user_by_username(db, user.username)
     if db_user:
         raise HTTPException(
@@ -172,6 +212,20 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
             status_code=400,
             detail="Email уже зарегистрирован"
         )
+
+@router.post("/register", response_model=User)
+async def register(user: UserCreate, db: Session = Depends(get_db)):
+    """Регистрация нового пользователя"""
+    # Проверяем email
+    if '@' not in user.email:
+        raise HTTPException(
+            status_code=400,
+            detail="Неверный формат email"
+        )
+    
+    # Проверяем существование пользователя до дорогого хеширования
+    await run_in_threadpool(_check_registration, db, user)
     
-    # Создаем пользователя
-    return create_user(db, user)
+    # Создаем пользователя: KDF — в пуле хеширования, запись — в пуле потоков
+    hashed_password = await password_hasher.hash(user.password)
+    return await run_in_threadpool(create_user, db, user, hashed_password)
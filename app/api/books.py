@@ -1,17 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from app.models import get_db
-from app.schemas.book import Book, BookCreate, BookUpdate, BookSearch, Review, ReviewCreate, Category, Author
+from typing import List, Optional, Union
+from app.models import get_db, get_read_db, run_read
+from app.schemas.book import Book, BookCreate, BookUpdate, BookSearch, BookSearchResult, Review, ReviewCreate, Category, Author
 from app.services.book import (
-    get_book, get_books, search_books, create_book, update_book, delete_book,
-    get_categories, get_authors, create_review, get_book_reviews
+    get_book, get_books, search_books, get_search_facets,
+    get_book_async, get_books_async, search_books_async, get_search_facets_async,
+    create_book, update_book, delete_book, get_categories, get_authors, create_review,
+    get_book_reviews, next_cursor, get_book_file_path
 )
-from app.api.auth import get_current_active_user
+from app.core.acl import Permission, check_permission, require_staff
+from app.core.files import RangeFileResponse
+from app.core.response_cache import catalog_cache
+from app.schemas.user import Principal
+from app.services.counters import book_counters
+from app.services.system_counters import get_system_counters, get_system_counters_async
 
 router = APIRouter(tags=["books"])
 
+
+def _set_next_cursor(response: Response, cursor: Optional[str]) -> None:
+    """Курсор следующей страницы отдаём в заголовке, чтобы не менять формат ответа."""
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+
 # ==============================================================================
 # 1. СТАТИЧЕСКИЕ МАРШРУТЫ БЕЗ PATH-ПАРАМЕТРОВ (ВЫСШИЙ ПРИОРИТЕТ)
 # Эти маршруты должны идти перед любыми маршрутами типа /{id}
@@ -19,33 +32,47 @@ router = APIRouter(tags=["books"])
 
 @router.get("/categories", response_model=List[Category])
 @router.get("/categories/", response_model=List[Category])
-def get_categories_endpoint(db: Session = Depends(get_db)):
+def get_categories_endpoint(request: Request, db: Session = Depends(get_db)):
     """Получить список всех категорий."""
-    return get_categories(db)
+    return catalog_cache.respond(request, db, get_categories, List[Category])
 
 
 @router.get("/authors", response_model=List[Author])
 @router.get("/authors/", response_model=List[Author])
-def get_authors_endpoint(db: Session = Depends(get_db)):
+def get_authors_endpoint(request: Request, db: Session = Depends(get_db)):
     """Получить список всех авторов."""
-    return get_authors(db)
+    return catalog_cache.respond(request, db, get_authors, List[Author])
+
 
+# Горячие публичные маршруты чтения работают на сессии из get_read_db:
+# AsyncSession при settings.async_db_routes (не занимает пул потоков на время
+# запросов к БД) или Session, запросы которой уходят в пул потоков
 
 @router.get("", response_model=List[Book])
 @router.get("/", response_model=List[Book])
-def read_books(
+async def read_books(
+    request: Request,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     sort: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor"),
+    db=Depends(get_read_db)
 ):
     """Получить список книг (корневой маршрут)."""
     # Public endpoint, no authentication required
-    return get_books(db, skip=skip, limit=limit, sort=sort)
+    return await catalog_cache.respond_async(
+        request,
+        db,
+        lambda session: run_read(
+            session, get_books, get_books_async, skip=skip, limit=limit, sort=sort, cursor=cursor
+        ),
+        List[Book],
+        headers=lambda books: {"X-Next-Cursor": next_cursor(books, limit, sort)},
+    )
 
 
-@router.get("/search", response_model=List[Book])
-def search_books_endpoint(
+@router.get("/search", response_model=Union[List[Book], BookSearchResult])
+async def search_books_endpoint(
     query: str = Query("", min_length=0),  # Измените на пустую строку по умолчанию
     category_id: Optional[int] = Query(None),
     author_id: Optional[int] = Query(None),
@@ -54,7 +81,11 @@ def search_books_endpoint(
     year_max: Optional[int] = Query(None),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor"),
+    facets: bool = Query(False, description="Вернуть {items, facets} со счётчиками для фильтров"),
+    facet_limit: Optional[int] = Query(None, ge=1, description="Не больше N самых частых значений в каждом фасете; по умолчанию все"),
+    response: Response = None,
+    db=Depends(get_read_db)
 ):
     """Поиск книг по различным параметрам."""
     search_params = BookSearch(
@@ -65,34 +96,77 @@ def search_books_endpoint(
         year_min=year_min,
         year_max=year_max
     )
-    return search_books(db, search_params, skip=skip, limit=limit)
+    books = await run_read(db, search_books, search_books_async, search_params, skip=skip, limit=limit, cursor=cursor)
+    # Результаты текстового поиска упорядочены по релевантности и листаются через skip
+    if not query:
+        _set_next_cursor(response, next_cursor(books, limit, "newest"))
+    if facets:
+        found_facets = await run_read(db, get_search_facets, get_search_facets_async, search_params, limit=facet_limit)
+        return {"items": books, "facets": found_facets}
+    return books
 
 @router.get("/stats")
-def get_books_stats(db: Session = Depends(get_db)):
+async def get_books_stats(request: Request, db=Depends(get_read_db)):
     """Получить статистику по книгам"""
-    from app.models.book import Book, Author, Category
-    
-    total_books = db.query(Book).filter(Book.is_active == True).count()
-    total_authors = db.query(Author).count()
-    total_categories = db.query(Category).filter(Category.is_active == True).count()
-    
-    return {
-        "total_books": total_books,
-        "total_authors": total_authors,
-        "total_categories": total_categories
-    }
+    async def build(session):
+        counters = await run_read(session, get_system_counters, get_system_counters_async)
+        return {
+            "total_books": counters["books"],
+            "total_authors": counters["authors"],
+            "total_categories": counters["categories"]
+        }
+
+    return await catalog_cache.respond_async(request, db, build)
 
 # ==============================================================================
 # 2. ДИНАМИЧЕСКИЕ МАРШРУТЫ С PATH-ПАРАМЕТРАМИ (НИЗШИЙ ПРИОРИТЕТ)
 # ==============================================================================
 
 @router.get("/{book_id}", response_model=Book)
-def read_book(book_id: int, db: Session = Depends(get_db)):
+async def read_book(book_id: int, request: Request, db=Depends(get_read_db)):
     """Получить книгу по ID."""
+    async def build(session):
+        book = await run_read(session, get_book, get_book_async, book_id)
+        if book is None:
+            raise HTTPException(status_code=404, detail="Book not found")
+        return book
+
+    return await catalog_cache.respond_async(request, db, build, Book)
+
+
+@router.api_route("/{book_id}/download", methods=["GET", "HEAD"])
+def download_book(
+    book_id: int,
+    request: Request,
+    attachment: bool = Query(False, description="Отдать как вложение, а не для просмотра в браузере"),
+    db: Session = Depends(get_db)
+):
+    """Скачать файл книги с поддержкой Range и условных запросов.
+
+    Скачиванием считается только запрос с attachment=true (кнопка
+    «Скачать»): читалка загружает тот же файл без него.
+    """
     book = get_book(db, book_id)
     if book is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    return book
+    if not book.file_url:
+        raise HTTPException(status_code=404, detail="Файл книги не загружен")
+
+    # Внешние ссылки отдаём редиректом, но скачивание всё равно считаем
+    if book.file_url.startswith(("http://", "https://")):
+        if request.method == "GET" and attachment:
+            book_counters.add(book.id, "download_count")
+        return RedirectResponse(book.file_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+    path = get_book_file_path(book)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Файл книги не найден")
+
+    filename = f"{book.title}{path.suffix}"
+    response = RangeFileResponse(path, request.headers, filename=filename, attachment=attachment)
+    if request.method == "GET" and attachment and response.is_initial_request:
+        book_counters.add(book.id, "download_count")
+    return response
 
 
 # В функции create_review_endpoint добавьте логирование:
@@ -101,7 +175,7 @@ def create_review_endpoint(
     book_id: int,
     review: ReviewCreate,
     db: Session = Depends(get_db),
-    current_user = Depends(get_current_active_user)
+    current_user: Principal = Depends(check_permission(Permission.WRITE_REVIEWS))
 ):
     """Создать рецензию для книги"""
     print(f"📝 Начало создания рецензии для книги {book_id}")
@@ -156,19 +230,12 @@ def create_review_endpoint(
             is_approved=True
         )
         
+        # Рейтинг книги и распределение оценок обновляются в той же
+        # транзакции при flush (app/services/ratings.py)
         db.add(db_review)
         db.commit()
         db.refresh(db_review)
-
-        # После создания рецензии пересчитаем средний рейтинг книги,
-        # чтобы он корректно отображался в каталоге и других списках
-        avg_rating = db.query(func.avg(Review.rating)).filter(
-            Review.book_id == book_id,
-            Review.is_approved == True
-        ).scalar()
-
-        book.rating = avg_rating or 0.0
-        db.commit()
+        catalog_cache.bump()
         
         print(f"✅ Рецензия создана успешно: ID {db_review.id}")
         
@@ -215,16 +282,9 @@ def get_book_reviews_endpoint(
 def create_book_endpoint(
     book: BookCreate,
     db: Session = Depends(get_db),
-    current_user = Depends(get_current_active_user)  # Простая проверка авторизации
+    current_user: Principal = Depends(require_staff)
 ):
     """Создать новую книгу (требуется авторизация и права администратора/библиотекаря)"""
-    # Проверяем права через роль пользователя
-    if not current_user or current_user.role not in ["admin", "librarian"]:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Требуются права администратора или библиотекаря"
-        )
-    
     return create_book(db, book)
 
 @router.put("/{book_id}", response_model=Book)
@@ -232,15 +292,9 @@ def update_book_endpoint(
     book_id: int,
     book: BookUpdate,
     db: Session = Depends(get_db),
-    current_user = Depends(get_current_active_user)
+    current_user: Principal = Depends(require_staff)
 ):
     """Обновить существующую книгу"""
-    if not current_user or current_user.role not in ["admin", "librarian"]:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Требуются права администратора или библиотекаря"
-        )
-    
     updated_book = update_book(db, book_id, book)
     if updated_book is None:
         raise HTTPException(status_code=404, detail="Book not found")
@@ -250,15 +304,11 @@ def update_book_endpoint(
 def delete_book_endpoint(
     book_id: int,
     db: Session = Depends(get_db),
-    current_user = Depends(get_current_active_user)
+    current_user: Principal = Depends(check_permission(
+        Permission.DELETE_BOOKS, detail="Требуются права администратора"
+    ))
 ):
     """Удалить книгу"""
-    if not current_user or current_user.role != "admin":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Требуются права администратора"
-        )
-    
     if not delete_book(db, book_id):
         raise HTTPException(status_code=404, detail="Book not found")
     return {"message": "Book deleted successfully"}
@@ -1,16 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from pydantic import BaseModel
-from app.models import get_db
-from app.schemas.user import User, UserUpdate
+from pydantic import BaseModel, Field
+from app.models import get_db, get_read_db, run_read
+from app.api.auth import get_current_active_user, get_current_active_user_async
+from app.core.acl import Permission, has_permission, require_admin
+from app.schemas.user import User, UserUpdate, Principal
 from app.schemas.book import Book
 from app.services.auth import get_user_by_username, get_users
-from app.services.book import get_book
+from app.services.book import get_book, get_existing_book_ids, get_user_favorites, add_favorite, remove_favorite
+from app.services.principal import invalidate_principal
+from app.services.progress import progress_buffer
 from app.services.user_stats import (
     get_user_reading_stats,
     get_user_reading_sessions,
-    update_reading_progress,
+    count_user_reading_sessions,
+    get_active_reading_session,
+    get_user_reading_stats_async,
+    get_user_reading_sessions_async,
+    count_user_reading_sessions_async,
+    get_active_reading_session_async,
+    session_progress,
 )
 
 router = APIRouter(tags=["users"])
@@ -18,202 +28,177 @@ router = APIRouter(tags=["users"])
 
 class ReadingProgress(BaseModel):
     progress_percentage: int
-    pages_read: Optional[int] = None
+    pages_read: Optional[int] = Field(None, ge=0, le=100_000)
     is_completed: Optional[bool] = None
 
-# Простая проверка аутентификации через request.state.user
-def get_current_user_from_request(request: Request):
-    """Получить текущего пользователя из request.state.user"""
-    user = request.state.user
-    if not user or not user.get("is_authenticated"):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Не авторизован"
-        )
-    return user
 
-# Проверка активного пользователя
-def get_current_active_user(request: Request):
-    """Получить текущего активного пользователя"""
-    user = get_current_user_from_request(request)
-    
-    # Здесь можно добавить проверку is_active, если есть в данных
-    # if not user.get("is_active", True):
-    #     raise HTTPException(status_code=400, detail="Пользователь неактивен")
-    
-    return user
+class BookReadingProgress(ReadingProgress):
+    book_id: int
+
+
+class ReadingProgressBatch(BaseModel):
+    items: List[BookReadingProgress] = Field(..., min_length=1, max_length=100)
+
+# Чтение /me/* — на сессии из get_read_db (см. горячие маршруты в books.py)
 
 @router.get("/me/stats")
-def get_my_stats(
-    request: Request,
-    db: Session = Depends(get_db)
+async def get_my_stats(
+    current_user: Principal = Depends(get_current_active_user_async),
+    db=Depends(get_read_db)
 ):
     """Получить статистику чтения текущего пользователя"""
-    user = get_current_active_user(request)
-    
-    # Получаем объект пользователя из базы
-    user_obj = get_user_by_username(db, user.get("username"))
-    if not user_obj:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-    
-    return get_user_reading_stats(db, user_obj.id)
+    return await run_read(db, get_user_reading_stats, get_user_reading_stats_async, current_user.id)
 
 @router.get("/me/reading-sessions")
-def get_my_reading_sessions(
-    request: Request,
+async def get_my_reading_sessions(
     active: bool = Query(False, description="Только активные сессии"),
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_active_user_async),
+    db=Depends(get_read_db)
 ):
     """Получить сессии чтения текущего пользователя"""
-    user = get_current_active_user(request)
-    
-    # Получаем объект пользователя из базы
-    user_obj = get_user_by_username(db, user.get("username"))
-    if not user_obj:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-    
-    sessions = get_user_reading_sessions(db, user_obj.id, active_only=active)
-    
-    # Применяем пагинацию
-    paginated_sessions = sessions[skip:skip + limit]
+    sessions = await run_read(
+        db, get_user_reading_sessions, get_user_reading_sessions_async,
+        current_user.id, active_only=active, skip=skip, limit=limit,
+    )
+    pending = progress_buffer.pending_for_user(current_user.id)
+    for session in sessions:
+        progress_buffer.overlay(session, pending.get(session["book"]["id"]))
     
     return {
-        "sessions": paginated_sessions,
-        "total": len(sessions),
+        "sessions": sessions,
+        "total": await run_read(
+            db, count_user_reading_sessions, count_user_reading_sessions_async, current_user.id, active_only=active
+        ),
         "skip": skip,
         "limit": limit
     }
 
 
+@router.get("/me/reading-sessions/{book_id}")
+async def get_my_reading_session(
+    book_id: int,
+    current_user: Principal = Depends(get_current_active_user_async),
+    db=Depends(get_read_db),
+):
+    """Активная сессия чтения книги текущего пользователя."""
+    session = await run_read(db, get_active_reading_session, get_active_reading_session_async, current_user.id, book_id)
+    pending = progress_buffer.pending(current_user.id, book_id)
+    if not session and not pending:
+        raise HTTPException(status_code=404, detail="Сессия чтения не найдена")
+    if session:
+        progress = session_progress(session)
+    else:
+        progress = {"id": None, "book_id": book_id, "progress_percentage": 0, "pages_read": 0, "is_completed": False}
+    return progress_buffer.overlay(progress, pending)
+
+
 @router.post("/me/reading-sessions/{book_id}/progress")
 def update_my_reading_progress(
     book_id: int,
     data: ReadingProgress,
-    request: Request,
+    current_user: Principal = Depends(get_current_active_user),
     db: Session = Depends(get_db),
 ):
     """Обновить прогресс чтения книги для текущего пользователя."""
-    user = get_current_active_user(request)
-
-    user_obj = get_user_by_username(db, user.get("username"))
-    if not user_obj:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-
     book = get_book(db, book_id)
     if not book:
         raise HTTPException(status_code=404, detail="Книга не найдена")
 
-    session = update_reading_progress(
+    return progress_buffer.save(
         db,
-        user_obj.id,
+        current_user.id,
         book_id,
         data.progress_percentage,
         pages_read=data.pages_read,
         is_completed=data.is_completed,
     )
 
+
+@router.post("/me/reading-sessions/progress")
+def update_my_reading_progress_batch(
+    data: ReadingProgressBatch,
+    current_user: Principal = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+):
+    """Сохранить прогресс чтения сразу нескольких книг."""
+    book_ids = {item.book_id for item in data.items}
+    missing_ids = sorted(book_ids - get_existing_book_ids(db, book_ids))
+    if missing_ids:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Книги не найдены: {', '.join(map(str, missing_ids))}",
+        )
+
     return {
-        "id": session.id,
-        "book_id": session.book_id,
-        "progress_percentage": session.progress_percentage,
-        "pages_read": session.pages_read,
-        "is_completed": session.is_completed,
+        "sessions": [
+            progress_buffer.save(
+                db,
+                current_user.id,
+                item.book_id,
+                item.progress_percentage,
+                pages_read=item.pages_read,
+                is_completed=item.is_completed,
+            )
+            for item in data.items
+        ]
     }
 
-@router.get("/", response_model=List[User])
+@router.get("/", response_model=List[User], dependencies=[Depends(require_admin)])
 def read_users(
-    request: Request,
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db)
 ):
     """Получить список всех пользователей (админ)"""
-    user = get_current_active_user(request)
-    
-    if user.get("role") != "admin":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Требуются права администратора"
-        )
-    
     return get_users(db, skip=skip, limit=limit)
 
 
 @router.get("/me/favorites", response_model=List[Book])
 def get_my_favorites(
-    request: Request,
+    current_user: Principal = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Получить избранные книги текущего пользователя"""
-    user = get_current_active_user(request)
-
-    user_obj = get_user_by_username(db, user.get("username"))
-    if not user_obj:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-
-    # user_obj.favorites уже содержит связанные книги
-    return user_obj.favorites
+    return get_user_favorites(db, current_user.id)
 
 
 @router.post("/me/favorites/{book_id}", response_model=Book)
 def add_favorite_book(
     book_id: int,
-    request: Request,
+    current_user: Principal = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Добавить книгу в избранное текущего пользователя"""
-    user = get_current_active_user(request)
-
-    user_obj = get_user_by_username(db, user.get("username"))
-    if not user_obj:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-
     book = get_book(db, book_id)
     if not book:
         raise HTTPException(status_code=404, detail="Книга не найдена")
 
-    if book not in user_obj.favorites:
-        user_obj.favorites.append(book)
-        db.commit()
-        db.refresh(user_obj)
-
+    add_favorite(db, current_user.id, book_id)
     return book
 
 
 @router.delete("/me/favorites/{book_id}")
 def remove_favorite_book(
     book_id: int,
-    request: Request,
+    current_user: Principal = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Удалить книгу из избранного текущего пользователя"""
-    user = get_current_active_user(request)
-
-    user_obj = get_user_by_username(db, user.get("username"))
-    if not user_obj:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-
-    # Удаляем книгу из списка избранного, если она там есть
-    user_obj.favorites = [b for b in user_obj.favorites if b.id != book_id]
-    db.commit()
-    db.refresh(user_obj)
-
+    remove_favorite(db, current_user.id, book_id)
     return {"detail": "Книга удалена из избранного"}
 
 @router.get("/{username}", response_model=User)
 def read_user(
     username: str,
-    request: Request,
+    current_user: Principal = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Получить профиль пользователя"""
-    current_user = get_current_active_user(request)
-    
     # Проверяем права
-    is_self = current_user.get("username") == username
-    has_read_other_perm = current_user.get("role") in ["admin", "librarian"]
+    is_self = current_user.username == username
+    has_read_other_perm = has_permission(current_user, Permission.EDIT_BOOKS)
     
     if not is_self and not has_read_other_perm:
         raise HTTPException(
@@ -231,14 +216,12 @@ def read_user(
 def update_user(
     username: str,
     user_update: UserUpdate,
-    request: Request,
+    current_user: Principal = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Обновить профиль пользователя"""
-    current_user = get_current_active_user(request)
-    
-    is_self = current_user.get("username") == username
-    has_edit_perm = current_user.get("role") == "admin"
+    is_self = current_user.username == username
+    has_edit_perm = has_permission(current_user, Permission.MANAGE_USERS)
     
     # 1. Проверяем права на обновление
     if not is_self and not has_edit_perm:
@@ -260,7 +243,7 @@ def update_user(
             )
         
         # Предотвращаем изменение своей собственной роли
-        if is_self and user_update.role != current_user.get("role"):
+        if is_self and user_update.role != current_user.role:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Администраторы не могут изменять свою собственную роль"
@@ -274,5 +257,6 @@ def update_user(
     
     db.commit()
     db.refresh(user_obj)
+    invalidate_principal(user_obj.id, username)
     
     return user_obj
\ No newline at end of file
@@ -2,7 +2,7 @@ from enum import Enum
 from typing import List, Optional
 from fastapi import Depends, HTTPException, status
 from app.api.auth import get_current_active_user
-from app.schemas.user import User
+from app.schemas.user import Principal
 
 # Определяем роли
 class Role(str, Enum):
@@ -56,29 +56,38 @@ ROLE_PERMISSIONS = {
     ],
 }
 
-def get_user_permissions(user: Optional[User]) -> List[Permission]:
+# Битовые маски, вычисляемые один раз при импорте:
+# проверка разрешения сводится к одному битовому И без обращения к БД
+PERMISSION_BITS = {permission: 1 << index for index, permission in enumerate(Permission)}
+
+ROLE_MASKS = {
+    role.value: sum(PERMISSION_BITS[permission] for permission in permissions)
+    for role, permissions in ROLE_PERMISSIONS.items()
+}
+
+
+def get_role_mask(role: Optional[str]) -> int:
+    """Маска разрешений роли; неизвестная роль получает права гостя"""
+    return ROLE_MASKS.get(role or Role.GUEST.value, ROLE_MASKS[Role.GUEST.value])
+
+
+def get_user_permissions(user: Optional[Principal]) -> List[Permission]:
     """Получает список разрешений пользователя"""
-    if not user:
-        # Если пользователь не авторизован, возвращаем разрешения гостя
-        return ROLE_PERMISSIONS[Role.GUEST]
-    
-    try:
-        role = Role(user.role) if user.role else Role.GUEST
-        return ROLE_PERMISSIONS.get(role, ROLE_PERMISSIONS[Role.GUEST])
-    except (ValueError, AttributeError):
-        # Если роль неизвестна, возвращаем разрешения гостя
-        return ROLE_PERMISSIONS[Role.GUEST]
+    mask = get_role_mask(user.role if user else None)
+    return [permission for permission, bit in PERMISSION_BITS.items() if mask & bit]
 
-def has_permission(user: Optional[User], permission: Permission) -> bool:
+def has_permission(user: Optional[Principal], permission: Permission) -> bool:
     """Проверяет, есть ли у пользователя указанное разрешение"""
-    user_permissions = get_user_permissions(user)
-    return permission in user_permissions
+    return bool(get_role_mask(user.role if user else None) & PERMISSION_BITS[permission])
 
-def check_permission(permission: Permission):
+def check_permission(permission: Permission, detail: Optional[str] = None):
     """Dependency для проверки разрешений с улучшенной обработкой ошибок"""
+    bit = PERMISSION_BITS[permission]
+    forbidden_detail = detail or f"Недостаточно прав. Требуется разрешение: {permission.value}"
+
     async def permission_checker(
-        current_user: Optional[User] = Depends(get_current_active_user)
-    ) -> User:
+        current_user: Optional[Principal] = Depends(get_current_active_user)
+    ) -> Principal:
         # Если пользователь не найден, вызываем исключение
         if not current_user:
             raise HTTPException(
@@ -87,12 +96,23 @@ def check_permission(permission: Permission):
             )
         
         # Проверяем разрешение
-        if not has_permission(current_user, permission):
+        if not get_role_mask(current_user.role) & bit:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"Недостаточно прав. Требуется разрешение: {permission.value}"
+                detail=forbidden_detail
             )
         
         return current_user
     
-    return permission_checker
\ No newline at end of file
+    return permission_checker
+
+
+# Готовые проверки для роутеров
+require_admin = check_permission(
+    Permission.MANAGE_USERS,
+    detail="Требуются права администратора",
+)
+require_staff = check_permission(
+    Permission.EDIT_BOOKS,
+    detail="Требуются права администратора или библиотекаря",
+)
@@ -0,0 +1,371 @@
+import json
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from uuid import uuid4
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+class TTLCache:
+    """Ограниченный LRU-кэш в памяти процесса с временем жизни записей.
+
+    Потокобезопасен: синхронные эндпоинты FastAPI выполняются в пуле потоков.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Удаляет все записи, для которых predicate(key, value) истинно."""
+        with self._lock:
+            stale = [key for key, (_, value) in self._data.items() if predicate(key, value)]
+            for key in stale:
+                del self._data[key]
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+try:
+    import redis
+except ImportError:  # Redis нужен только при заданном REDIS_URL
+    redis = None
+
+INVALIDATION_CHANNEL = "library:cache-invalidation"
+
+# Как часто повторять подключение к L2 после ошибки
+_ATTACH_RETRY_SECONDS = 30.0
+
+# Не чаще раза в столько секунд ошибка L2 пишется в лог (метрика — на каждую)
+_ERROR_LOG_INTERVAL = 30.0
+
+_MISSING = object()
+
+
+class InMemoryBackend:
+    """L2 и pub/sub в памяти процесса: замена Redis для тестов и разработки."""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, bytes]] = {}
+        self._subscribers: List[Callable[[dict], None]] = []
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (monotonic() + ttl, value)
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            _, value = self._data.get(key, (0.0, b"0"))
+            value = int(value) + 1
+            self._data[key] = (float("inf"), str(value).encode())
+            return value
+
+    def publish(self, message: dict) -> None:
+        payload = json.dumps(message)
+        for callback in list(self._subscribers):
+            callback(json.loads(payload))
+
+    def subscribe(self, callback: Callable[[dict], None]) -> None:
+        with self._lock:
+            self._subscribers.append(callback)
+
+
+class RedisBackend:
+    """L2 в Redis; сообщения об инвалидации слушает фоновый поток redis-py."""
+
+    def __init__(
+        self,
+        url: str,
+        channel: str = INVALIDATION_CHANNEL,
+        socket_timeout: Optional[float] = None,
+        connect_timeout: Optional[float] = None,
+    ):
+        if redis is None:
+            raise RuntimeError("Для REDIS_URL требуется пакет redis")
+        # Без таймаутов зависший (а не отказавший) Redis блокирует каждое обращение к кэшу
+        self._client = redis.Redis.from_url(
+            url, socket_timeout=socket_timeout, socket_connect_timeout=connect_timeout
+        )
+        self._channel = channel
+        self._subscribers: List[Callable[[dict], None]] = []
+        self._listener = None
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self._client.delete(*keys)
+
+    def incr(self, key: str) -> int:
+        return int(self._client.incr(key))
+
+    def publish(self, message: dict) -> None:
+        self._client.publish(self._channel, json.dumps(message))
+
+    def subscribe(self, callback: Callable[[dict], None]) -> None:
+        with self._lock:
+            if self._listener is None:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self._channel: self._dispatch})
+                self._listener = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+            self._subscribers.append(callback)
+
+    def _dispatch(self, message: dict) -> None:
+        payload = json.loads(message["data"])
+        for callback in list(self._subscribers):
+            callback(payload)
+
+    def close(self) -> None:
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.stop()
+
+
+_backend = None
+_backend_lock = Lock()
+
+
+def cache_backend():
+    """Общий L2 процесса: Redis при заданном REDIS_URL, иначе память процесса."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if settings.redis_url:
+                _backend = RedisBackend(
+                    settings.redis_url,
+                    socket_timeout=settings.redis_socket_timeout,
+                    connect_timeout=settings.redis_connect_timeout,
+                )
+            else:
+                _backend = InMemoryBackend()
+        return _backend
+
+
+def _encode_key(key: Hashable) -> str:
+    return json.dumps(key, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+class TwoTierCache:
+    """Двухуровневый кэш: LRU в каждом воркере (L1) и общий L2.
+
+    При delete/clear воркер рассылает сообщение об инвалидации, и остальные
+    воркеры выбрасывают записи из своего L1. clear() не перебирает ключи L2:
+    он увеличивает поколение пространства имён, и старые записи перестают
+    находиться. Ошибки L2 не ломают запрос — кэш продолжает работать на L1.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        maxsize: int,
+        ttl: float,
+        backend=None,
+        dumps: Callable[[Any], bytes] = _json_dumps,
+        loads: Callable[[bytes], Any] = json.loads,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._backend = backend
+        self._dumps = dumps
+        self._loads = loads
+        self._origin = uuid4().hex
+        self._generation = 0
+        self._attached = False
+        self._next_attach = 0.0
+        self._next_error_log = 0.0
+        self._suppressed_errors = 0
+        self._lock = Lock()
+        # Отдельная блокировка: _l2_failed вызывается и под self._lock
+        self._log_lock = Lock()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def _l2(self):
+        """L2 с подпиской на инвалидации; подключается лениво при первом обращении."""
+        if self._attached:
+            return self._backend
+        with self._lock:
+            if not self._attached and monotonic() >= self._next_attach:
+                try:
+                    if self._backend is None:
+                        self._backend = cache_backend()
+                    generation = self._backend.get(self._generation_key())
+                    self._backend.subscribe(self._on_message)
+                    self._generation = max(self._generation, int(generation or 0))
+                    self._attached = True
+                except Exception as e:
+                    self._next_attach = monotonic() + _ATTACH_RETRY_SECONDS
+                    self._l2_failed("подключение", e)
+        return self._backend if self._attached else None
+
+    def _l2_failed(self, operation: str, error: Exception) -> None:
+        metrics.increment(f"cache.{self.namespace}.l2_errors")
+        # При недоступном L2 ошибка случается на каждом запросе: лог не чаще _ERROR_LOG_INTERVAL
+        now = monotonic()
+        with self._log_lock:
+            if now < self._next_error_log:
+                self._suppressed_errors += 1
+                return
+            suppressed, self._suppressed_errors = self._suppressed_errors, 0
+            self._next_error_log = now + _ERROR_LOG_INTERVAL
+        note = f" (ещё {suppressed} ошибок с прошлого сообщения)" if suppressed else ""
+        print(f"⚠️ Кэш {self.namespace}: ошибка L2 ({operation}): {error}{note}")
+
+    def _generation_key(self) -> str:
+        return f"{self.namespace}:generation"
+
+    def _remote_key(self, key: str) -> str:
+        return f"{self.namespace}:{self._generation}:{key}"
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        local_key = _encode_key(key)
+        value = self._local.get(local_key, _MISSING)
+        if value is not _MISSING:
+            metrics.increment(f"cache.{self.namespace}.l1_hits")
+            return value
+
+        backend = self._l2()
+        if backend is not None:
+            try:
+                raw = backend.get(self._remote_key(local_key))
+            except Exception as e:
+                self._l2_failed("чтение", e)
+                raw = None
+            if raw is not None:
+                value = self._loads(raw)
+                self._local.set(local_key, value)
+                metrics.increment(f"cache.{self.namespace}.l2_hits")
+                return value
+
+        metrics.increment(f"cache.{self.namespace}.misses")
+        return default
+
+    def get_local(self, key: Hashable, default: Any = None) -> Any:
+        """Только L1: без сетевых обращений, можно вызывать из цикла событий."""
+        value = self._local.get(_encode_key(key), _MISSING)
+        if value is _MISSING:
+            return default
+        metrics.increment(f"cache.{self.namespace}.l1_hits")
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, generation: Optional[int] = None) -> None:
+        """Сохраняет значение; с generation запись пропускается, если кэш успели очистить."""
+        if generation is not None and generation != self._generation:
+            return
+        local_key = _encode_key(key)
+        ttl = self.ttl if ttl is None else ttl
+        self._local.set(local_key, value, ttl=ttl)
+        backend = self._l2()
+        if backend is not None:
+            try:
+                backend.set(self._remote_key(local_key), self._dumps(value), ttl)
+            except Exception as e:
+                self._l2_failed("запись", e)
+
+    def delete(self, *keys: Hashable) -> None:
+        local_keys = [_encode_key(key) for key in keys]
+        for local_key in local_keys:
+            self._local.delete(local_key)
+        backend = self._l2()
+        if backend is not None:
+            try:
+                backend.delete(*(self._remote_key(local_key) for local_key in local_keys))
+                backend.publish({"ns": self.namespace, "origin": self._origin, "op": "delete", "keys": local_keys})
+            except Exception as e:
+                self._l2_failed("удаление", e)
+
+    def clear(self) -> None:
+        self._local.clear()
+        backend = self._l2()
+        if backend is None:
+            self._generation += 1
+            return
+        try:
+            self._generation = backend.incr(self._generation_key())
+            backend.publish({
+                "ns": self.namespace,
+                "origin": self._origin,
+                "op": "clear",
+                "generation": self._generation,
+            })
+        except Exception as e:
+            self._generation += 1
+            self._l2_failed("очистка", e)
+
+    def _on_message(self, message: dict) -> None:
+        if message.get("ns") != self.namespace or message.get("origin") == self._origin:
+            return
+        metrics.increment(f"cache.{self.namespace}.invalidations_received")
+        if message.get("op") == "delete":
+            for local_key in message.get("keys", []):
+                self._local.delete(local_key)
+        elif message.get("op") == "clear":
+            self._generation = max(self._generation, int(message.get("generation", 0)))
+            self._local.clear()
+
+    def __len__(self) -> int:
+        return len(self._local)
@@ -1,12 +1,86 @@
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    # Пул соединений каждого engine (синхронного и асинхронного) в воркере:
+    # постоянные соединения, временные сверх них, ожидание свободного
+    # соединения (секунды) и возраст, после которого соединение пересоздаётся
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    # Число воркеров (как у gunicorn/uvicorn) и запас соединений PostgreSQL
+    # для миграций и скриптов — для проверки бюджета max_connections
+    web_concurrency: int = 1
+    db_reserved_connections: int = 10
+    # Адрес для асинхронного engine; по умолчанию DATABASE_URL с драйвером
+    # asyncpg (PostgreSQL) или aiosqlite (SQLite)
+    async_database_url: Optional[str] = None
+    # Горячие маршруты чтения каталога и /api/users/me/* на AsyncSession вместо
+    # Session в пуле потоков; включать после замеров на PostgreSQL с asyncpg
+    async_db_routes: bool = False
     secret_key: str
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
     debug: bool = False
+    # В режиме debug колбэки, занявшие цикл событий дольше порога (секунды), логируются
+    loop_block_threshold: float = 0.1
+
+    # Кэш пользователей (principal): L1 в процессе и общий L2
+    principal_cache_size: int = 10_000
+    principal_cache_ttl: int = 60
+
+    # Кэш проверенных токенов
+    token_cache_size: int = 10_000
+    token_cache_ttl: int = 300
+
+    # Хеширование паролей: число итераций PBKDF2 и ограничения пула
+    password_hash_iterations: int = 600_000
+    password_hash_workers: int = 4
+    password_hash_max_pending: int = 64
+
+    # Поиск по каталогу: "database" (FTS в БД) или "memory" (индекс в памяти процесса)
+    search_backend: str = "database"
+    # Конфигурация полнотекстового поиска PostgreSQL (to_tsvector/to_tsquery)
+    search_language: str = "russian"
+
+    # Общий L2-кэш и канал инвалидации между воркерами; без него — память процесса
+    redis_url: Optional[str] = None
+    # Таймауты Redis (секунды): при зависшем сервере запросы быстрее уходят на L1
+    redis_socket_timeout: float = 0.25
+    redis_connect_timeout: float = 0.5
+
+    # Кэш ответов публичных эндпоинтов каталога (ETag/304)
+    response_cache_size: int = 2048
+    response_cache_ttl: int = 30
+    # После soft TTL запись ещё отдаётся, а свежая версия строится в фоне
+    response_cache_soft_ttl: int = 10
+
+    # Отложенная запись счётчиков просмотров/скачиваний: интервал сброса
+    # и число инкрементов, после которого буфер сбрасывается досрочно
+    counter_flush_interval: float = 5.0
+    counter_max_pending: int = 1000
+
+    # Рейтинг популярности: период полураспада вклада события и интервал
+    # фонового пересчёта по завершённым чтениям и отзывам
+    popularity_half_life_hours: float = 72.0
+    popularity_interval: float = 300.0
+
+    # Буфер прогресса чтения: окно объединения сохранений ползунка, число
+    # пар пользователь-книга, после которого буфер сбрасывается досрочно,
+    # и жёсткий предел буфера, после которого прогресс пишется сразу
+    progress_flush_interval: float = 1.0
+    progress_max_pending: int = 500
+    progress_max_buffered: int = 10_000
+
+    # Интервал пакетной записи дельт system_counters и период их сверки
+    # с реальными COUNT(*), секунды
+    system_counters_flush_interval: float = 1.0
+    system_counters_reconcile_interval: float = 600.0
+    # Период сверки агрегатов рейтинга книг с рецензиями, секунды
+    book_ratings_reconcile_interval: float = 3600.0
 
     model_config = SettingsConfigDict(
         env_file=".env",
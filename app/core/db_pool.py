@@ -0,0 +1,121 @@
+from time import perf_counter
+from sqlalchemy import event, make_url
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+
+def _timed_pool(base: type, name: str) -> type:
+    """Класс пула, который замеряет время ожидания свободного соединения
+    (вместе с открытием нового сверх пула) в db.pool.<name>.checkout_wait."""
+
+    class TimedPool(base):
+        def connect(self):
+            started = perf_counter()
+            try:
+                return super().connect()
+            finally:
+                metrics.observe(f"db.pool.{name}.checkout_wait", perf_counter() - started)
+
+    TimedPool.__name__ = TimedPool.__qualname__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+def pool_kwargs(url: str, name: str, asynchronous: bool = False) -> dict:
+    """Параметры create_engine для пула из настроек.
+
+    Соединения не пингуются при выдаче (pool_pre_ping): это лишний запрос
+    на каждый checkout. Вместо этого они пересоздаются старше pool_recycle,
+    а обрыв, замеченный на запросе, инвалидирует пул (см. instrument_engine).
+    SQLite в памяти живёт в одном соединении — его пул не настраивается.
+    """
+    database_url = make_url(url)
+    if database_url.get_backend_name() == "sqlite" and database_url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        # Для файлового SQLite aiosqlite по умолчанию получил бы NullPool:
+        # новое соединение (и поток) на каждый запрос
+        "poolclass": _timed_pool(AsyncAdaptedQueuePool if asynchronous else QueuePool, name),
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_logging_name": name,
+    }
+
+
+def _report(name: str, in_use: int, overflow: int) -> None:
+    metrics.set_gauge(f"db.pool.{name}.in_use", in_use)
+    metrics.set_gauge(f"db.pool.{name}.overflow", max(overflow, 0))
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """Учёт занятых и сверхлимитных соединений пула и обрывов соединений
+    engine в метриках и логе."""
+    if isinstance(engine.pool, QueuePool):
+        # engine.pool читается в момент события: dispose() заменяет пул новым
+
+        @event.listens_for(engine, "checkout")
+        def on_checkout(dbapi_connection, record, proxy):
+            pool = engine.pool
+            _report(name, pool.checkedout(), pool.overflow())
+
+        @event.listens_for(engine, "checkin")
+        def on_checkin(dbapi_connection, record):
+            # checkin срабатывает до того, как пул учтёт возврат: соединение
+            # ещё числится выданным, а в заполненном пуле сверхлимитное
+            # соединение после возврата закроется
+            pool = engine.pool
+            closes_overflow = pool.checkedin() >= pool.size()
+            _report(name, pool.checkedout() - 1, pool.overflow() - closes_overflow)
+
+    @event.listens_for(engine, "handle_error")
+    def on_error(context):
+        # Оптимистичная обработка обрыва: SQLAlchemy уже инвалидирует это
+        # соединение и все более старые в пуле, следующие запросы
+        # переподключаются; текущий запрос получает ошибку
+        if context.is_disconnect:
+            metrics.increment(f"db.pool.{name}.disconnects")
+            print(f"⚠️ Соединение с БД ({name}) оборвалось, пул переподключится: {context.original_exception}")
+
+
+def pools_per_worker() -> int:
+    """Пулы на каждый воркер: синхронный engine и, если включены
+    async-маршруты чтения, асинхронный (иначе он не создаётся)."""
+    return 2 if settings.async_db_routes else 1
+
+
+def connection_budget() -> int:
+    """Сколько соединений могут открыть все воркеры в худшем случае."""
+    return settings.web_concurrency * pools_per_worker() * (settings.db_pool_size + settings.db_max_overflow)
+
+
+def check_connection_budget(engine: Engine) -> None:
+    """На PostgreSQL проверяет, что воркеры × пулы помещаются в max_connections.
+
+    Запас db_reserved_connections оставляется для миграций, psql, фоновых
+    скриптов и репликации; соединения суперпользователя не учитываются.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+
+    with engine.connect() as connection:
+        max_connections = int(connection.exec_driver_sql("SHOW max_connections").scalar())
+        superuser_reserved = int(connection.exec_driver_sql("SHOW superuser_reserved_connections").scalar())
+
+    available = max_connections - superuser_reserved - settings.db_reserved_connections
+    required = connection_budget()
+    metrics.set_gauge("db.pool.budget_required", required)
+    metrics.set_gauge("db.pool.budget_available", available)
+    if required > available:
+        raise RuntimeError(
+            f"Пулы соединений не помещаются в max_connections={max_connections}: "
+            f"{settings.web_concurrency} воркеров × {pools_per_worker()} пул(а) × "
+            f"({settings.db_pool_size} + {settings.db_max_overflow}) = {required}, "
+            f"доступно {available} (резерв {settings.db_reserved_connections}, "
+            f"суперпользователь {superuser_reserved}). Уменьшите DB_POOL_SIZE, "
+            f"DB_MAX_OVERFLOW или WEB_CONCURRENCY либо увеличьте max_connections."
+        )
+    print(f"✅ Бюджет соединений: {required} из {available} доступных (max_connections={max_connections})")
@@ -0,0 +1,167 @@
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import quote
+from uuid import uuid4
+import anyio
+from starlette.datastructures import Headers, UploadFile
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+_CHUNK_SIZE = 64 * 1024
+_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+async def save_upload(file: UploadFile, directory: Path, default_suffix: str) -> str:
+    """Сохраняет загруженный файл под случайным именем и возвращает это имя.
+
+    Чтение из UploadFile и запись на диск идут в пуле потоков кусками
+    по 1 МиБ, поэтому большая загрузка не блокирует цикл событий.
+    """
+    await anyio.Path(directory).mkdir(parents=True, exist_ok=True)
+    filename = f"{uuid4().hex}{Path(file.filename or '').suffix or default_suffix}"
+    async with await anyio.open_file(directory / filename, "wb") as buffer:
+        while chunk := await file.read(_UPLOAD_CHUNK_SIZE):
+            await buffer.write(chunk)
+    return filename
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def _parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """Разбирает одиночный диапазон bytes=a-b; возвращает (start, end) включительно.
+
+    None — заголовок не поддерживается или некорректен (несколько
+    диапазонов, другие единицы), и отдаётся весь файл.
+    """
+    unit, _, spec = value.partition("=")
+    start_text, dash, end_text = spec.strip().partition("-")
+    if unit.strip().lower() != "bytes" or "," in spec or not dash:
+        return None
+    try:
+        start = int(start_text) if start_text else None
+        end = int(end_text) if end_text else None
+    except ValueError:
+        return None
+
+    if start is None:
+        # bytes=-N: последние N байт
+        if not end:
+            raise RangeNotSatisfiable()
+        return max(size - end, 0), size - 1
+    if start >= size or (end is not None and end < start):
+        raise RangeNotSatisfiable()
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+class RangeFileResponse(Response):
+    """Отдача файла с поддержкой Range, If-Range и условных запросов.
+
+    Starlette 0.27 в FileResponse не умеет Range, поэтому докачка и
+    перемотка больших PDF раньше скачивали файл целиком. Если сервер
+    поддерживает ASGI-расширение http.response.zerocopy, тело уходит через
+    sendfile без копирования в пространство пользователя; иначе читается
+    кусками по 64 КиБ.
+    """
+
+    def __init__(self, path: Path, request_headers: Headers, filename: Optional[str] = None, attachment: bool = False):
+        self.path = path
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+        super().__init__(status_code=200, media_type=media_type)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["etag"] = etag
+        self.headers["last-modified"] = last_modified
+        disposition = "attachment" if attachment else "inline"
+        name = filename or path.name
+        self.headers["content-disposition"] = f"{disposition}; filename*=utf-8''{quote(name)}"
+
+        self.start, self.length = 0, size
+        if self._not_modified(request_headers, etag, stat.st_mtime):
+            self.status_code = 304
+            self.length = 0
+            del self.headers["content-type"]
+            del self.headers["content-length"]
+            return
+
+        range_header = request_headers.get("range")
+        if range_header and self._if_range_matches(request_headers.get("if-range"), etag, last_modified):
+            try:
+                byte_range = _parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                self.status_code = 416
+                self.length = 0
+                self.headers["content-range"] = f"bytes */{size}"
+                byte_range = None
+            if byte_range is not None:
+                start, end = byte_range
+                self.status_code = 206
+                self.start, self.length = start, end - start + 1
+                self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        self.headers["content-length"] = str(self.length)
+
+    @staticmethod
+    def _not_modified(request_headers: Headers, etag: str, mtime: float) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _if_range_matches(if_range: Optional[str], etag: str, last_modified: str) -> bool:
+        # Файл изменился с момента первой части — отдаём его целиком
+        return if_range is None or if_range.strip() in (etag, last_modified)
+
+    @property
+    def is_initial_request(self) -> bool:
+        """Запрос файла с начала: докачка и перемотка не считаются отдельным скачиванием."""
+        return self.status_code in (200, 206) and self.start == 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if scope["method"] == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopy" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": file,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await file.read(min(_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
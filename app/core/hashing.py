@@ -0,0 +1,73 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Optional, TypeVar
+from fastapi import HTTPException, status
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.security import get_password_hash, verify_password
+
+T = TypeVar("T")
+
+
+class PasswordHashingService:
+    """Выполняет KDF в отдельном ограниченном пуле потоков.
+
+    hashlib отпускает GIL на время PBKDF2, поэтому вычисления не блокируют
+    event loop и общий пул потоков Starlette. Если в очереди уже слишком
+    много операций, новые запросы сразу получают 503 вместо ожидания.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._lock = Lock()
+
+    async def _run(self, metric: str, func: Callable[..., T], *args) -> T:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                metrics.increment("password_hash.rejected")
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Сервер перегружен, повторите попытку позже",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+            metrics.set_gauge("password_hash.pending", self._pending)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="password-hash",
+                )
+            executor = self._executor
+
+        started = perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, func, *args)
+        finally:
+            metrics.observe(metric, perf_counter() - started)
+            with self._lock:
+                self._pending -= 1
+                metrics.set_gauge("password_hash.pending", self._pending)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("password_hash.verify_seconds", verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("password_hash.hash_seconds", get_password_hash, password)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHashingService(
+    max_workers=settings.password_hash_workers,
+    max_pending=settings.password_hash_max_pending,
+)
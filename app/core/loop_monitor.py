@@ -0,0 +1,33 @@
+import asyncio
+import logging
+from app.core.metrics import metrics
+
+_asyncio_logger = logging.getLogger("asyncio")
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """Перехватывает предупреждения asyncio о долгих колбэках."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if not message.startswith("Executing "):
+            return
+        metrics.increment("event_loop.slow_callbacks")
+        print(f"🐢 Цикл событий заблокирован: {message}")
+
+
+_handler = _SlowCallbackHandler(level=logging.WARNING)
+
+
+def enable_loop_block_detector(loop: asyncio.AbstractEventLoop, threshold: float) -> None:
+    """Включает отладочный режим asyncio: каждый колбэк или шаг задачи,
+    занявший цикл дольше threshold секунд, попадает в лог и метрики.
+
+    Отладочный режим замедляет цикл, поэтому включается только при DEBUG.
+    """
+    loop.set_debug(True)
+    loop.slow_callback_duration = threshold
+    if _handler not in _asyncio_logger.handlers:
+        _asyncio_logger.addHandler(_handler)
+    if _asyncio_logger.getEffectiveLevel() > logging.WARNING:
+        _asyncio_logger.setLevel(logging.WARNING)
@@ -0,0 +1,61 @@
+from collections import deque
+from threading import Lock
+from typing import Any, Deque, Dict
+
+
+class Metrics:
+    """Простейший реестр метрик процесса: счётчики, gauge-значения и тайминги."""
+
+    def __init__(self, timing_window: int = 1024):
+        self._lock = Lock()
+        self._timing_window = timing_window
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[str, Deque[float]] = {}
+        self._timing_totals: Dict[str, Dict[str, float]] = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Добавляет измерение длительности (последние значения хранятся для перцентилей)."""
+        with self._lock:
+            window = self._timings.get(name)
+            if window is None:
+                window = self._timings[name] = deque(maxlen=self._timing_window)
+                self._timing_totals[name] = {"count": 0, "sum": 0.0, "max": 0.0}
+            window.append(seconds)
+            totals = self._timing_totals[name]
+            totals["count"] += 1
+            totals["sum"] += seconds
+            totals["max"] = max(totals["max"], seconds)
+
+    def counter(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            timings = {}
+            for name, window in self._timings.items():
+                ordered = sorted(window)
+                totals = self._timing_totals[name]
+                timings[name] = {
+                    "count": totals["count"],
+                    "avg": totals["sum"] / totals["count"],
+                    "max": totals["max"],
+                    "p50": ordered[int(0.50 * (len(ordered) - 1))],
+                    "p99": ordered[int(0.99 * (len(ordered) - 1))],
+                }
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": timings,
+            }
+
+
+metrics = Metrics()
@@ -0,0 +1,77 @@
+from typing import Any, Iterator, Mapping, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Receive, Scope, Send
+from app.schemas.user import Principal
+from app.services.principal import anonymous_state, resolve_principal, resolve_principal_async
+
+
+class LazyUserState(Mapping):
+    """request.state.user, который определяет пользователя при первом обращении.
+
+    Cookie декодируется, а пользователь загружается только если обработчик
+    или шаблон действительно читают данные пользователя.
+    """
+
+    __slots__ = ("_token", "_principal", "_state")
+
+    def __init__(self, token: Optional[str]):
+        self._token = token
+        self._principal: Optional[Principal] = None
+        self._state: Optional[dict] = None
+
+    def resolve(self, db: Optional[Session] = None) -> Optional[Principal]:
+        if self._state is None:
+            self._remember(resolve_principal(self._token, db))
+        return self._principal
+
+    async def resolve_async(self, db: AsyncSession) -> Optional[Principal]:
+        if self._state is None:
+            self._remember(await resolve_principal_async(self._token, db))
+        return self._principal
+
+    def _remember(self, principal: Optional[Principal]) -> None:
+        self._principal = principal
+        self._state = principal.as_state() if principal else anonymous_state()
+
+    @property
+    def principal(self) -> Optional[Principal]:
+        return self.resolve()
+
+    def _data(self) -> dict:
+        if self._state is None:
+            self.resolve()
+        return self._state
+
+    def __getitem__(self, key: str) -> Any:
+        return self._data()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data())
+
+    def __len__(self) -> int:
+        return len(self._data())
+
+    def __repr__(self) -> str:
+        if self._state is None:
+            return "LazyUserState(<unresolved>)"
+        return f"LazyUserState({self._state!r})"
+
+
+class AuthStateMiddleware:
+    """ASGI-middleware, кладущий ленивого пользователя в request.state.user.
+
+    Запросы к смонтированной статике пропускаются без какой-либо работы.
+    """
+
+    def __init__(self, app: ASGIApp, skip_prefixes: Tuple[str, ...] = ("/static/",)):
+        self.app = app
+        self.skip_prefixes = skip_prefixes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and not scope["path"].startswith(self.skip_prefixes):
+            token = HTTPConnection(scope).cookies.get("access_token")
+            scope.setdefault("state", {})["user"] = LazyUserState(token)
+
+        await self.app(scope, receive, send)
@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import json
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from threading import Lock
+from time import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple, Union
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.cache import TwoTierCache
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.singleflight import SingleFlight
+from app.models import SessionLocal, async_session
+
+
+@lru_cache(maxsize=None)
+def _adapter(model) -> TypeAdapter:
+    return TypeAdapter(model)
+
+
+def _render(value: Any, model=None) -> bytes:
+    if model is None:
+        return json.dumps(jsonable_encoder(value), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    adapter = _adapter(model)
+    return adapter.dump_json(adapter.validate_python(value, from_attributes=True))
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+# Запись кэша: (тело, ETag, дополнительные заголовки, время построения)
+Entry = Tuple[bytes, str, Dict[str, str], float]
+
+
+def _dump_entry(entry: Entry) -> bytes:
+    body, etag, headers, built_at = entry
+    return json.dumps({
+        "body": body.decode("utf-8"),
+        "etag": etag,
+        "headers": headers,
+        "built_at": built_at,
+    }).encode("utf-8")
+
+
+def _load_entry(raw: bytes) -> Entry:
+    data = json.loads(raw)
+    return data["body"].encode("utf-8"), data["etag"], data["headers"], data["built_at"]
+
+
+class ResponseCache:
+    """Кэш сериализованных ответов публичных эндпоинтов каталога.
+
+    Ключ — путь и отсортированные параметры запроса. Любое изменение
+    каталога увеличивает версию (поколение пространства имён в общем кэше),
+    и старые записи перестают находиться во всех воркерах. TTL ограничивает
+    устаревание полей, которые меняются без изменения версии (просмотры,
+    скачивания).
+
+    Промах по одному ключу строит ответ ровно один раз: конкурентные запросы
+    ждут результат ведущего (single-flight). После soft_ttl запись ещё
+    отдаётся, а новая версия строится в фоне, поэтому истечение горячей
+    страницы не превращается в лавину одинаковых запросов к БД.
+
+    respond — для синхронных эндпоинтов на Session, respond_async — для
+    асинхронных на сессии из get_read_db (AsyncSession или Session);
+    записи и single-flight у них общие.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, soft_ttl: Optional[float] = None, backend=None):
+        self.soft_ttl = soft_ttl
+        self._flight = SingleFlight("catalog")
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._background: Set[asyncio.Task] = set()
+        self._lock = Lock()
+        self._entries = TwoTierCache(
+            "catalog",
+            maxsize=maxsize,
+            ttl=ttl,
+            backend=backend,
+            dumps=_dump_entry,
+            loads=_load_entry,
+        )
+
+    @property
+    def version(self) -> int:
+        return self._entries.generation
+
+    def bump(self) -> int:
+        self._entries.clear()
+        version = self._entries.generation
+        metrics.set_gauge("response_cache.catalog_version", version)
+        return version
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _key(self, request: Request) -> Tuple:
+        path = request.url.path.rstrip("/") or "/"
+        return path, tuple(sorted(request.query_params.multi_items()))
+
+    def _build(self, key: Tuple, generation: int, db: Session, build, model, headers) -> Entry:
+        return self._store(key, generation, build(db), model, headers)
+
+    async def _build_async(self, key: Tuple, generation: int, db, build, model, headers) -> Entry:
+        value = await build(db)
+        # Сериализация страницы и запись в L2 (Redis) блокируют — выполняем их в пуле потоков
+        return await run_in_threadpool(self._store, key, generation, value, model, headers)
+
+    def _store(self, key: Tuple, generation: int, value: Any, model, headers) -> Entry:
+        body = _render(value, model)
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        extra = {name: item for name, item in (headers(value) if headers else {}).items() if item}
+        entry = (body, etag, extra, time())
+        # Ответ, построенный до изменения каталога, не должен попасть в новое поколение
+        self._entries.set(key, entry, generation=generation)
+        return entry
+
+    def _refresh_in_background(self, key: Tuple, build, model, headers) -> None:
+        flight_key = (self._entries.generation, key)
+        if self._flight.in_flight(flight_key):
+            return
+
+        def refresh():
+            # Сессия запроса к этому моменту уже закрыта — открываем свою
+            db = SessionLocal()
+            try:
+                self._flight.do(flight_key, lambda: self._build(key, flight_key[0], db, build, model, headers))
+                metrics.increment("response_cache.background_refreshes")
+            except Exception as e:
+                metrics.increment("response_cache.refresh_errors")
+                print(f"⚠️ Не удалось обновить кэш {key[0]}: {e}")
+            finally:
+                db.close()
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+            executor = self._executor
+        executor.submit(refresh)
+
+    @staticmethod
+    @asynccontextmanager
+    async def _session_like(db):
+        # Сессия запроса к моменту фонового обновления уже закрыта — открываем такую же
+        if isinstance(db, AsyncSession):
+            async with async_session() as session:
+                yield session
+            return
+        session = SessionLocal()
+        try:
+            yield session
+        finally:
+            await run_in_threadpool(session.close)
+
+    def _refresh_in_background_async(self, key: Tuple, db, build, model, headers) -> None:
+        flight_key = (self._entries.generation, key)
+        if self._flight.in_flight(flight_key):
+            return
+
+        async def refresh():
+            try:
+                async with self._session_like(db) as session:
+                    await self._flight.do_async(
+                        flight_key,
+                        lambda: self._build_async(key, flight_key[0], session, build, model, headers),
+                    )
+                metrics.increment("response_cache.background_refreshes")
+            except Exception as e:
+                metrics.increment("response_cache.refresh_errors")
+                print(f"⚠️ Не удалось обновить кэш {key[0]}: {e}")
+
+        # Ссылку держим до завершения, иначе задачу может собрать сборщик мусора
+        task = asyncio.ensure_future(refresh())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def respond(
+        self,
+        request: Request,
+        db: Session,
+        build: Callable[[Session], Any],
+        model=None,
+        headers: Optional[Callable[[Any], Dict[str, Optional[str]]]] = None,
+    ) -> Response:
+        """Отдаёт ответ из кэша, а при промахе строит, сериализует и сохраняет его.
+
+        build получает сессию БД и возвращает значение для сериализации;
+        headers получает построенное значение и возвращает дополнительные
+        заголовки, которые кэшируются вместе с телом.
+        """
+        key = self._key(request)
+        entry = self._entries.get(key)
+        if entry is None:
+            metrics.increment("response_cache.misses")
+            generation = self._entries.generation
+            entry = self._flight.do(
+                (generation, key),
+                lambda: self._build(key, generation, db, build, model, headers),
+            )
+        else:
+            metrics.increment("response_cache.hits")
+            if self.soft_ttl is not None and time() - entry[3] >= self.soft_ttl:
+                self._refresh_in_background(key, build, model, headers)
+
+        return self._response(request, entry)
+
+    async def respond_async(
+        self,
+        request: Request,
+        db: Union[AsyncSession, Session],
+        build: Callable[[Any], Awaitable[Any]],
+        model=None,
+        headers: Optional[Callable[[Any], Dict[str, Optional[str]]]] = None,
+    ) -> Response:
+        """То же, что respond, но build — корутина над сессией из get_read_db.
+
+        Попадание в L1 обслуживается прямо в цикле событий; в пул потоков
+        уходят только обращение к L2 и сериализация при промахе.
+        """
+        key = self._key(request)
+        entry = self._entries.get_local(key)
+        if entry is None:
+            entry = await run_in_threadpool(self._entries.get, key)
+        if entry is None:
+            metrics.increment("response_cache.misses")
+            generation = self._entries.generation
+            entry = await self._flight.do_async(
+                (generation, key),
+                lambda: self._build_async(key, generation, db, build, model, headers),
+            )
+        else:
+            metrics.increment("response_cache.hits")
+            if self.soft_ttl is not None and time() - entry[3] >= self.soft_ttl:
+                self._refresh_in_background_async(key, db, build, model, headers)
+
+        return self._response(request, entry)
+
+    def _response(self, request: Request, entry: Entry) -> Response:
+        body, etag, extra, _ = entry
+        response_headers = {"ETag": etag, "Cache-Control": "no-cache", **extra}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            metrics.increment("response_cache.not_modified")
+            return Response(status_code=304, headers=response_headers)
+        return Response(content=body, media_type="application/json", headers=response_headers)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+catalog_cache = ResponseCache(
+    maxsize=settings.response_cache_size,
+    ttl=settings.response_cache_ttl,
+    soft_ttl=settings.response_cache_soft_ttl,
+)
@@ -6,10 +6,15 @@ import json
 import base64
 import hmac
 from fastapi import HTTPException, status
+from app.core.cache import TTLCache
 from app.core.config import settings
+from app.core.metrics import metrics
 
 PEPPER = "library_system_pepper_2025"
 
+# Кэш уже проверенных токенов: ключ — исходная строка токена
+_verified_tokens = TTLCache(maxsize=settings.token_cache_size, ttl=settings.token_cache_ttl)
+
 
 def _b64url_encode(data: bytes) -> str:
     return base64.urlsafe_b64encode(data).decode().rstrip("=")
@@ -34,6 +39,15 @@ def _build_legacy_signature(signature_input: str) -> str:
     ).hexdigest()[:43]
     return _b64url_encode(legacy_signature.encode())
 
+def _pbkdf2(password: str, salt: str, iterations: int) -> str:
+    return hashlib.pbkdf2_hmac(
+        "sha256",
+        f"{PEPPER}{password}".encode(),
+        salt.encode(),
+        iterations,
+    ).hex()
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Проверяет пароль"""
     if not plain_password or not hashed_password:
@@ -41,12 +55,16 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     
     try:
         parts = hashed_password.split('$')
-        if len(parts) != 3:
-            return False
-        
-        algorithm, salt, stored_hash = parts
-        
-        if algorithm == "sha256":
+        algorithm = parts[0]
+
+        if algorithm == "pbkdf2_sha256" and len(parts) == 4:
+            _, iterations, salt, stored_hash = parts
+            expected_hash = _pbkdf2(plain_password, salt, int(iterations))
+            return secrets.compare_digest(expected_hash, stored_hash)
+
+        # Старый формат: sha256$salt$hash
+        if algorithm == "sha256" and len(parts) == 3:
+            _, salt, stored_hash = parts
             password_with_salt = f"{PEPPER}{plain_password}{salt}"
             expected_hash = hashlib.sha256(password_with_salt.encode()).hexdigest()
             return secrets.compare_digest(expected_hash, stored_hash)
@@ -57,16 +75,23 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         return False
 
 def get_password_hash(password: str) -> str:
-    """Создает хеш пароля"""
+    """Создает хеш пароля (PBKDF2-SHA256 с настраиваемым числом итераций)"""
     if not password:
         raise ValueError("Password cannot be empty")
     
-    safe_password = password[:50]
-    salt = secrets.token_hex(8)
-    password_with_salt = f"{PEPPER}{safe_password}{salt}"
-    password_hash = hashlib.sha256(password_with_salt.encode()).hexdigest()
-    
-    return f"sha256${salt}${password_hash}"
+    iterations = settings.password_hash_iterations
+    salt = secrets.token_hex(16)
+    return f"pbkdf2_sha256${iterations}${salt}${_pbkdf2(password, salt, iterations)}"
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Нужно ли пересчитать хеш: старый формат или устаревшее число итераций"""
+    parts = (hashed_password or "").split('$')
+    if parts[0] != "pbkdf2_sha256" or len(parts) != 4:
+        return True
+    try:
+        return int(parts[1]) < settings.password_hash_iterations
+    except ValueError:
+        return True
 
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """Создает простой JWT-подобный токен"""
@@ -100,6 +125,25 @@ def verify_token(token: str) -> Dict[str, Any]:
             detail="Token is empty"
         )
 
+    # Уже проверенный токен: запись живёт не дольше срока действия токена
+    cached_payload = _verified_tokens.get(token)
+    if cached_payload is not None:
+        metrics.increment("auth.token_cache.hits")
+        return dict(cached_payload)
+
+    metrics.increment("auth.token_cache.misses")
+    payload = _decode_token(token)
+
+    ttl = float(settings.token_cache_ttl)
+    if 'exp' in payload:
+        ttl = min(ttl, payload['exp'] - datetime.now(timezone.utc).timestamp())
+    if ttl > 0:
+        _verified_tokens.set(token, payload, ttl=ttl)
+
+    return dict(payload)
+
+
+def _decode_token(token: str) -> Dict[str, Any]:
     parts = token.split('.')
     if len(parts) != 3:
         raise HTTPException(
@@ -118,17 +162,14 @@ def verify_token(token: str) -> Dict[str, Any]:
             )
 
         signature_input = f"{parts[0]}.{parts[1]}"
-        expected_signature = _build_signature(signature_input)
-        legacy_signature = _build_legacy_signature(signature_input)
-
-        if not (
-            secrets.compare_digest(parts[2], expected_signature)
-            or secrets.compare_digest(parts[2], legacy_signature)
-        ):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token signature"
-            )
+        if not secrets.compare_digest(parts[2], _build_signature(signature_input)):
+            # Старый формат подписи проверяем только если основной не подошёл
+            if not secrets.compare_digest(parts[2], _build_legacy_signature(signature_input)):
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Invalid token signature"
+                )
+            metrics.increment("auth.legacy_signature_hits")
 
         if 'exp' in payload:
             exp_time = datetime.fromtimestamp(payload['exp'], tz=timezone.utc)
@@ -0,0 +1,87 @@
+import asyncio
+from concurrent.futures import Future
+from threading import Lock
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+from app.core.metrics import metrics
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Не более одного загрузчика на ключ: остальные вызовы ждут его результат.
+
+    Общий результат хранится в concurrent.futures.Future, поэтому одну и ту
+    же загрузку могут ждать и потоки синхронных эндпоинтов (do), и корутины
+    (do_async). Исключение загрузчика получают все ожидающие.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, Future] = {}
+        self._waiting = 0
+        self._lock = Lock()
+
+    def in_flight(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._calls
+
+    def _join(self, key: Hashable):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._waiting += 1
+                metrics.increment(f"singleflight.{self.name}.coalesced")
+                metrics.set_gauge(f"singleflight.{self.name}.waiting", self._waiting)
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _leave(self) -> None:
+        with self._lock:
+            self._waiting -= 1
+            metrics.set_gauge(f"singleflight.{self.name}.waiting", self._waiting)
+
+    def _finish(self, key: Hashable, future: Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key: Hashable, loader: Callable[[], T]) -> T:
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                return future.result()
+            finally:
+                self._leave()
+
+        try:
+            result = loader()
+        except BaseException as e:
+            self._finish(key, future)
+            future.set_exception(e)
+            raise
+        self._finish(key, future)
+        future.set_result(result)
+        return result
+
+    async def do_async(self, key: Hashable, loader: Callable[[], Awaitable[T]]) -> T:
+        future, leader = self._join(key)
+        if leader:
+            # Загрузка идёт отдельной задачей: отмена ведущего запроса
+            # (клиент отключился) не отменяет её для остальных
+            task = asyncio.ensure_future(loader())
+            task.add_done_callback(lambda done: self._resolve(key, future, done))
+        try:
+            return await asyncio.shield(asyncio.wrap_future(future))
+        finally:
+            if not leader:
+                self._leave()
+
+    def _resolve(self, key: Hashable, future: Future, task: asyncio.Future) -> None:
+        self._finish(key, future)
+        if task.cancelled():
+            future.set_exception(asyncio.CancelledError())
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
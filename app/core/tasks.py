@@ -0,0 +1,54 @@
+from threading import Event, Thread
+from typing import Callable, Optional
+from app.core.metrics import metrics
+
+
+class PeriodicTask:
+    """Фоновый поток, вызывающий func раз в interval секунд.
+
+    wake() запускает очередной вызов досрочно. Ошибки func логируются и
+    считаются в метриках, но не останавливают поток.
+    """
+
+    def __init__(self, name: str, interval: float, func: Callable[[], object], run_immediately: bool = False):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.run_immediately = run_immediately
+        self._wakeup = Event()
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def _call(self) -> None:
+        try:
+            self.func()
+        except Exception as e:
+            metrics.increment(f"tasks.{self.name}.errors")
+            print(f"⚠️ Фоновая задача {self.name} завершилась с ошибкой: {e}")
+
+    def _run(self) -> None:
+        if self.run_immediately:
+            self._call()
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            self._call()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            thread.join()
@@ -5,21 +5,53 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse, RedirectResponse
 from starlette.middleware.sessions import SessionMiddleware
 from contextlib import asynccontextmanager
-from typing import Dict, Any
+import asyncio
+from typing import Optional
 from sqlalchemy.orm import Session
 from app.api import auth, books, users, admin 
 from app.core.config import settings
-from app.core.security import verify_token
-from app.models import get_db, SessionLocal, init_db
+from app.core.hashing import password_hasher
+from app.core.loop_monitor import enable_loop_block_detector
+from app.core.response_cache import catalog_cache
+from app.models import dispose_async_engine, get_db, init_db, SessionLocal
 from app.services.book import get_book
-from app.models.user import User as UserModel
+from app.services.counters import book_counters
+from app.services.popularity import popularity_ranker
+from app.services.progress import progress_buffer
+from app.services.ratings import ratings_reconciler
+from app.services.system_counters import counters_reconciler, system_counter_buffer
+from app.services.search_index import catalog_index
+from app.core.acl import Permission, has_permission
+from app.core.middleware import AuthStateMiddleware, LazyUserState
+from app.schemas.user import Principal
 from app.services.user_stats import ensure_reading_session
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
+    if settings.debug:
+        enable_loop_block_detector(asyncio.get_running_loop(), settings.loop_block_threshold)
     init_db()
+    if settings.search_backend == "memory":
+        with SessionLocal() as db:
+            catalog_index.rebuild(db)
+    system_counter_buffer.start()
+    book_counters.start()
+    progress_buffer.start()
+    popularity_ranker.start()
+    counters_reconciler.start()
+    ratings_reconciler.start()
     yield
+    ratings_reconciler.stop()
+    counters_reconciler.stop()
+    popularity_ranker.stop()
+    progress_buffer.stop()
+    book_counters.stop()
+    # Последним: сброс буферов выше тоже меняет счётчики
+    system_counter_buffer.stop()
+    password_hasher.shutdown()
+    catalog_cache.shutdown()
+    await dispose_async_engine()
 
 
 app = FastAPI(
@@ -30,6 +62,8 @@ app = FastAPI(
 )
 
 # Middleware
+# Пользователь определяется лениво, статика обходится без разбора cookie
+app.add_middleware(AuthStateMiddleware)
 app.add_middleware(SessionMiddleware, secret_key=settings.secret_key)
 app.add_middleware(
     CORSMiddleware,
@@ -40,59 +74,21 @@ app.add_middleware(
 )
 
 
-def _is_authenticated(request: Request) -> bool:
-    return bool(getattr(request.state, "user", {}).get("is_authenticated"))
+def page_user(request: Request) -> Optional[Principal]:
+    """Пользователь HTML-страницы, определённый до рендеринга.
 
+    Обычная функция: при промахе кэша LazyUserState идёт в БД (и в Redis),
+    поэтому FastAPI выполняет её в пуле потоков, а async-обработчики и
+    шаблоны потом читают уже готовый request.state.user.
+    """
+    user_state = getattr(request.state, "user", None)
+    if isinstance(user_state, LazyUserState):
+        return user_state.resolve()
+    return None
 
-def _is_staff(request: Request) -> bool:
-    return getattr(request.state, "user", {}).get("role") in {"admin", "librarian"}
 
-# Custom Middleware для добавления пользователя в запрос
-@app.middleware("http")
-async def add_user_to_request(request: Request, call_next):
-    # Инициализируем пользователя
-    request.state.user: Dict[str, Any] = {
-        "is_authenticated": False, 
-        "username": None,
-        "role": None,
-        "user_id": None,
-        "email": None,
-        "full_name": None,
-        "created_at": None,
-        "is_active": False,
-    }
-    
-    # Проверяем токен из cookie
-    token = request.cookies.get("access_token")
-    
-    if token:
-        try:
-            payload = verify_token(token)
-            username = payload.get("sub")
-            if username:
-                # Получаем пользователя из базы для проверки роли
-                db = SessionLocal()
-                try:
-                    user = db.query(UserModel).filter(UserModel.username == username).first()
-                    if user:
-                        # Добавляем информацию о пользователе
-                        request.state.user = {
-                            "is_authenticated": True, 
-                            "username": user.username,
-                            "role": user.role,
-                            "user_id": user.id,
-                            "email": user.email,
-                            "full_name": user.full_name,
-                            "created_at": user.created_at,
-                            "is_active": user.is_active,
-                        }
-                finally:
-                    db.close()
-        except Exception:
-            pass
-    
-    response = await call_next(request)
-    return response
+def _is_staff(user: Optional[Principal]) -> bool:
+    return has_permission(user, Permission.EDIT_BOOKS)
 
 # Mount static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -106,15 +102,17 @@ app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 
 # HTML Routes
 @app.get("/", response_class=HTMLResponse)
-async def index(request: Request):
+async def index(request: Request, user: Optional[Principal] = Depends(page_user)):
     return templates.TemplateResponse("index.html", {"request": request})
     
 @app.get("/catalog", response_class=HTMLResponse)
-async def catalog(request: Request):
+async def catalog(request: Request, user: Optional[Principal] = Depends(page_user)):
     return templates.TemplateResponse("catalog.html", {"request": request})
     
+# Обычная функция: FastAPI выполняет её в пуле потоков, и синхронные запросы
+# к БД (включая ленивые загрузки при рендеринге шаблона) не блокируют цикл событий
 @app.get("/book/{book_id}", response_class=HTMLResponse)
-async def book_detail(
+def book_detail(
     request: Request, 
     book_id: int,
     db: Session = Depends(get_db)
@@ -126,9 +124,8 @@ async def book_detail(
         # Перенаправляем на каталог если книга не найдена
         return RedirectResponse(url="/catalog")
 
-    book.view_count = (book.view_count or 0) + 1
-    db.commit()
-    db.refresh(book)
+    book_counters.add(book.id, "view_count")
+    pending = book_counters.pending(book.id)
 
     # Если запрошено чтение (например, /book/{id}?read=true) и есть файл,
     # показываем встроенный просмотрщик PDF/файла и фиксируем сессию чтения
@@ -136,16 +133,30 @@ async def book_detail(
         # Если пользователь авторизован, создаём/обновляем сессию чтения
         user_state = getattr(request, "state", None)
         user_info = getattr(user_state, "user", None) if user_state else None
+        if isinstance(user_info, LazyUserState):
+            # Пользователь загружается в сессии запроса, а не во второй, своей
+            user_info.resolve(db)
+        progress = 0
         if user_info and user_info.get("is_authenticated") and user_info.get("user_id"):
             try:
-                ensure_reading_session(db, user_info["user_id"], book.id)
+                # Текущий прогресс отдаём сразу в шаблоне, без отдельного запроса из браузера
+                session = ensure_reading_session(db, user_info["user_id"], book.id)
+                progress = session.progress_percentage or 0
+                pending_progress = progress_buffer.pending(user_info["user_id"], book.id)
+                if pending_progress:
+                    progress = pending_progress["progress_percentage"]
             except Exception:
                 # Не мешаем пользователю читать книгу, даже если сессия не создалась
                 pass
 
         return templates.TemplateResponse(
             "reader.html",
-            {"request": request, "book": book, "file_url": book.file_url}
+            {
+                "request": request,
+                "book": book,
+                "file_url": f"/api/books/{book.id}/download",
+                "progress": progress,
+            }
         )
     
     # Преобразуем данные книги для шаблона
@@ -161,8 +172,10 @@ async def book_detail(
         "language": book.language,
         "isbn": book.isbn,
         "rating": float(book.rating) if book.rating else 0.0,
-        "view_count": book.view_count or 0,
-        "download_count": book.download_count or 0,
+        "rating_count": book.rating_count or 0,
+        "rating_histogram": book.rating_histogram,
+        "view_count": (book.view_count or 0) + pending.get("view_count", 0),
+        "download_count": (book.download_count or 0) + pending.get("download_count", 0),
         "created_at": book.created_at,
         "authors": [
             {
@@ -188,32 +201,32 @@ async def book_detail(
     })
     
 @app.get("/login", response_class=HTMLResponse)
-async def login_page(request: Request):
+async def login_page(request: Request, user: Optional[Principal] = Depends(page_user)):
     return templates.TemplateResponse("login.html", {"request": request})
     
 @app.get("/register", response_class=HTMLResponse)
-async def register_page(request: Request):
+async def register_page(request: Request, user: Optional[Principal] = Depends(page_user)):
     return templates.TemplateResponse("register.html", {"request": request})
 
 @app.get("/profile", response_class=HTMLResponse)
-async def profile_page(request: Request):
-    if not _is_authenticated(request):
+async def profile_page(request: Request, user: Optional[Principal] = Depends(page_user)):
+    if user is None:
         return RedirectResponse(url="/login", status_code=302)
     return templates.TemplateResponse("profile.html", {"request": request})
 
 @app.get("/admin", response_class=HTMLResponse)
-async def admin_page(request: Request):
-    if not _is_authenticated(request):
+async def admin_page(request: Request, user: Optional[Principal] = Depends(page_user)):
+    if user is None:
         return RedirectResponse(url="/login", status_code=302)
-    if not _is_staff(request):
+    if not _is_staff(user):
         return RedirectResponse(url="/", status_code=302)
     return templates.TemplateResponse("admin.html", {"request": request})
 
 @app.get("/admin/add-book", response_class=HTMLResponse)
-async def admin_add_book_page(request: Request):
-    if not _is_authenticated(request):
+async def admin_add_book_page(request: Request, user: Optional[Principal] = Depends(page_user)):
+    if user is None:
         return RedirectResponse(url="/login", status_code=302)
-    if not _is_staff(request):
+    if not _is_staff(user):
         return RedirectResponse(url="/", status_code=302)
     return templates.TemplateResponse("admin/add_book.html", {"request": request})
 
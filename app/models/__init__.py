@@ -1,6 +1,10 @@
-from sqlalchemy import create_engine
+from threading import Lock
+from sqlalchemy import create_engine, inspect, text
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 from app.core.config import settings
+from app.core.db_pool import check_connection_budget, instrument_engine, pool_kwargs
 from sqlalchemy.schema import MetaData
 from sqlalchemy.orm import declarative_base
 
@@ -15,15 +19,64 @@ metadata = MetaData(naming_convention={
 
 # 1. Создание Engine
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
-engine_kwargs = {"pool_pre_ping": True}
+engine_kwargs = pool_kwargs(SQLALCHEMY_DATABASE_URL, "sync")
 if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
     engine_kwargs["connect_args"] = {"check_same_thread": False}
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_kwargs)
+instrument_engine(engine, "sync")
 
 # 2. Создание SessionLocal
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def async_database_url(url: str) -> str:
+    """Тот же адрес БД для асинхронного драйвера: asyncpg или aiosqlite."""
+    scheme, _, rest = url.partition("://")
+    dialect = scheme.split("+", 1)[0]
+    if dialect == "postgresql":
+        return f"postgresql+asyncpg://{rest}"
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+
+# Асинхронные сессии для горячих маршрутов чтения (settings.async_db_routes);
+# engine привязывается при создании сессии (см. get_async_engine)
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+_async_engine = None
+_async_engine_lock = Lock()
+
+
+def get_async_engine():
+    """Асинхронный engine: работает рядом с синхронным (админка, фоновые
+    задачи, скрипты) и не занимает пул потоков.
+
+    Создаётся при первом обращении, так что без async-маршрутов его пул
+    не открывается и не расходует бюджет max_connections.
+    """
+    global _async_engine
+    with _async_engine_lock:
+        if _async_engine is None:
+            _async_engine = create_async_engine(
+                settings.async_database_url or async_database_url(SQLALCHEMY_DATABASE_URL),
+                **pool_kwargs(SQLALCHEMY_DATABASE_URL, "async", asynchronous=True),
+            )
+            instrument_engine(_async_engine.sync_engine, "async")
+        return _async_engine
+
+
+def async_session() -> AsyncSession:
+    """Новая AsyncSession на асинхронном engine."""
+    return AsyncSessionLocal(bind=get_async_engine())
+
+
+async def dispose_async_engine() -> None:
+    """Закрывает соединения асинхронного пула, если он был создан."""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
 # 3. Базовый класс для всех моделей
 Base = declarative_base(metadata=metadata)
 
@@ -34,6 +87,37 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """Dependency для асинхронных эндпоинтов: AsyncSession поверх asyncpg/aiosqlite."""
+    async with async_session() as db:
+        yield db
+
+
+async def get_read_db():
+    """Dependency горячих маршрутов чтения: AsyncSession при
+    settings.async_db_routes, иначе Session (запросы — через run_read)."""
+    if settings.async_db_routes:
+        async with async_session() as db:
+            yield db
+        return
+
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        # Возврат соединения в пул делает ROLLBACK — это запрос к БД
+        await run_in_threadpool(db.close)
+
+
+async def run_read(db, sync_func, async_func, *args, **kwargs):
+    """Вызывает вариант сервиса под сессию из get_read_db: async_func на
+    AsyncSession в цикле событий или sync_func на Session в пуле потоков."""
+    if isinstance(db, AsyncSession):
+        return await async_func(db, *args, **kwargs)
+    return await run_in_threadpool(sync_func, db, *args, **kwargs)
+
         
 def init_db():
     """
@@ -44,13 +128,36 @@ def init_db():
     try:
         from app.models import user as user_models  # noqa: F401
         from app.models import book as book_models  # noqa: F401
+        from app.models import system as system_models  # noqa: F401
+
+        # Воркеры × пулы не должны исчерпывать max_connections PostgreSQL
+        check_connection_budget(engine)
 
         # Создаем все таблицы (если их нет)
         Base.metadata.create_all(bind=engine, checkfirst=True)
+
+        # Дубликаты активных сессий мешают создать уникальный индекс
+        from app.services.user_stats import remove_duplicate_active_sessions
+        with engine.begin() as connection:
+            if inspect(connection).has_table("reading_sessions"):
+                removed = remove_duplicate_active_sessions(connection)
+                if removed:
+                    print(f"⚠️ Удалено дублирующих активных сессий чтения: {removed}")
+
+        upgrade_schema()
         print("✅ Таблицы созданы/проверены")
 
         seed_initial_data()
 
+        from app.services.system_counters import ensure_system_counters
+        ensure_system_counters()
+
+        from app.services.ratings import ensure_book_ratings
+        ensure_book_ratings()
+
+        from app.services.search import ensure_search_schema
+        ensure_search_schema()
+
         # Проверяем наличие администратора
         check_admin_exists()
 
@@ -66,6 +173,107 @@ def init_db():
     print("--- Инициализация базы данных завершена ---")
 
 
+# Индексы, которые создавали прежние версии моделей и которые больше не нужны:
+# их поддержка замедляет каждую запись. Таблица -> имена индексов
+RETIRED_INDEXES = {
+    # Заменён ix_books_active_popularity (рейтинг популярности с затуханием)
+    "books": ("ix_books_active_popular",),
+}
+
+
+def upgrade_schema():
+    """Приводит существующие таблицы к моделям: столбцы, NOT NULL и индексы.
+
+    create_all() не изменяет уже созданные таблицы, поэтому новые столбцы
+    с серверным значением по умолчанию (или допускающие NULL) и новые индексы
+    добавляем вручную. NULL в столбцах, ставших NOT NULL, заполняем серверным
+    значением по умолчанию. Удаляются только индексы из RETIRED_INDEXES —
+    созданные прежними версиями приложения; индексы, добавленные вручную,
+    не трогаются.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing_columns = {column["name"]: column for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    if existing_columns[column.name]["nullable"] and not column.nullable:
+                        _fill_nulls(connection, table, column)
+                    continue
+                if not column.nullable and column.server_default is None:
+                    print(f"⚠️ Столбец {table.name}.{column.name} нельзя добавить автоматически")
+                    continue
+
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {_server_default_sql(column)}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                connection.execute(text(ddl))
+                print(f"✅ Добавлен столбец {table.name}.{column.name}")
+
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for name in RETIRED_INDEXES.get(table.name, ()):
+            if name not in existing_indexes:
+                continue
+            try:
+                # IF EXISTS: несколько воркеров могут выполнять init_db одновременно
+                with engine.begin() as connection:
+                    connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+                print(f"✅ Удалён устаревший индекс {name}")
+            except Exception as e:
+                print(f"⚠️ Не удалось удалить индекс {name}: {e}")
+
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            # Индексы только для другой СУБД (например, GIN для PostgreSQL)
+            ddl_if = getattr(index, "_ddl_if", None)
+            if ddl_if is not None and ddl_if.dialect and ddl_if.dialect != engine.dialect.name:
+                continue
+            try:
+                index.create(bind=engine)
+                print(f"✅ Создан индекс {index.name}")
+            except Exception as e:
+                print(f"⚠️ Не удалось создать индекс {index.name}: {e}")
+
+
+def _server_default_sql(column) -> str:
+    default = column.server_default.arg
+    if isinstance(default, str):
+        return f"'{default}'"
+    return str(default.compile(dialect=engine.dialect))
+
+
+def _fill_nulls(connection, table, column) -> None:
+    """Заполняет NULL в столбце, который модель объявляет NOT NULL.
+
+    Ключи keyset-пагинации сравниваются кортежем строк, и строка с NULL
+    в ключе не попала бы ни на одну страницу. SQLite не умеет менять
+    NOT NULL у существующего столбца, там остаётся только заполнение.
+    """
+    if column.server_default is None:
+        print(f"⚠️ Столбец {table.name}.{column.name} допускает NULL, а в модели — NOT NULL")
+        return
+
+    filled = connection.execute(text(
+        f"UPDATE {table.name} SET {column.name} = {_server_default_sql(column)} WHERE {column.name} IS NULL"
+    )).rowcount
+    if filled:
+        print(f"✅ Заполнено NULL в {table.name}.{column.name}: {filled}")
+    if engine.dialect.name == "postgresql":
+        connection.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column.name} SET NOT NULL"))
+        print(f"✅ Столбец {table.name}.{column.name} переведён в NOT NULL")
+
+
 def seed_initial_data():
     """Создаем демонстрационные записи для пустой базы."""
     db = SessionLocal()
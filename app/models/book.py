@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Numeric, JSON, Table
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Numeric, JSON, Table, Index, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import TSVECTOR
@@ -51,11 +51,22 @@ class Book(Base):
     file_size = Column(Integer)  # Size in bytes
     file_format = Column(String(10))  # PDF, EPUB, etc.
     rating = Column(Numeric(3, 2), default=0.0)  # Average rating
+    # Агрегаты одобренных рецензий, поддерживаются инкрементально (app/services/ratings.py)
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_1_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_2_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_3_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_4_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_5_count = Column(Integer, nullable=False, default=0, server_default="0")
     download_count = Column(Integer, default=0)
     view_count = Column(Integer, default=0)
+    # Рейтинг популярности с экспоненциальным затуханием (см. app/services/popularity.py)
+    popularity_score = Column(Float, nullable=False, default=0.0, server_default="0")
     is_active = Column(Boolean, default=True)
     is_featured = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Ключ сортировки «новые» в keyset-пагинации, поэтому без NULL
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     # Full-text search vector
@@ -68,6 +79,19 @@ class Book(Base):
     reading_sessions = relationship("ReadingSession", back_populates="book")
     favorited_by = relationship("User", secondary="user_favorites", back_populates="favorites")
 
+    @property
+    def rating_histogram(self) -> dict:
+        """Число одобренных рецензий по звёздам: {1: ..., 5: ...}."""
+        return {stars: getattr(self, f"rating_{stars}_count") or 0 for stars in range(1, 6)}
+
+    # Составные индексы под каждый порядок сортировки каталога (keyset-пагинация)
+    __table_args__ = (
+        Index("ix_books_active_id", "is_active", "id"),
+        Index("ix_books_active_newest", "is_active", "created_at", "id"),
+        Index("ix_books_active_popularity", "is_active", "popularity_score", "id"),
+        Index("ix_books_search_vector", "search_vector", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+
 
 # Association tables
 book_categories = Table(
@@ -102,6 +126,11 @@ class Review(Base):
     book = relationship("Book", back_populates="reviews")
     user = relationship("User", back_populates="reviews")
 
+    __table_args__ = (
+        Index("ix_reviews_approved_created", "is_approved", "created_at"),
+        Index("ix_reviews_user", "user_id"),
+    )
+
 
 class ReadingSession(Base):
     __tablename__ = "reading_sessions"
@@ -118,3 +147,16 @@ class ReadingSession(Base):
     # Relationships
     user = relationship("User", back_populates="reading_sessions")
     book = relationship("Book", back_populates="reading_sessions")
+
+    __table_args__ = (
+        Index("ix_reading_sessions_completed_end", "is_completed", "end_time"),
+        Index("ix_reading_sessions_user_state", "user_id", "is_completed", start_time.desc()),
+        Index("ix_reading_sessions_user_book", "user_id", "book_id", "is_completed"),
+        # Не больше одной активной сессии на пару; цель для ON CONFLICT при сохранении прогресса
+        Index(
+            "uq_reading_sessions_active", "user_id", "book_id",
+            unique=True,
+            postgresql_where=is_completed == False,
+            sqlite_where=is_completed == False,
+        ),
+    )
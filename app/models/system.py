@@ -0,0 +1,23 @@
+from sqlalchemy import Column, String, DateTime, BigInteger, JSON
+from sqlalchemy.sql import func
+from app.models import Base
+
+
+class JobState(Base):
+    """Состояние фоновых задач: до какого момента уже обработаны события."""
+    __tablename__ = "job_state"
+
+    name = Column(String(64), primary_key=True)
+    last_run_at = Column(DateTime)  # UTC без часового пояса
+    # Параметры, от которых зависят сохранённые результаты задачи
+    # (для рейтинга популярности — точка отсчёта и период полураспада)
+    params = Column(JSON)
+
+
+class SystemCounter(Base):
+    """Поддерживаемые счётчики объектов для дашбордов (см. app/services/system_counters.py)."""
+    __tablename__ = "system_counters"
+
+    name = Column(String(64), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
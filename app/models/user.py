@@ -24,6 +24,8 @@ class User(Base):
     role = Column(String(20), default="reader")  # guest, reader, librarian, admin
     is_active = Column(Boolean, default=True)
     is_verified = Column(Boolean, default=False)
+    # Увеличивается при отзыве ранее выданных токенов (например, при блокировке)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
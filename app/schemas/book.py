@@ -1,5 +1,5 @@
 from pydantic import BaseModel, ConfigDict, Field
-from typing import Optional, List
+from typing import Optional, List, Union
 from datetime import datetime
 
 
@@ -103,3 +103,21 @@ class BookSearch(BaseModel):
     language: Optional[str] = None
     year_min: Optional[int] = None
     year_max: Optional[int] = None
+
+
+class FacetCount(BaseModel):
+    value: Union[int, str]
+    label: str
+    count: int
+
+
+class SearchFacets(BaseModel):
+    categories: List[FacetCount] = Field(default_factory=list)
+    authors: List[FacetCount] = Field(default_factory=list)
+    languages: List[FacetCount] = Field(default_factory=list)
+    decades: List[FacetCount] = Field(default_factory=list)
+
+
+class BookSearchResult(BaseModel):
+    items: List[Book]
+    facets: SearchFacets
@@ -54,6 +54,26 @@ class User(UserBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class Principal(User):
+    """Неизменяемый снимок пользователя для текущего запроса (кэшируется в памяти)."""
+    token_version: int = 0
+
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+    def as_state(self) -> dict:
+        """Представление для request.state.user и шаблонов."""
+        return {
+            "is_authenticated": True,
+            "username": self.username,
+            "role": self.role,
+            "user_id": self.id,
+            "email": self.email,
+            "full_name": self.full_name,
+            "created_at": self.created_at,
+            "is_active": self.is_active,
+        }
+
+
 class UserLogin(BaseModel):
     username: str
     password: str
@@ -3,6 +3,7 @@ from fastapi import HTTPException, status
 from app.models.user import User
 from app.schemas.user import UserCreate, UserLogin, UserUpdate
 from app.core.security import verify_password, get_password_hash, create_access_token
+from app.services.principal import invalidate_principal, token_claims
 from datetime import timedelta  
 from app.core.config import settings
 from typing import List, Optional
@@ -13,7 +14,8 @@ def get_user_by_username(db: Session, username: str) -> Optional[User]:
 def get_user_by_email(db: Session, email: str) -> Optional[User]:
     return db.query(User).filter(User.email == email).first()
 
-def create_user(db: Session, user: UserCreate) -> User:
+def create_user(db: Session, user: UserCreate, hashed_password: str) -> User:
+    """Создание пользователя; пароль хешируется заранее через password_hasher"""
     # Проверяем, есть ли уже пользователи в системе
     total_users = db.query(User).count()
     
@@ -33,7 +35,6 @@ def create_user(db: Session, user: UserCreate) -> User:
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
     db_user = User(
         username=user.username,
         email=user.email,
@@ -90,12 +91,14 @@ def update_user(db: Session, user_id: int, user_update: dict) -> Optional[User]:
     if "password" in user_update:
         user_update.pop("password")
     
+    previous_username = db_user.username
     for field, value in user_update.items():
         if hasattr(db_user, field):
             setattr(db_user, field, value)
     
     db.commit()
     db.refresh(db_user)
+    invalidate_principal(db_user.id, previous_username)
     return db_user
 
 def delete_user(db: Session, user_id: int) -> bool:
@@ -139,7 +142,7 @@ def login_user(db: Session, user_login: UserLogin) -> dict:
     # Создаем токен
     access_token = create_access_token(
         data={
-            "sub": user.username,
+            **token_claims(user),
             "role": user.role,
             "user_id": user.id,
             "email": user.email
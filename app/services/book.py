@@ -1,26 +1,142 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import Integer, String, cast, func, literal, or_, select, tuple_, union_all
 from fastapi import HTTPException, status
-from typing import List, Optional
-from app.models.book import Book, Category, Author, Review
+from typing import Dict, Iterable, List, Optional, Set
+from datetime import datetime
+from pathlib import Path
+from decimal import Decimal
+import base64
+import json
+from app.models.book import Book, Category, Author, Review, book_authors, book_categories
+from app.models.user import user_favorites
 from app.schemas.book import BookCreate, BookUpdate, BookSearch, ReviewCreate
+from app.core.config import settings
+from app.core.response_cache import catalog_cache
+from app.services.search import apply_text_search, refresh_search_index
+from app.services.search_index import catalog_index, naive_utc
+
+
+def _with_relations(query):
+    # Авторы и категории страницы догружаются двумя запросами IN (...), а не по книге
+    return query.options(selectinload(Book.authors), selectinload(Book.categories))
+
+
+def _dialect_name(db) -> str:
+    return db.get_bind().dialect.name
 
 
 def get_book(db: Session, book_id: int) -> Optional[Book]:
     return db.query(Book).filter(Book.id == book_id, Book.is_active == True).first()
 
 
+async def get_book_async(db: AsyncSession, book_id: int) -> Optional[Book]:
+    # Ленивой загрузки в AsyncSession нет, поэтому связи читаются сразу
+    return await db.scalar(
+        _with_relations(select(Book)).where(Book.id == book_id, Book.is_active == True).limit(1)
+    )
+
+
+def get_existing_book_ids(db: Session, book_ids: Iterable[int]) -> Set[int]:
+    """Какие из книг существуют и активны — одним запросом."""
+    book_ids = list(book_ids)
+    if not book_ids:
+        return set()
+    rows = db.query(Book.id).filter(Book.id.in_(book_ids), Book.is_active == True).all()
+    return {book_id for (book_id,) in rows}
+
+
+# Ключи сортировки для каждого режима: (столбцы, по убыванию ли).
+# Все столбцы одного режима идут в одном направлении, поэтому курсор
+# сравнивается одним сравнением кортежей и использует составной индекс.
+_SORT_KEYS = {
+    "newest": ((Book.created_at, Book.id), True),
+    "popular": ((Book.popularity_score, Book.id), True),
+    None: ((Book.id,), False),
+}
+
+
+def _sort_spec(sort: Optional[str]):
+    return _SORT_KEYS.get(sort, _SORT_KEYS[None])
+
+
 def _apply_sort(query, sort: Optional[str]):
-    if sort == "newest":
-        return query.order_by(Book.created_at.desc(), Book.id.desc())
-    if sort == "popular":
-        return query.order_by(
-            Book.view_count.desc(),
-            Book.download_count.desc(),
-            Book.rating.desc(),
-            Book.id.desc(),
+    columns, descending = _sort_spec(sort)
+    return query.order_by(*(column.desc() if descending else column.asc() for column in columns))
+
+
+def _encode_cursor_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"dec": str(value)}
+    return value
+
+
+def _decode_cursor_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "dec" in value:
+            return Decimal(value["dec"])
+        raise ValueError("unknown cursor value")
+    return value
+
+
+def encode_cursor(book: Book, sort: Optional[str]) -> str:
+    """Непрозрачный курсор, указывающий на позицию после переданной книги."""
+    columns, _ = _sort_spec(sort)
+    data = {
+        "s": sort if sort in _SORT_KEYS else None,
+        "k": [_encode_cursor_value(getattr(book, column.key)) for column in columns],
+    }
+    raw = json.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def next_cursor(books: List[Book], limit: int, sort: Optional[str]) -> Optional[str]:
+    """Курсор следующей страницы или None, если страница последняя."""
+    if len(books) < limit or not books:
+        return None
+    return encode_cursor(books[-1], sort)
+
+
+def _decode_cursor(cursor: str, sort: Optional[str]) -> list:
+    columns, _ = _sort_spec(sort)
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        if data.get("s") != (sort if sort in _SORT_KEYS else None):
+            raise ValueError("cursor belongs to another sort order")
+        values = [_decode_cursor_value(value) for value in data["k"]]
+        if len(values) != len(columns):
+            raise ValueError("cursor length mismatch")
+        return values
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный курсор пагинации"
         )
-    return query.order_by(Book.id.asc())
+
+
+def _apply_cursor(query, sort: Optional[str], cursor: str, dialect_name: str):
+    columns, descending = _sort_spec(sort)
+    values = _decode_cursor(cursor, sort)
+
+    position = tuple_(*columns)
+    bound = tuple_(*(_cursor_literal(value, column, dialect_name) for value, column in zip(values, columns)))
+    return query.filter(position < bound if descending else position > bound)
+
+
+def _cursor_literal(value, column, dialect_name: str):
+    if dialect_name == "sqlite" and isinstance(value, datetime):
+        # SQLite хранит server_default=now() как текст 'YYYY-MM-DD HH:MM:SS',
+        # сравнение идёт по строкам, поэтому формат должен совпадать
+        text_value = value.strftime("%Y-%m-%d %H:%M:%S")
+        if value.microsecond:
+            text_value += f".{value.microsecond:06d}"
+        return literal(text_value)
+    return literal(value, column.type)
 
 
 def _normalize_optional_text(value: Optional[str]) -> Optional[str]:
@@ -55,39 +171,50 @@ def _load_authors(db: Session, author_ids: List[int]) -> List[Author]:
     return authors
 
 
+def _limit_page(query, sort: Optional[str], skip: int, limit: int, cursor: Optional[str], dialect_name: str):
+    # С курсором skip игнорируется: позиция задаётся ключом сортировки
+    if cursor:
+        query = _apply_cursor(query, sort, cursor, dialect_name)
+    elif skip:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+
+def _paginate(query, sort: Optional[str], skip: int, limit: int, cursor: Optional[str]):
+    return _limit_page(query, sort, skip, limit, cursor, _dialect_name(query.session)).all()
+
+
 def get_books(
     db: Session,
     skip: int = 0,
     limit: int = 100,
     sort: Optional[str] = None,
+    cursor: Optional[str] = None,
 ) -> List[Book]:
-    query = db.query(Book).filter(Book.is_active == True)
+    query = _with_relations(db.query(Book).filter(Book.is_active == True))
     query = _apply_sort(query, sort)
-    return query.offset(skip).limit(limit).all()
+    return _paginate(query, sort, skip, limit, cursor)
 
 
-def search_books(db: Session, search: BookSearch, skip: int = 0, limit: int = 100) -> List[Book]:
-    query = db.query(Book).filter(Book.is_active == True)
+async def get_books_async(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+) -> List[Book]:
+    statement = _apply_sort(_with_relations(select(Book).where(Book.is_active == True)), sort)
+    statement = _limit_page(statement, sort, skip, limit, cursor, _dialect_name(db))
+    return list((await db.scalars(statement)).all())
 
-    if search.query:
-        text_query = f"%{search.query}%"
-        query = query.outerjoin(Book.authors).outerjoin(Book.categories)
-        query = query.filter(
-            or_(
-                Book.title.ilike(text_query),
-                Book.description.ilike(text_query),
-                Book.subtitle.ilike(text_query),
-                Author.first_name.ilike(text_query),
-                Author.last_name.ilike(text_query),
-                Category.name.ilike(text_query),
-            )
-        )
 
+def _apply_search_filters(query, search: BookSearch):
+    # EXISTS вместо JOIN: не размножает строки и не требует DISTINCT
     if search.category_id:
-        query = query.join(Book.categories).filter(Category.id == search.category_id)
+        query = query.filter(Book.categories.any(Category.id == search.category_id))
 
     if search.author_id:
-        query = query.join(Book.authors).filter(Author.id == search.author_id)
+        query = query.filter(Book.authors.any(Author.id == search.author_id))
 
     if search.language:
         query = query.filter(Book.language == search.language)
@@ -98,8 +225,216 @@ def search_books(db: Session, search: BookSearch, skip: int = 0, limit: int = 10
     if search.year_max:
         query = query.filter(Book.publication_year <= search.year_max)
 
-    query = _apply_sort(query.distinct(), "newest")
-    return query.offset(skip).limit(limit).all()
+    return query
+
+
+def _apply_like_search(query, query_text: str):
+    # Запасной вариант без полнотекстового индекса
+    text_query = f"%{query_text}%"
+    query = query.outerjoin(Book.authors).outerjoin(Book.categories)
+    return query.filter(
+        or_(
+            Book.title.ilike(text_query),
+            Book.description.ilike(text_query),
+            Book.subtitle.ilike(text_query),
+            Author.first_name.ilike(text_query),
+            Author.last_name.ilike(text_query),
+            Category.name.ilike(text_query),
+        )
+    ).distinct()
+
+
+def _in_memory_position(cursor: str):
+    """Позиция курсора «сначала новые» в виде ключа порядка индекса."""
+    created_at, book_id = _decode_cursor(cursor, "newest")
+    if not isinstance(created_at, datetime) or not isinstance(book_id, int):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный курсор пагинации"
+        )
+    return naive_utc(created_at), book_id
+
+
+def _in_memory_page_ids(search: BookSearch, skip: int, limit: int, cursor: Optional[str]) -> List[int]:
+    # Подбор и сортировка id — в индексе процесса, из БД читается только страница
+    if cursor:
+        return catalog_index.search(search, limit=limit, before=_in_memory_position(cursor))
+    return catalog_index.search(search, limit=skip + limit)[skip:]
+
+
+def _in_page_order(books: Iterable[Book], page_ids: List[int]) -> List[Book]:
+    books_by_id = {book.id: book for book in books}
+    return [books_by_id[book_id] for book_id in page_ids if book_id in books_by_id]
+
+
+def _search_books_in_memory(
+    db: Session,
+    search: BookSearch,
+    skip: int,
+    limit: int,
+    cursor: Optional[str],
+) -> List[Book]:
+    page_ids = _in_memory_page_ids(search, skip, limit, cursor)
+    if not page_ids:
+        return []
+    return _in_page_order(_with_relations(db.query(Book)).filter(Book.id.in_(page_ids)).all(), page_ids)
+
+
+def _filter_search(query, search: BookSearch, dialect_name: str):
+    """Применяет фильтры и текстовое условие; второй элемент — упорядочен ли запрос по релевантности."""
+    query = _apply_search_filters(query, search)
+    if search.query:
+        ranked = apply_text_search(query, search.query, dialect_name)
+        if ranked is not None:
+            return ranked, True
+        query = _apply_like_search(query, search.query)
+    return query, False
+
+
+def search_books(
+    db: Session,
+    search: BookSearch,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+) -> List[Book]:
+    if settings.search_backend == "memory" and catalog_index.ready:
+        return _search_books_in_memory(db, search, skip, limit, cursor)
+
+    dialect_name = _dialect_name(db)
+    query = _search_page(_with_relations(db.query(Book)), search, skip, limit, cursor, dialect_name)
+    return query.all()
+
+
+def _search_page(query, search: BookSearch, skip: int, limit: int, cursor: Optional[str], dialect_name: str):
+    query, ranked = _filter_search(query.filter(Book.is_active == True), search, dialect_name)
+    if ranked:
+        # Порядок по релевантности: постраничность только через skip
+        if cursor:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Курсор не поддерживается для поиска по тексту, используйте skip"
+            )
+        return query.offset(skip).limit(limit)
+
+    query = _apply_sort(query, "newest")
+    return _limit_page(query, "newest", skip, limit, cursor, dialect_name)
+
+
+async def search_books_async(
+    db: AsyncSession,
+    search: BookSearch,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+) -> List[Book]:
+    if settings.search_backend == "memory" and catalog_index.ready:
+        page_ids = _in_memory_page_ids(search, skip, limit, cursor)
+        if not page_ids:
+            return []
+        books = await db.scalars(_with_relations(select(Book)).where(Book.id.in_(page_ids)))
+        return _in_page_order(books.all(), page_ids)
+
+    statement = _search_page(_with_relations(select(Book)), search, skip, limit, cursor, _dialect_name(db))
+    return list((await db.scalars(statement)).all())
+
+
+def _facet_branch(name: str, value, label, source, group_by, limit: Optional[int], where=None):
+    branch = select(
+        literal(name).label("facet"),
+        cast(value, Integer).label("value"),
+        cast(label, String).label("label"),
+        func.count().label("count"),
+    ).select_from(source)
+    if where is not None:
+        branch = branch.where(where)
+    # Каждая ветка сортируется и ограничивается отдельно, поэтому оборачивается в подзапрос
+    branch = branch.group_by(*group_by).order_by(func.count().desc(), *group_by)
+    if limit is not None:
+        branch = branch.limit(limit)
+    branch = branch.subquery()
+    return select(branch.c.facet, branch.c.value, branch.c.label, branch.c["count"])
+
+
+# Фильтры, которые не применяются к собственной группировке (дизъюнктивные фасеты)
+_FACET_OWN_FILTERS = {
+    "categories": {"category_id": None},
+    "authors": {"author_id": None},
+    "languages": {"language": None},
+    "decades": {"year_min": None, "year_max": None},
+}
+
+
+def _facet_source(search: BookSearch, facet: str, dialect_name: str):
+    matched_query, _ = _filter_search(
+        select(
+            Book.id.label("book_id"),
+            Book.language.label("language"),
+            Book.publication_year.label("year"),
+        ).where(Book.is_active == True),
+        search.model_copy(update=_FACET_OWN_FILTERS[facet]),
+        dialect_name,
+    )
+    return matched_query.order_by(None).subquery(f"matched_{facet}")
+
+
+def _facets_statement(search: BookSearch, limit: Optional[int], dialect_name: str):
+    author_name = Author.first_name + " " + Author.last_name
+
+    by_category = _facet_source(search, "categories", dialect_name)
+    by_author = _facet_source(search, "authors", dialect_name)
+    by_language = _facet_source(search, "languages", dialect_name)
+    by_decade = _facet_source(search, "decades", dialect_name)
+    decade = (by_decade.c.year // 10) * 10
+
+    return union_all(
+        _facet_branch(
+            "categories", Category.id, Category.name,
+            by_category.join(book_categories, book_categories.c.book_id == by_category.c.book_id)
+                       .join(Category, Category.id == book_categories.c.category_id),
+            (Category.id, Category.name), limit,
+        ),
+        _facet_branch(
+            "authors", Author.id, author_name,
+            by_author.join(book_authors, book_authors.c.book_id == by_author.c.book_id)
+                     .join(Author, Author.id == book_authors.c.author_id),
+            (Author.id, author_name), limit,
+        ),
+        _facet_branch(
+            "languages", None, by_language.c.language, by_language,
+            (by_language.c.language,), limit, where=by_language.c.language.is_not(None),
+        ),
+        _facet_branch(
+            "decades", decade, None, by_decade,
+            (decade,), limit, where=by_decade.c.year.is_not(None),
+        ),
+    )
+
+
+def _collect_facets(rows) -> Dict[str, list]:
+    facets = {"categories": [], "authors": [], "languages": [], "decades": []}
+    for facet, value, label, count in rows:
+        if facet == "languages":
+            value = label
+        elif facet == "decades":
+            label = f"{value}-е"
+        facets[facet].append({"value": value, "label": label, "count": count})
+    return facets
+
+
+def get_search_facets(db: Session, search: BookSearch, limit: Optional[int] = None) -> Dict[str, list]:
+    """Счётчики по категориям, авторам, языкам и десятилетиям для текущих фильтров.
+
+    Фасеты дизъюнктивные: каждая группировка считается по книгам, найденным
+    без её собственного фильтра, поэтому при выбранной категории в списке
+    остаются и остальные категории с их числом книг. Все четыре группировки
+    считаются одним запросом UNION ALL. Без limit возвращаются все значения.
+    """
+    return _collect_facets(db.execute(_facets_statement(search, limit, _dialect_name(db))))
+
+
+async def get_search_facets_async(db: AsyncSession, search: BookSearch, limit: Optional[int] = None) -> Dict[str, list]:
+    return _collect_facets(await db.execute(_facets_statement(search, limit, _dialect_name(db))))
 
 
 def create_book(db: Session, book: BookCreate) -> Book:
@@ -126,8 +461,13 @@ def create_book(db: Session, book: BookCreate) -> Book:
         db_book.authors = authors
 
     db.add(db_book)
+    db.flush()
+    refresh_search_index(db, [db_book.id])
     db.commit()
+    catalog_cache.bump()
     db.refresh(db_book)
+    if catalog_index.ready:
+        catalog_index.add_book(db_book)
     return db_book
 
 
@@ -158,8 +498,13 @@ def update_book(db: Session, book_id: int, book_update: BookUpdate) -> Optional[
         authors = _load_authors(db, author_ids) if author_ids else []
         db_book.authors = authors
 
+    db.flush()
+    refresh_search_index(db, [db_book.id])
     db.commit()
+    catalog_cache.bump()
     db.refresh(db_book)
+    if catalog_index.ready:
+        catalog_index.add_book(db_book)
     return db_book
 
 
@@ -170,9 +515,26 @@ def delete_book(db: Session, book_id: int) -> bool:
     
     db_book.is_active = False
     db.commit()
+    catalog_cache.bump()
+    if catalog_index.ready:
+        catalog_index.remove_book(book_id)
     return True
 
 
+_STATIC_ROOT = Path("static").resolve()
+
+
+def get_book_file_path(book: Book) -> Optional[Path]:
+    """Файл книги на диске для file_url вида /static/...; None, если файла нет."""
+    if not book.file_url or not book.file_url.startswith("/static/"):
+        return None
+    path = (_STATIC_ROOT / book.file_url[len("/static/"):]).resolve()
+    # Не выпускаем за пределы каталога static
+    if _STATIC_ROOT not in path.parents or not path.is_file():
+        return None
+    return path
+
+
 def get_categories(db: Session) -> List[Category]:
     return db.query(Category).filter(Category.is_active == True).all()
 
@@ -189,19 +551,10 @@ def create_review(db: Session, review: ReviewCreate, user_id: int) -> Review:
         title=review.title,
         content=review.content
     )
+    # Агрегаты рейтинга книги обновляются при flush (app/services/ratings.py)
     db.add(db_review)
-    
-    # Update book rating
-    avg_rating = db.query(func.avg(Review.rating)).filter(
-        Review.book_id == review.book_id,
-        Review.is_approved == True
-    ).scalar()
-    
-    book = db.query(Book).filter(Book.id == review.book_id).first()
-    if book:
-        book.rating = avg_rating or 0.0
-    
     db.commit()
+    catalog_cache.bump()
     db.refresh(db_review)
     return db_review
 
@@ -212,3 +565,27 @@ def get_book_reviews(db: Session, book_id: int, skip: int = 0, limit: int = 50)
         Review.book_id == book_id, 
         Review.is_approved == True # Only show approved reviews by default
     ).offset(skip).limit(limit).all()
+
+
+def get_user_favorites(db: Session, user_id: int) -> List[Book]:
+    return _with_relations(db.query(Book)).join(
+        user_favorites, user_favorites.c.book_id == Book.id
+    ).filter(user_favorites.c.user_id == user_id).all()
+
+
+def add_favorite(db: Session, user_id: int, book_id: int) -> None:
+    exists = db.query(user_favorites).filter(
+        user_favorites.c.user_id == user_id,
+        user_favorites.c.book_id == book_id,
+    ).first()
+    if not exists:
+        db.execute(user_favorites.insert().values(user_id=user_id, book_id=book_id))
+        db.commit()
+
+
+def remove_favorite(db: Session, user_id: int, book_id: int) -> None:
+    db.execute(user_favorites.delete().where(
+        user_favorites.c.user_id == user_id,
+        user_favorites.c.book_id == book_id,
+    ))
+    db.commit()
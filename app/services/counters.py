@@ -0,0 +1,129 @@
+from datetime import datetime
+from threading import Lock
+from typing import Dict
+from sqlalchemy import bindparam, func, update
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.tasks import PeriodicTask
+from app.models import SessionLocal
+from app.models.book import Book
+from app.services.popularity import counter_score, load_clock
+
+COUNTER_FIELDS = ("view_count", "download_count")
+
+_books = Book.__table__
+
+# Одна инструкция на пачку: executemany с дельтами по каждой книге
+_FLUSH_STATEMENT = (
+    update(_books)
+    .where(_books.c.id == bindparam("book_id"))
+    .values(
+        view_count=func.coalesce(_books.c.view_count, 0) + bindparam("view_delta"),
+        download_count=func.coalesce(_books.c.download_count, 0) + bindparam("download_delta"),
+        popularity_score=func.coalesce(_books.c.popularity_score, 0) + bindparam("score_delta"),
+    )
+)
+
+
+class CounterBuffer:
+    """Буфер инкрементов счётчиков книг с отложенной записью (write-behind).
+
+    Просмотры и скачивания копятся в памяти воркера и сбрасываются в БД
+    раз в flush_interval секунд одним пакетным UPDATE ... = col + delta.
+    При накоплении max_pending инкрементов сброс происходит сразу, поэтому
+    при аварийной остановке теряется не больше одного интервала или
+    max_pending событий. При штатной остановке буфер сбрасывается в lifespan.
+    Тем же UPDATE к рейтингу популярности добавляется вклад этих событий.
+    """
+
+    def __init__(self, flush_interval: float, max_pending: int):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Dict[int, Dict[str, int]] = {}
+        self._pending_total = 0
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._task = PeriodicTask("counter-flush", flush_interval, self.flush)
+
+    def add(self, book_id: int, field: str = "view_count", delta: int = 1) -> None:
+        if field not in COUNTER_FIELDS:
+            raise ValueError(f"Неизвестный счётчик: {field}")
+        with self._lock:
+            counters = self._pending.setdefault(book_id, {})
+            counters[field] = counters.get(field, 0) + delta
+            self._pending_total += delta
+            overflow = self._pending_total >= self.max_pending
+        metrics.increment(f"counters.{field}")
+        if overflow:
+            self._task.wake()
+
+    def pending(self, book_id: int) -> Dict[str, int]:
+        """Ещё не записанные в БД инкременты книги (для показа актуальных значений)."""
+        with self._lock:
+            return dict(self._pending.get(book_id, {}))
+
+    def _merge_back(self, batch: Dict[int, Dict[str, int]]) -> None:
+        with self._lock:
+            for book_id, counters in batch.items():
+                current = self._pending.setdefault(book_id, {})
+                for field, delta in counters.items():
+                    current[field] = current.get(field, 0) + delta
+                    self._pending_total += delta
+
+    def flush(self) -> int:
+        """Записывает накопленные инкременты; возвращает число обновлённых книг."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._pending_total = 0
+            if not batch:
+                return 0
+
+            now = datetime.utcnow()
+            db = SessionLocal()
+            try:
+                # Вклад в рейтинг считается в масштабе, действующем в этой транзакции
+                clock = load_clock(db, lock=True)
+                params = [
+                    {
+                        "book_id": book_id,
+                        "view_delta": counters.get("view_count", 0),
+                        "download_delta": counters.get("download_count", 0),
+                        "score_delta": counter_score(
+                            counters.get("view_count", 0),
+                            counters.get("download_count", 0),
+                            now,
+                            clock,
+                        ),
+                    }
+                    for book_id, counters in sorted(batch.items())
+                ]
+                db.execute(_FLUSH_STATEMENT, params)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                # Не теряем инкременты: вернём их в буфер до следующей попытки
+                self._merge_back(batch)
+                metrics.increment("counters.flush_errors")
+                print(f"⚠️ Не удалось сбросить счётчики книг: {e}")
+                return 0
+            finally:
+                db.close()
+
+            metrics.increment("counters.flushes")
+            metrics.set_gauge("counters.last_flush_books", len(params))
+            return len(params)
+
+    def start(self) -> None:
+        self._task.start()
+
+    def stop(self) -> None:
+        """Останавливает фоновый сброс и записывает остаток буфера."""
+        self._task.stop()
+        self.flush()
+
+
+book_counters = CounterBuffer(
+    flush_interval=settings.counter_flush_interval,
+    max_pending=settings.counter_max_pending,
+)
@@ -0,0 +1,276 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from sqlalchemy import bindparam, func, literal, select, update
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.tasks import PeriodicTask
+from app.models import SessionLocal
+from app.models.book import Book, ReadingSession, Review
+from app.models.system import JobState
+
+# Вклад одного события в рейтинг (отзыв умножается ещё и на оценку 1-5)
+WEIGHTS = {
+    "view": 1.0,
+    "download": 3.0,
+    "completed": 10.0,
+    "review": 1.0,
+}
+
+JOB_NAME = "popularity"
+
+# Вклад события хранится в «прямом» затухании: weight * 2^((t - epoch) / half_life).
+# Тогда порядок по сохранённому значению совпадает с порядком по затухшему
+# на текущий момент рейтингу, и старые записи не нужно переписывать — новые
+# события просто весят больше. Точка отсчёта и период полураспада хранятся
+# в job_state: множитель растёт без ограничений, поэтому раз в
+# RENORMALIZE_AFTER периодов все рейтинги делятся на него, а точка отсчёта
+# сдвигается на текущий момент. Смена периода в настройках пересчитывает
+# рейтинг заново.
+_LEGACY_EPOCH = datetime(2024, 1, 1)
+RENORMALIZE_AFTER = 64
+_BATCH_SIZE = 1000
+
+_books = Book.__table__
+
+_ADD_STATEMENT = (
+    update(_books)
+    .where(_books.c.id == bindparam("book_id"))
+    .values(popularity_score=func.coalesce(_books.c.popularity_score, 0) + bindparam("score_delta"))
+)
+_SET_STATEMENT = (
+    update(_books)
+    .where(_books.c.id == bindparam("book_id"))
+    .values(popularity_score=bindparam("score"))
+)
+_RESCALE_STATEMENT = (
+    update(_books)
+    .where(_books.c.popularity_score != 0)
+    .values(popularity_score=_books.c.popularity_score / bindparam("factor"))
+)
+
+
+def _naive_utc(moment: datetime) -> datetime:
+    if moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+@dataclass(frozen=True)
+class DecayClock:
+    """Точка отсчёта и период полураспада, в которых хранится рейтинг."""
+    epoch: datetime
+    half_life_hours: float
+
+    def half_lives(self, moment: datetime) -> float:
+        return (_naive_utc(moment) - self.epoch).total_seconds() / (self.half_life_hours * 3600)
+
+    def boost(self, moment: datetime) -> float:
+        """Множитель события в момент moment (удваивается каждые half_life часов)."""
+        return 2.0 ** self.half_lives(moment)
+
+    def to_params(self) -> dict:
+        return {"epoch": self.epoch.isoformat(), "half_life_hours": self.half_life_hours}
+
+    @classmethod
+    def from_params(cls, params: Optional[dict]) -> "DecayClock":
+        if not params:
+            # Рейтинг, посчитанный до хранения параметров в job_state
+            return cls(_LEGACY_EPOCH, settings.popularity_half_life_hours)
+        return cls(datetime.fromisoformat(params["epoch"]), float(params["half_life_hours"]))
+
+
+def load_clock(db: Session, lock: bool = False) -> DecayClock:
+    """Текущие параметры затухания из job_state.
+
+    lock=True берёт разделяемую блокировку строки до конца транзакции:
+    тогда перенормировка не пройдёт между чтением параметров и записью
+    посчитанных по ним вкладов (на SQLite записи и так последовательны).
+    """
+    query = select(JobState.params).where(JobState.name == JOB_NAME)
+    if lock:
+        query = query.with_for_update(read=True)
+    return DecayClock.from_params(db.execute(query).scalar_one_or_none())
+
+
+def decay_boost(moment: datetime, clock: Optional[DecayClock] = None) -> float:
+    """Множитель события в момент moment; без clock — от исходной точки отсчёта."""
+    return (clock or DecayClock.from_params(None)).boost(moment)
+
+
+def counter_score(views: int, downloads: int, moment: datetime, clock: DecayClock) -> float:
+    return (WEIGHTS["view"] * views + WEIGHTS["download"] * downloads) * clock.boost(moment)
+
+
+def current_score(stored: float, clock: DecayClock, now: Optional[datetime] = None) -> float:
+    """Затухший на момент now рейтинг — для показа, сортировке он не нужен."""
+    return (stored or 0.0) / clock.boost(now or datetime.utcnow())
+
+
+def _moment_literal(value: datetime, column, dialect_name: str):
+    if dialect_name == "sqlite":
+        # server_default=now() в SQLite — текст с точностью до секунды,
+        # поэтому границы окна тоже без долей секунды
+        return literal(value.strftime("%Y-%m-%d %H:%M:%S"))
+    return literal(value.replace(tzinfo=timezone.utc), column.type)
+
+
+def _event_scores(db: Session, since: Optional[datetime], until: datetime, clock: DecayClock) -> Dict[int, float]:
+    """Вклад завершённых чтений и одобренных отзывов за окно (since, until]."""
+    dialect_name = db.get_bind().dialect.name
+    scores: Dict[int, float] = defaultdict(float)
+
+    sessions = select(ReadingSession.book_id, ReadingSession.end_time).where(
+        ReadingSession.is_completed.is_(True),
+        ReadingSession.end_time <= _moment_literal(until, ReadingSession.end_time, dialect_name),
+    )
+    if since is not None:
+        sessions = sessions.where(
+            ReadingSession.end_time > _moment_literal(since, ReadingSession.end_time, dialect_name)
+        )
+    for book_id, end_time in db.execute(sessions):
+        scores[book_id] += WEIGHTS["completed"] * clock.boost(end_time)
+
+    reviews = select(Review.book_id, Review.rating, Review.created_at).where(
+        Review.is_approved.is_(True),
+        Review.created_at <= _moment_literal(until, Review.created_at, dialect_name),
+    )
+    if since is not None:
+        reviews = reviews.where(Review.created_at > _moment_literal(since, Review.created_at, dialect_name))
+    for book_id, rating, created_at in db.execute(reviews):
+        scores[book_id] += WEIGHTS["review"] * (rating or 0) * clock.boost(created_at or until)
+
+    return scores
+
+
+def rebuild_popularity(db: Session, now: datetime, clock: DecayClock) -> int:
+    """Полный пересчёт: накопленные просмотры и скачивания относим ко дню
+    добавления книги, к ним добавляем все завершённые чтения и отзывы."""
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(Book.id, Book.view_count, Book.download_count, Book.created_at)
+            .where(Book.id > last_id)
+            .order_by(Book.id)
+            .limit(_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        db.execute(_SET_STATEMENT, [
+            {
+                "book_id": book_id,
+                "score": counter_score(views or 0, downloads or 0, created_at or now, clock),
+            }
+            for book_id, views, downloads, created_at in rows
+        ])
+        updated += len(rows)
+        last_id = rows[-1][0]
+
+    _add_scores(db, _event_scores(db, None, now, clock))
+    return updated
+
+
+def renormalize_popularity(db: Session, clock: DecayClock, now: datetime) -> DecayClock:
+    """Делит все рейтинги на множитель момента now и сдвигает туда точку отсчёта.
+
+    Порядок книг не меняется. Вызывается в транзакции, которая уже
+    заблокировала строку задачи в job_state.
+    """
+    factor = clock.boost(now)
+    renormalized = DecayClock(_naive_utc(now), clock.half_life_hours)
+    _save_clock(db, renormalized)
+    db.execute(_RESCALE_STATEMENT, {"factor": factor})
+    metrics.increment("popularity.renormalizations")
+    print(f"✅ Рейтинг популярности перенормирован (множитель {factor:.3g})")
+    return renormalized
+
+
+def _save_clock(db: Session, clock: DecayClock) -> None:
+    db.execute(update(JobState).where(JobState.name == JOB_NAME).values(params=clock.to_params()))
+
+
+def _add_scores(db: Session, scores: Dict[int, float]) -> None:
+    if scores:
+        db.execute(_ADD_STATEMENT, [
+            {"book_id": book_id, "score_delta": score} for book_id, score in sorted(scores.items())
+        ])
+
+
+def update_popularity(db: Session, now: Optional[datetime] = None) -> int:
+    """Добавляет к рейтингу события, появившиеся с прошлого запуска.
+
+    Просмотры и скачивания попадают в рейтинг при сбросе счётчиков
+    (app/services/counters.py), здесь — завершённые чтения и отзывы.
+    Первый запуск и смена периода полураспада пересчитывают рейтинг
+    целиком. Возвращает число книг.
+    """
+    now = (now or datetime.utcnow()).replace(microsecond=0)
+    since = db.execute(select(JobState.last_run_at).where(JobState.name == JOB_NAME)).scalar_one_or_none()
+    if since is None:
+        clock = DecayClock(now, settings.popularity_half_life_hours)
+        # При гонке воркеров второй INSERT упадёт на первичном ключе
+        db.add(JobState(name=JOB_NAME, last_run_at=now, params=clock.to_params()))
+        db.flush()
+        updated = rebuild_popularity(db, now, clock)
+    else:
+        if since >= now:
+            return 0
+        # Сдвигаем отметку условно: если её уже сдвинул другой воркер,
+        # окно обработано им, и события не будут учтены дважды
+        claimed = db.execute(
+            update(JobState)
+            .where(JobState.name == JOB_NAME, JobState.last_run_at == since)
+            .values(last_run_at=now)
+        ).rowcount
+        if not claimed:
+            db.rollback()
+            return 0
+        clock = load_clock(db)
+        if clock.half_life_hours != settings.popularity_half_life_hours:
+            print(
+                f"⚠️ Период полураспада изменился ({clock.half_life_hours} -> "
+                f"{settings.popularity_half_life_hours} ч), рейтинг популярности пересчитывается"
+            )
+            clock = DecayClock(now, settings.popularity_half_life_hours)
+            _save_clock(db, clock)
+            updated = rebuild_popularity(db, now, clock)
+        else:
+            if clock.half_lives(now) >= RENORMALIZE_AFTER:
+                clock = renormalize_popularity(db, clock, now)
+            scores = _event_scores(db, since, now, clock)
+            _add_scores(db, scores)
+            updated = len(scores)
+    db.commit()
+
+    metrics.increment("popularity.runs")
+    metrics.set_gauge("popularity.last_run_books", updated)
+    return updated
+
+
+class PopularityRanker:
+    """Периодический пересчёт рейтинга популярности в фоновом потоке."""
+
+    def __init__(self, interval: float):
+        self._task = PeriodicTask("popularity", interval, self.run, run_immediately=True)
+
+    def run(self) -> int:
+        db = SessionLocal()
+        try:
+            return update_popularity(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def start(self) -> None:
+        self._task.start()
+
+    def stop(self) -> None:
+        self._task.stop()
+
+
+popularity_ranker = PopularityRanker(interval=settings.popularity_interval)
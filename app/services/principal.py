@@ -0,0 +1,156 @@
+from typing import Any, Dict, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.cache import TwoTierCache
+from app.core.config import settings
+from app.core.security import verify_token
+from app.models import SessionLocal
+from app.models.user import User
+from app.schemas.user import Principal
+
+# Кэш снимков пользователей по user_id, общий для воркеров.
+# Старые токены без user_id кэшируются по имени пользователя из sub.
+principal_cache = TwoTierCache(
+    "principal",
+    maxsize=settings.principal_cache_size,
+    ttl=settings.principal_cache_ttl,
+    dumps=lambda principal: principal.model_dump_json().encode("utf-8"),
+    loads=Principal.model_validate_json,
+)
+
+
+def anonymous_state() -> Dict[str, Any]:
+    """Состояние request.state.user для неавторизованного посетителя."""
+    return {
+        "is_authenticated": False,
+        "username": None,
+        "role": None,
+        "user_id": None,
+        "email": None,
+        "full_name": None,
+        "created_at": None,
+        "is_active": False,
+    }
+
+
+def token_claims(user: User) -> Dict[str, Any]:
+    """Данные пользователя, которые кладутся в токен при входе."""
+    return {
+        "sub": user.username,
+        "uid": user.id,
+        "ver": user.token_version or 0,
+    }
+
+
+def _load_principal(db: Session, user_id: Optional[int], username: Optional[str]) -> Optional[Principal]:
+    query = db.query(User)
+    if user_id is not None:
+        user = query.filter(User.id == user_id).first()
+    else:
+        user = query.filter(User.username == username).first()
+    return Principal.model_validate(user) if user else None
+
+
+def _fetch_principal(db: Optional[Session], user_id: Optional[int], username: Optional[str]) -> Optional[Principal]:
+    if db is not None:
+        return _load_principal(db, user_id, username)
+    session = SessionLocal()
+    try:
+        return _load_principal(session, user_id, username)
+    finally:
+        session.close()
+
+
+def _cache_key(user_id: Optional[int], username: Optional[str]):
+    return user_id if user_id is not None else f"sub:{username}"
+
+
+def _token_identity(token: Optional[str]) -> Optional[Tuple[Optional[int], Optional[str], int]]:
+    """(user_id, username, версия) из проверенного токена или None."""
+    if not token:
+        return None
+
+    try:
+        payload = verify_token(token)
+    except HTTPException:
+        return None
+
+    user_id = payload.get("uid")
+    username = payload.get("sub")
+    if user_id is None and not username:
+        return None
+
+    return user_id, username, int(payload.get("ver", 0))
+
+
+def _is_stale(principal: Optional[Principal], version: int) -> bool:
+    # Снимок старее токена: пользователь успел войти заново после отзыва
+    return principal is None or principal.token_version < version
+
+
+def _valid(principal: Optional[Principal], version: int) -> Optional[Principal]:
+    # Токен выпущен до отзыва (например, до блокировки пользователя)
+    if principal is None or principal.token_version != version:
+        return None
+    return principal
+
+
+def resolve_principal(token: Optional[str], db: Optional[Session] = None) -> Optional[Principal]:
+    """Возвращает пользователя по токену, обращаясь к БД только при промахе кэша."""
+    identity = _token_identity(token)
+    if identity is None:
+        return None
+    user_id, username, version = identity
+
+    cache_key = _cache_key(user_id, username)
+    principal = principal_cache.get(cache_key)
+    if _is_stale(principal, version):
+        principal = _fetch_principal(db, user_id, username if user_id is None else None)
+        if principal is None:
+            return None
+        principal_cache.set(cache_key, principal)
+
+    return _valid(principal, version)
+
+
+async def resolve_principal_async(token: Optional[str], db: AsyncSession) -> Optional[Principal]:
+    """resolve_principal для async-обработчиков.
+
+    Попадание в L1 обслуживается прямо в цикле событий; L2 (сетевой) —
+    в пуле потоков, промах кэша загружается через AsyncSession.
+    """
+    identity = _token_identity(token)
+    if identity is None:
+        return None
+    user_id, username, version = identity
+
+    cache_key = _cache_key(user_id, username)
+    principal = principal_cache.get_local(cache_key)
+    if principal is None:
+        principal = await run_in_threadpool(principal_cache.get, cache_key)
+    if _is_stale(principal, version):
+        if user_id is not None:
+            statement = select(User).where(User.id == user_id)
+        else:
+            statement = select(User).where(User.username == username)
+        user = (await db.execute(statement)).scalars().first()
+        if user is None:
+            return None
+        principal = Principal.model_validate(user)
+        await run_in_threadpool(principal_cache.set, cache_key, principal)
+
+    return _valid(principal, version)
+
+
+def invalidate_principal(user_id: int, username: Optional[str] = None) -> None:
+    """Сбрасывает кэшированные снимки пользователя после изменения его данных.
+
+    username — имя, под которым пользователь мог быть закэширован по старому
+    токену без user_id (до переименования — прежнее имя).
+    """
+    principal_cache.delete(user_id)
+    if username:
+        principal_cache.delete(_cache_key(None, username))
@@ -0,0 +1,201 @@
+from threading import Lock
+from typing import Dict, Optional, Tuple
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.tasks import PeriodicTask
+from app.models import SessionLocal
+from app.services.user_stats import session_progress, update_reading_progress, write_progress_batch
+
+
+class ProgressBuffer:
+    """Буфер сохранений прогресса чтения с объединением записей.
+
+    Пока читатель двигает ползунок, в памяти воркера для пары
+    (user_id, book_id) хранится только последнее значение; раз в
+    flush_interval секунд буфер пишется многострочным upsert'ом. Завершение
+    книги записывается сразу: от него зависит проверка при создании отзыва.
+
+    Буфер ограничен max_buffered парами: если записи в БД не проходят
+    и буфер заполнен, новые пары сохраняются сразу, минуя буфер.
+    """
+
+    # Ошибки, которые не исчезнут при повторе: строку пропускаем
+    PERMANENT_ERRORS = (IntegrityError, DataError)
+
+    def __init__(self, flush_interval: float, max_pending: int, max_buffered: int):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_buffered = max_buffered
+        self._pending: Dict[Tuple[int, int], dict] = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._task = PeriodicTask("progress-flush", flush_interval, self.flush)
+
+    def save(
+        self,
+        db: Session,
+        user_id: int,
+        book_id: int,
+        progress_percentage: int,
+        pages_read: Optional[int] = None,
+        is_completed: Optional[bool] = None,
+    ) -> dict:
+        """Сохраняет прогресс; возвращает его в формате ответа API.
+
+        У ещё не записанной сессии id в ответе — None.
+        """
+        normalized_progress = max(0, min(100, progress_percentage))
+        completed = normalized_progress >= 100
+        if is_completed is not None:
+            completed = is_completed
+
+        if completed:
+            # Под блокировкой сброса: иначе устаревшее значение из уже
+            # забранной пачки могло бы записаться после завершения
+            # и открыть новую активную сессию
+            with self._flush_lock:
+                with self._lock:
+                    self._pending.pop((user_id, book_id), None)
+                session = update_reading_progress(
+                    db, user_id, book_id, progress_percentage,
+                    pages_read=pages_read, is_completed=True,
+                )
+            metrics.increment("progress.immediate_writes")
+            return session_progress(session)
+
+        with self._lock:
+            entry = self._pending.get((user_id, book_id))
+            full = entry is None and len(self._pending) >= self.max_buffered
+            if not full:
+                if entry is None:
+                    entry = self._pending[(user_id, book_id)] = {"user_id": user_id, "book_id": book_id, "pages_read": None}
+                else:
+                    metrics.increment("progress.coalesced")
+                entry["progress_percentage"] = normalized_progress
+                if pages_read is not None:
+                    entry["pages_read"] = max(0, pages_read)
+                snapshot = dict(entry)
+            overflow = len(self._pending) >= self.max_pending
+
+        if full:
+            # Буфер не сбрасывается (например, БД недоступна): пишем сразу,
+            # чтобы память воркера не росла без ограничений
+            with self._flush_lock:
+                session = update_reading_progress(
+                    db, user_id, book_id, progress_percentage,
+                    pages_read=pages_read, is_completed=False,
+                )
+            metrics.increment("progress.buffer_full_writes")
+            return session_progress(session)
+
+        metrics.increment("progress.buffered")
+        if overflow:
+            self._task.wake()
+
+        return {
+            "id": None,
+            "book_id": book_id,
+            "progress_percentage": snapshot["progress_percentage"],
+            "pages_read": snapshot["pages_read"],
+            "is_completed": False,
+        }
+
+    def pending(self, user_id: int, book_id: int) -> Optional[dict]:
+        """Ещё не записанный прогресс книги — чтобы читатель сразу видел своё значение."""
+        with self._lock:
+            entry = self._pending.get((user_id, book_id))
+            return dict(entry) if entry else None
+
+    def pending_for_user(self, user_id: int) -> Dict[int, dict]:
+        with self._lock:
+            return {book_id: dict(entry) for (owner_id, book_id), entry in self._pending.items() if owner_id == user_id}
+
+    def overlay(self, progress: dict, pending: Optional[dict]) -> dict:
+        """Накладывает незаписанный прогресс на прочитанный из БД."""
+        if pending and not progress.get("is_completed"):
+            progress["progress_percentage"] = pending["progress_percentage"]
+            if pending["pages_read"] is not None:
+                progress["pages_read"] = pending["pages_read"]
+        return progress
+
+    def _requeue(self, batch: Dict[Tuple[int, int], dict]) -> None:
+        """Возвращает в буфер то, что не успели обновить заново, в пределах max_buffered."""
+        dropped = 0
+        with self._lock:
+            for key, entry in batch.items():
+                if key in self._pending:
+                    continue
+                if len(self._pending) >= self.max_buffered:
+                    dropped += 1
+                    continue
+                self._pending[key] = entry
+        if dropped:
+            metrics.increment("progress.dropped", dropped)
+            print(f"⚠️ Буфер прогресса чтения переполнен, отброшено записей: {dropped}")
+
+    def _write_rows(self, db: Session, batch: Dict[Tuple[int, int], dict]) -> int:
+        """Пишет пачку по одной строке, чтобы одна плохая строка не блокировала остальные."""
+        written = 0
+        items = list(batch.items())
+        for position, (key, entry) in enumerate(items):
+            try:
+                written += write_progress_batch(db, [entry])
+            except self.PERMANENT_ERRORS as e:
+                db.rollback()
+                metrics.increment("progress.dropped")
+                print(f"⚠️ Прогресс чтения {key} отброшен: {e}")
+            except Exception as e:
+                db.rollback()
+                # Временная ошибка: оставшиеся строки повторим при следующем сбросе
+                self._requeue(dict(items[position:]))
+                metrics.increment("progress.flush_errors")
+                print(f"⚠️ Не удалось записать прогресс чтения: {e}")
+                break
+        return written
+
+    def flush(self) -> int:
+        """Записывает накопленный прогресс; возвращает число сессий."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            db = SessionLocal()
+            try:
+                try:
+                    written = write_progress_batch(db, list(batch.values()))
+                except self.PERMANENT_ERRORS:
+                    db.rollback()
+                    metrics.increment("progress.batch_splits")
+                    written = self._write_rows(db, batch)
+            except Exception as e:
+                db.rollback()
+                # Временная ошибка (например, обрыв соединения): повторим в следующий раз
+                self._requeue(batch)
+                metrics.increment("progress.flush_errors")
+                print(f"⚠️ Не удалось записать прогресс чтения: {e}")
+                return 0
+            finally:
+                db.close()
+
+            metrics.increment("progress.flushes")
+            metrics.set_gauge("progress.last_flush_sessions", written)
+            return written
+
+    def start(self) -> None:
+        self._task.start()
+
+    def stop(self) -> None:
+        """Останавливает фоновый сброс и записывает остаток буфера."""
+        self._task.stop()
+        self.flush()
+
+
+progress_buffer = ProgressBuffer(
+    flush_interval=settings.progress_flush_interval,
+    max_pending=settings.progress_max_pending,
+    max_buffered=settings.progress_max_buffered,
+)
@@ -0,0 +1,169 @@
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+from sqlalchemy import Float, bindparam, case, cast, event, func, inspect, or_, select, update
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.tasks import PeriodicTask
+from app.models import SessionLocal
+from app.models.book import Book, Review
+
+STARS = range(1, 6)
+
+# Столбцы агрегатов Book, которые сверяются с рецензиями
+AGGREGATE_COLUMNS = ("rating_sum", "rating_count") + tuple(f"rating_{stars}_count" for stars in STARS)
+
+_books = Book.__table__
+
+
+def _apply_delta_statement():
+    new_sum = _books.c.rating_sum + bindparam("d_sum")
+    new_count = _books.c.rating_count + bindparam("d_count")
+    values = {
+        "rating_sum": new_sum,
+        "rating_count": new_count,
+        # Средний рейтинг из тех же новых значений; в SET справа видны старые значения строки
+        "rating": case((new_count > 0, cast(new_sum, Float) / new_count), else_=0),
+    }
+    for stars in STARS:
+        column = f"rating_{stars}_count"
+        values[column] = _books.c[column] + bindparam(f"d_{stars}")
+    return update(_books).where(_books.c.id == bindparam("b_id")).values(values)
+
+
+_APPLY_DELTA_STATEMENT = _apply_delta_statement()
+
+
+def _original(obj, attribute: str):
+    history = inspect(obj).attrs[attribute].history
+    return history.deleted[0] if history.deleted else getattr(obj, attribute)
+
+
+def _contribution(book_id, rating, is_approved) -> Optional[Tuple[int, int]]:
+    # is_approved по умолчанию False, поэтому NULL до вставки — не одобрена
+    if not is_approved or book_id is None or rating not in STARS:
+        return None
+    return book_id, rating
+
+
+def _current(review: Review):
+    return _contribution(review.book_id, review.rating, review.is_approved)
+
+
+def _committed(review: Review):
+    return _contribution(
+        _original(review, "book_id"), _original(review, "rating"), _original(review, "is_approved")
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _track_reviews(session: Session, _flush_context) -> None:
+    """Изменяет агрегаты рейтинга книг в той же транзакции, что и сами рецензии.
+
+    Учитываются только одобренные рецензии: создание, одобрение, снятие
+    одобрения, смена оценки или книги и удаление.
+    """
+    deltas: Dict[Tuple[int, int], int] = defaultdict(int)
+    for review in session.new:
+        if isinstance(review, Review) and _current(review):
+            deltas[_current(review)] += 1
+    for review in session.deleted:
+        if isinstance(review, Review) and _committed(review):
+            deltas[_committed(review)] -= 1
+    for review in session.dirty:
+        if not isinstance(review, Review):
+            continue
+        before, after = _committed(review), _current(review)
+        if before != after:
+            if before:
+                deltas[before] -= 1
+            if after:
+                deltas[after] += 1
+
+    per_book: Dict[int, dict] = {}
+    for (book_id, rating), delta in deltas.items():
+        if not delta:
+            continue
+        params = per_book.setdefault(
+            book_id, {"b_id": book_id, "d_sum": 0, "d_count": 0, **{f"d_{stars}": 0 for stars in STARS}}
+        )
+        params["d_sum"] += rating * delta
+        params["d_count"] += delta
+        params[f"d_{rating}"] += delta
+
+    if per_book:
+        # Строки книг блокируются в порядке id, чтобы параллельные транзакции не взаимоблокировались
+        session.connection().execute(_APPLY_DELTA_STATEMENT, [per_book[book_id] for book_id in sorted(per_book)])
+
+
+def _real_aggregates():
+    return select(
+        Review.book_id,
+        func.sum(Review.rating).label("rating_sum"),
+        func.count().label("rating_count"),
+        *(func.sum(case((Review.rating == stars, 1), else_=0)).label(f"rating_{stars}_count") for stars in STARS),
+    ).where(Review.is_approved == True).group_by(Review.book_id).subquery("real")
+
+
+def _approved_reviews(expression, *criteria):
+    return select(expression).where(
+        Review.book_id == _books.c.id, Review.is_approved == True, *criteria
+    ).scalar_subquery()
+
+
+def reconcile_book_ratings(db: Session) -> int:
+    """Сверяет агрегаты рейтинга книг с одобренными рецензиями и исправляет расхождения.
+
+    Возвращает число исправленных книг.
+    """
+    real = _real_aggregates()
+    drifted = db.execute(
+        select(_books.c.id)
+        .outerjoin(real, real.c.book_id == _books.c.id)
+        .where(or_(*(func.coalesce(real.c[name], 0) != _books.c[name] for name in AGGREGATE_COLUMNS)))
+    ).scalars().all()
+
+    if drifted:
+        # Значения считаются подзапросами в самом UPDATE, а не берутся из прочитанного
+        # выше, чтобы не затереть рецензии, закоммиченные между запросами
+        values = {
+            "rating_sum": _approved_reviews(func.coalesce(func.sum(Review.rating), 0)),
+            "rating_count": _approved_reviews(func.count()),
+            "rating": _approved_reviews(func.coalesce(func.avg(Review.rating), 0)),
+        }
+        for stars in STARS:
+            values[f"rating_{stars}_count"] = _approved_reviews(func.count(), Review.rating == stars)
+        db.execute(update(_books).where(_books.c.id.in_(drifted)).values(values))
+    db.commit()
+
+    metrics.increment("book_ratings.reconciliations")
+    if drifted:
+        metrics.increment("book_ratings.corrections", len(drifted))
+        print(f"⚠️ Исправлены агрегаты рейтинга у книг: {len(drifted)}")
+    return len(drifted)
+
+
+def ensure_book_ratings() -> None:
+    """Заполняет агрегаты при старте, например после добавления столбцов."""
+    db = SessionLocal()
+    try:
+        reconcile_book_ratings(db)
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Не удалось проверить агрегаты рейтинга книг: {e}")
+    finally:
+        db.close()
+
+
+def _reconcile() -> int:
+    db = SessionLocal()
+    try:
+        return reconcile_book_ratings(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+ratings_reconciler = PeriodicTask("book-ratings", settings.book_ratings_reconcile_interval, _reconcile)
@@ -0,0 +1,216 @@
+"""Полнотекстовый поиск по каталогу.
+
+PostgreSQL: взвешенный Book.search_vector (tsvector) с GIN-индексом и ts_rank.
+SQLite: виртуальная таблица FTS5 books_fts с ранжированием bm25.
+
+Индекс обновляется при создании/изменении книги и при переименовании автора
+или категории. Для уже существующих строк есть команда заполнения:
+
+    python -m app.services.search backfill
+"""
+import re
+import sys
+from typing import Iterable, List, Optional
+from sqlalchemy import Float, Integer, bindparam, column, func, select, table, text
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models import engine
+from app.models.book import Book, book_authors, book_categories
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_FTS_TABLE = "books_fts"
+
+_SQLITE_CREATE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {_FTS_TABLE} USING fts5(
+    title, subtitle, authors, categories, description,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+# Веса столбцов для bm25 в том же порядке, что и в таблице FTS5
+_SQLITE_WEIGHTS = "10.0, 4.0, 4.0, 2.0, 1.0"
+
+
+def _fold_sql(expression: str) -> str:
+    # ё/Ё приводим к е/Е как при индексации, так и в запросе
+    return f"replace(replace(coalesce({expression}, ''), 'ё', 'е'), 'Ё', 'Е')"
+
+
+_AUTHORS_SQL = {
+    "sqlite": "SELECT group_concat(a.first_name || ' ' || a.last_name, ' ') FROM authors a "
+              "JOIN book_authors ba ON ba.author_id = a.id WHERE ba.book_id = b.id",
+    "postgresql": "SELECT string_agg(a.first_name || ' ' || a.last_name, ' ') FROM authors a "
+                  "JOIN book_authors ba ON ba.author_id = a.id WHERE ba.book_id = b.id",
+}
+
+_CATEGORIES_SQL = {
+    "sqlite": "SELECT group_concat(c.name, ' ') FROM categories c "
+              "JOIN book_categories bc ON bc.category_id = c.id WHERE bc.book_id = b.id",
+    "postgresql": "SELECT string_agg(c.name, ' ') FROM categories c "
+                  "JOIN book_categories bc ON bc.category_id = c.id WHERE bc.book_id = b.id",
+}
+
+_fts_available: Optional[bool] = None
+
+
+def _dialect(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+
+def ensure_search_schema() -> None:
+    """Создаёт таблицу FTS5 на SQLite и дозаполняет индекс для новых строк."""
+    global _fts_available
+
+    if engine.dialect.name == "sqlite":
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(_SQLITE_CREATE))
+            _fts_available = True
+        except Exception as e:
+            print(f"⚠️ FTS5 недоступен, поиск работает через LIKE: {e}")
+            _fts_available = False
+            return
+
+    with Session(engine) as db:
+        indexed = backfill(db, only_missing=True)
+        if indexed:
+            print(f"✅ Поисковый индекс заполнен для {indexed} книг")
+
+
+def _fts_enabled(dialect: str) -> bool:
+    if dialect == "postgresql":
+        return True
+    if dialect == "sqlite":
+        return bool(_fts_available)
+    return False
+
+
+def fts_available(db: Session) -> bool:
+    return _fts_enabled(_dialect(db))
+
+
+def refresh_search_index(db: Session, book_ids: Iterable[int]) -> None:
+    """Пересчитывает поисковые данные книг в текущей транзакции."""
+    ids = sorted({book_id for book_id in book_ids if book_id is not None})
+    if not ids or not fts_available(db):
+        return
+
+    dialect = _dialect(db)
+    ids_param = bindparam("ids", expanding=True)
+
+    if dialect == "postgresql":
+        config = "CAST(:config AS regconfig)"
+        statement = text(f"""
+            UPDATE books AS b SET search_vector =
+                setweight(to_tsvector({config}, {_fold_sql('b.title')}), 'A') ||
+                setweight(to_tsvector({config}, {_fold_sql('b.subtitle')}), 'B') ||
+                setweight(to_tsvector({config}, {_fold_sql('(' + _AUTHORS_SQL[dialect] + ')')}), 'B') ||
+                setweight(to_tsvector({config}, {_fold_sql('(' + _CATEGORIES_SQL[dialect] + ')')}), 'C') ||
+                setweight(to_tsvector({config}, {_fold_sql('b.description')}), 'D')
+            WHERE b.id IN :ids
+        """).bindparams(ids_param)
+        db.execute(statement, {"ids": ids, "config": settings.search_language})
+        return
+
+    db.execute(text(f"DELETE FROM {_FTS_TABLE} WHERE rowid IN :ids").bindparams(ids_param), {"ids": ids})
+    db.execute(text(f"""
+        INSERT INTO {_FTS_TABLE} (rowid, title, subtitle, authors, categories, description)
+        SELECT b.id,
+               {_fold_sql('b.title')},
+               {_fold_sql('b.subtitle')},
+               {_fold_sql('(' + _AUTHORS_SQL[dialect] + ')')},
+               {_fold_sql('(' + _CATEGORIES_SQL[dialect] + ')')},
+               {_fold_sql('b.description')}
+        FROM books AS b
+        WHERE b.id IN :ids
+    """).bindparams(ids_param), {"ids": ids})
+
+
+def refresh_for_author(db: Session, author_id: int) -> List[int]:
+    """Пересчитывает поисковые данные книг автора; возвращает их id."""
+    book_ids = db.execute(
+        select(book_authors.c.book_id).where(book_authors.c.author_id == author_id)
+    ).scalars().all()
+    refresh_search_index(db, book_ids)
+    return book_ids
+
+
+def refresh_for_category(db: Session, category_id: int) -> List[int]:
+    """Пересчитывает поисковые данные книг категории; возвращает их id."""
+    book_ids = db.execute(
+        select(book_categories.c.book_id).where(book_categories.c.category_id == category_id)
+    ).scalars().all()
+    refresh_search_index(db, book_ids)
+    return book_ids
+
+
+def _query_tokens(query_text: str) -> List[str]:
+    folded = query_text.replace("ё", "е").replace("Ё", "Е")
+    return _TOKEN_RE.findall(folded)
+
+
+def apply_text_search(query, query_text: str, dialect: str):
+    """Фильтрует запрос (Query или select()) по полнотекстовому индексу
+    и сортирует по релевантности.
+
+    Возвращает None, если полнотекстовый индекс недоступен.
+    """
+    if not _fts_enabled(dialect):
+        return None
+
+    tokens = _query_tokens(query_text)
+    if not tokens:
+        return query
+
+    if dialect == "postgresql":
+        # Каждое слово — префикс: «войн» находит «война», как и прежний ILIKE
+        ts_query = func.to_tsquery(settings.search_language, " & ".join(f"{token}:*" for token in tokens))
+        rank = func.ts_rank(Book.search_vector, ts_query)
+        return query.filter(Book.search_vector.op("@@")(ts_query)).order_by(rank.desc(), Book.id.desc())
+
+    match = " ".join(f'"{token}"*' for token in tokens)
+    matches = text(
+        f"SELECT rowid AS book_id, bm25({_FTS_TABLE}, {_SQLITE_WEIGHTS}) AS rank "
+        f"FROM {_FTS_TABLE} WHERE {_FTS_TABLE} MATCH :match"
+    ).bindparams(match=match).columns(book_id=Integer, rank=Float).subquery("fts_matches")
+    return query.join(matches, matches.c.book_id == Book.id).order_by(matches.c.rank.asc(), Book.id.desc())
+
+
+def backfill(db: Session, batch_size: int = 1000, only_missing: bool = False) -> int:
+    """Заполняет поисковый индекс пачками; возвращает число обработанных книг."""
+    if not fts_available(db):
+        return 0
+
+    id_query = select(Book.id).order_by(Book.id)
+    if only_missing:
+        if _dialect(db) == "postgresql":
+            id_query = id_query.where(Book.search_vector.is_(None))
+        else:
+            indexed_ids = select(column("rowid")).select_from(table(_FTS_TABLE))
+            id_query = id_query.where(Book.id.not_in(indexed_ids))
+
+    processed = 0
+    last_id = 0
+    while True:
+        ids = db.execute(id_query.where(Book.id > last_id).limit(batch_size)).scalars().all()
+        if not ids:
+            break
+        refresh_search_index(db, ids)
+        db.commit()
+        processed += len(ids)
+        last_id = ids[-1]
+    return processed
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        print("Использование: python -m app.services.search backfill")
+        sys.exit(1)
+
+    from app.models import user as user_models  # noqa: F401
+
+    ensure_search_schema()
+    with Session(engine) as session:
+        total = backfill(session)
+    print(f"✅ Поисковый индекс пересчитан для {total} книг")
@@ -0,0 +1,280 @@
+import heapq
+import re
+import sys
+from array import array
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from threading import RLock
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session, selectinload
+from app.core.metrics import metrics
+from app.models.book import Book
+from app.schemas.book import BookSearch
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Не разворачиваем префикс в слишком большое число терминов: для коротких
+# префиксов учитываются только первые по алфавиту термины (см. _prefix_ids)
+_MAX_PREFIX_EXPANSION = 512
+
+
+def normalize_terms(text: Optional[str]) -> List[str]:
+    """Токены в нижнем регистре с заменой ё на е."""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+def naive_utc(value: datetime) -> datetime:
+    """Время для ключа порядка: наивное UTC.
+
+    PostgreSQL возвращает created_at с часовым поясом, SQLite — без него;
+    в одном ключе их нельзя сравнивать.
+    """
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+@dataclass(frozen=True)
+class _IndexedBook:
+    terms: Tuple[str, ...]
+    order_key: Tuple[datetime, int]
+    language: Optional[str]
+    year: Optional[int]
+
+
+class CatalogIndex:
+    """Инвертированный индекс каталога в памяти процесса.
+
+    Постинги хранятся в отсортированных array('I') с id книг. Кроме слов
+    из названия, подзаголовка, авторов и категорий в индекс попадают
+    служебные термины для фильтров: «c:<id>» (категория), «a:<id>» (автор)
+    и «l:<язык>», поэтому BookSearch целиком отвечается без обращения к БД.
+
+    Индекс свой у каждого процесса и обновляется только изменениями,
+    прошедшими через этот процесс. Правки в другом воркере или напрямую
+    в БД он увидит лишь после перезапуска (rebuild), поэтому при
+    WEB_CONCURRENCY > 1 нужен search_backend="database".
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._postings: Dict[str, array] = {}
+        self._sorted_terms: List[str] = []
+        self._books: Dict[int, _IndexedBook] = {}
+        self._by_newest: List[Tuple[datetime, int]] = []
+        self.ready = False
+
+    def _book_terms(self, book: Book) -> Tuple[str, ...]:
+        terms: Set[str] = set()
+        terms.update(normalize_terms(book.title))
+        terms.update(normalize_terms(book.subtitle))
+        for author in book.authors:
+            terms.update(normalize_terms(author.first_name))
+            terms.update(normalize_terms(author.last_name))
+            terms.add(f"a:{author.id}")
+        for category in book.categories:
+            terms.update(normalize_terms(category.name))
+            terms.add(f"c:{category.id}")
+        if book.language:
+            terms.add(f"l:{book.language}")
+        return tuple(sorted(terms))
+
+    def _add_posting(self, term: str, book_id: int) -> None:
+        postings = self._postings.get(term)
+        if postings is None:
+            self._postings[term] = array("I", [book_id])
+            insort(self._sorted_terms, term)
+            return
+        position = bisect_left(postings, book_id)
+        if position == len(postings) or postings[position] != book_id:
+            postings.insert(position, book_id)
+
+    def _remove_posting(self, term: str, book_id: int) -> None:
+        postings = self._postings.get(term)
+        if postings is None:
+            return
+        position = bisect_left(postings, book_id)
+        if position < len(postings) and postings[position] == book_id:
+            del postings[position]
+        if not postings:
+            del self._postings[term]
+            del self._sorted_terms[bisect_left(self._sorted_terms, term)]
+
+    def add_book(self, book: Book) -> None:
+        """Добавляет или переиндексирует книгу; неактивные книги удаляются."""
+        if not book.is_active:
+            self.remove_book(book.id)
+            return
+
+        indexed = _IndexedBook(
+            terms=self._book_terms(book),
+            order_key=(naive_utc(book.created_at or datetime.min), book.id),
+            language=book.language,
+            year=book.publication_year,
+        )
+        with self._lock:
+            self.remove_book(book.id)
+            for term in indexed.terms:
+                self._add_posting(term, book.id)
+            self._books[book.id] = indexed
+            insort(self._by_newest, indexed.order_key)
+
+    def remove_book(self, book_id: int) -> None:
+        with self._lock:
+            indexed = self._books.pop(book_id, None)
+            if indexed is None:
+                return
+            for term in indexed.terms:
+                self._remove_posting(term, book_id)
+            del self._by_newest[bisect_left(self._by_newest, indexed.order_key)]
+
+    def refresh_books(self, db: Session, book_ids: Iterable[int]) -> None:
+        """Переиндексирует книги после изменения их авторов или категорий.
+
+        Вызывается после commit: книги перечитываются вместе со связями,
+        исчезнувшие из БД удаляются из индекса.
+        """
+        ids = set(book_ids)
+        if not self.ready or not ids:
+            return
+        books = db.query(Book).filter(Book.id.in_(ids)).options(
+            selectinload(Book.authors),
+            selectinload(Book.categories),
+        ).all()
+        with self._lock:
+            for book in books:
+                self.add_book(book)
+            for book_id in ids - {book.id for book in books}:
+                self.remove_book(book_id)
+
+    def rebuild(self, db: Session) -> None:
+        """Полностью перестраивает индекс по активным книгам."""
+        started = perf_counter()
+        books = db.query(Book).filter(Book.is_active == True).options(
+            selectinload(Book.authors),
+            selectinload(Book.categories),
+        ).all()
+
+        with self._lock:
+            self._postings.clear()
+            self._sorted_terms.clear()
+            self._books.clear()
+            self._by_newest.clear()
+            for book in books:
+                self.add_book(book)
+            self.ready = True
+
+        elapsed = perf_counter() - started
+        memory = self.memory_bytes()
+        metrics.set_gauge("search_index.books", len(self._books))
+        metrics.set_gauge("search_index.terms", len(self._postings))
+        metrics.set_gauge("search_index.memory_bytes", memory)
+        metrics.set_gauge("search_index.build_seconds", elapsed)
+        print(
+            f"✅ Поисковый индекс в памяти: {len(self._books)} книг, {len(self._postings)} терминов, "
+            f"{elapsed * 1000:.1f} мс, ~{memory / 1024:.0f} КиБ"
+        )
+
+    def _term_ids(self, term: str) -> array:
+        return self._postings.get(term, array("I"))
+
+    def _prefix_ids(self, token: str) -> Set[int]:
+        """Книги с терминами, начинающимися на token.
+
+        Берутся не больше _MAX_PREFIX_EXPANSION первых по алфавиту терминов,
+        книги с остальными в результат не попадают; такие усечения
+        считаются в search_index.prefix_truncated.
+        """
+        ids: Set[int] = set()
+        start = bisect_left(self._sorted_terms, token)
+        end = start + _MAX_PREFIX_EXPANSION
+        for term in self._sorted_terms[start:end]:
+            if not term.startswith(token):
+                return ids
+            ids.update(self._postings[term])
+        if end < len(self._sorted_terms) and self._sorted_terms[end].startswith(token):
+            metrics.increment("search_index.prefix_truncated")
+        return ids
+
+    def search(
+        self,
+        search: BookSearch,
+        limit: Optional[int] = None,
+        before: Optional[Tuple[datetime, int]] = None,
+    ) -> List[int]:
+        """Id книг, подходящих под запрос, в порядке «сначала новые».
+
+        limit — сколько первых id нужно (skip + размер страницы), before —
+        ключ порядка из курсора: возвращаются только книги старше него.
+        """
+        with self._lock:
+            candidates: Optional[Set[int]] = None
+
+            def narrow(ids: Iterable[int]) -> None:
+                nonlocal candidates
+                candidates = set(ids) if candidates is None else candidates.intersection(ids)
+
+            if search.category_id:
+                narrow(self._term_ids(f"c:{search.category_id}"))
+            if search.author_id:
+                narrow(self._term_ids(f"a:{search.author_id}"))
+            if search.language:
+                narrow(self._term_ids(f"l:{search.language}"))
+            for token in normalize_terms(search.query):
+                if candidates is not None and not candidates:
+                    break
+                narrow(self._prefix_ids(token))
+
+            year_min, year_max = search.year_min, search.year_max
+
+            def matches(indexed: _IndexedBook) -> bool:
+                if before is not None and not indexed.order_key < before:
+                    return False
+                if year_min or year_max:
+                    year = indexed.year
+                    if year is None or (year_min and year < year_min) or (year_max and year > year_max):
+                        return False
+                return True
+
+            if candidates is not None:
+                # Сортируются только кандидаты, а не весь каталог
+                keys = [
+                    indexed.order_key for indexed in (self._books.get(book_id) for book_id in candidates)
+                    if indexed is not None and matches(indexed)
+                ]
+                keys = sorted(keys, reverse=True) if limit is None else heapq.nlargest(limit, keys)
+                return [book_id for _, book_id in keys]
+
+            # Без фильтров по терминам — общий список от новых к старым до первых limit
+            end = len(self._by_newest) if before is None else bisect_left(self._by_newest, before)
+            result = []
+            for position in range(end - 1, -1, -1):
+                if limit is not None and len(result) >= limit:
+                    break
+                book_id = self._by_newest[position][1]
+                if matches(self._books[book_id]):
+                    result.append(book_id)
+            return result
+
+    def order_key(self, book_id: int) -> Optional[Tuple[datetime, int]]:
+        indexed = self._books.get(book_id)
+        return indexed.order_key if indexed else None
+
+    def memory_bytes(self) -> int:
+        """Приблизительный объём памяти, занимаемый индексом."""
+        with self._lock:
+            total = sys.getsizeof(self._postings) + sys.getsizeof(self._sorted_terms)
+            total += sys.getsizeof(self._books) + sys.getsizeof(self._by_newest)
+            for term, postings in self._postings.items():
+                total += sys.getsizeof(term) + sys.getsizeof(postings)
+            for indexed in self._books.values():
+                total += sys.getsizeof(indexed) + sys.getsizeof(indexed.terms)
+            total += sum(sys.getsizeof(key) for key in self._by_newest)
+            return total
+
+
+catalog_index = CatalogIndex()
@@ -0,0 +1,232 @@
+from collections import defaultdict
+from threading import Lock
+from typing import Dict
+from sqlalchemy import bindparam, event, func, inspect, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.tasks import PeriodicTask
+from app.models import SessionLocal
+from app.models.book import Author, Book, Category, ReadingSession, Review
+from app.models.system import SystemCounter
+from app.models.user import User
+
+# Счётчик -> (модель, флаг активности или None, если считаются все строки)
+COUNTERS = {
+    "users": (User, None),
+    "books": (Book, "is_active"),
+    "authors": (Author, None),
+    "categories": (Category, "is_active"),
+    "reviews": (Review, None),
+    "reading_sessions": (ReadingSession, None),
+}
+
+_MODELS = {model: (name, flag) for name, (model, flag) in COUNTERS.items()}
+
+_counters = SystemCounter.__table__
+
+_INCREMENT_STATEMENT = (
+    update(_counters)
+    .where(_counters.c.name == bindparam("counter_name"))
+    .values(value=_counters.c.value + bindparam("delta"))
+)
+
+
+def _is_counted(flag, value) -> bool:
+    # Флаги активности по умолчанию True, поэтому NULL до вставки считаем активным
+    return flag is None or value is not False
+
+
+def _flag_change(obj, flag) -> int:
+    history = inspect(obj).attrs[flag].history
+    if not history.deleted or not history.added:
+        return 0
+    return int(_is_counted(flag, history.added[0])) - int(_is_counted(flag, history.deleted[0]))
+
+
+_SESSION_DELTAS = "system_counter_deltas"
+
+
+def _session_deltas(session: Session) -> Dict[str, int]:
+    return session.info.setdefault(_SESSION_DELTAS, defaultdict(int))
+
+
+@event.listens_for(Session, "after_flush")
+def _track_changes(session: Session, _flush_context) -> None:
+    """Копит изменения счётчиков в сессии до commit.
+
+    Строки system_counters в транзакции записи не обновляются: иначе каждая
+    вставка держала бы блокировку общей строки счётчика до своего commit,
+    и все пишущие транзакции выстраивались бы в очередь.
+    """
+    deltas = _session_deltas(session)
+    for obj in session.new:
+        spec = _MODELS.get(type(obj))
+        if spec and _is_counted(spec[1], getattr(obj, spec[1], None) if spec[1] else None):
+            deltas[spec[0]] += 1
+    for obj in session.deleted:
+        spec = _MODELS.get(type(obj))
+        if spec and _is_counted(spec[1], getattr(obj, spec[1], None) if spec[1] else None):
+            deltas[spec[0]] -= 1
+    for obj in session.dirty:
+        spec = _MODELS.get(type(obj))
+        if spec and spec[1]:
+            deltas[spec[0]] += _flag_change(obj, spec[1])
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session: Session) -> None:
+    deltas = session.info.pop(_SESSION_DELTAS, None)
+    if deltas:
+        system_counter_buffer.add(deltas)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: Session) -> None:
+    session.info.pop(_SESSION_DELTAS, None)
+
+
+def adjust_system_counter(db: Session, name: str, delta: int) -> None:
+    """Изменение счётчика для записей в обход unit of work (INSERT ... ON CONFLICT и т.п.)."""
+    if delta:
+        _session_deltas(db)[name] += delta
+
+
+class SystemCounterBuffer:
+    """Дельты счётчиков закоммиченных транзакций с отложенной записью.
+
+    Раз в flush_interval секунд дельты всех транзакций воркера записываются
+    одним пакетным UPDATE в отдельной короткой транзакции. Дельты,
+    не записанные до аварийной остановки, теряются — расхождение исправляет
+    периодическая сверка (reconcile_system_counters).
+    """
+
+    def __init__(self, flush_interval: float):
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._task = PeriodicTask("system-counters-flush", flush_interval, self.flush)
+
+    def add(self, deltas: Dict[str, int]) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                self._pending[name] += delta
+
+    def pending(self) -> Dict[str, int]:
+        with self._lock:
+            return {name: delta for name, delta in self._pending.items() if delta}
+
+    def flush(self) -> int:
+        """Записывает накопленные дельты; возвращает число изменённых счётчиков."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, defaultdict(int)
+            params = [{"counter_name": name, "delta": delta} for name, delta in sorted(batch.items()) if delta]
+            if not params:
+                return 0
+
+            db = SessionLocal()
+            try:
+                db.execute(_INCREMENT_STATEMENT, params)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                # Не теряем дельты: вернём их в буфер до следующей попытки
+                self.add(batch)
+                metrics.increment("system_counters.flush_errors")
+                print(f"⚠️ Не удалось записать системные счётчики: {e}")
+                return 0
+            finally:
+                db.close()
+
+            metrics.increment("system_counters.flushes")
+            return len(params)
+
+    def start(self) -> None:
+        self._task.start()
+
+    def stop(self) -> None:
+        """Останавливает фоновую запись и записывает остаток буфера."""
+        self._task.stop()
+        self.flush()
+
+
+system_counter_buffer = SystemCounterBuffer(flush_interval=settings.system_counters_flush_interval)
+
+
+def _real_count(name: str):
+    model, flag = COUNTERS[name]
+    query = select(func.count()).select_from(model)
+    if flag:
+        query = query.where(getattr(model, flag) == True)
+    return query.scalar_subquery()
+
+
+def _counter_values(rows) -> Dict[str, int]:
+    values = dict(rows.all())
+    return {name: int(values.get(name) or 0) for name in COUNTERS}
+
+
+def get_system_counters(db: Session) -> Dict[str, int]:
+    """Все счётчики одним запросом."""
+    return _counter_values(db.execute(select(SystemCounter.name, SystemCounter.value)))
+
+
+async def get_system_counters_async(db: AsyncSession) -> Dict[str, int]:
+    return _counter_values(await db.execute(select(SystemCounter.name, SystemCounter.value)))
+
+
+def reconcile_system_counters(db: Session) -> Dict[str, int]:
+    """Сверяет счётчики с реальными COUNT(*) и исправляет расхождения.
+
+    Возвращает расхождения по счётчикам, которые пришлось исправить.
+    Перед сверкой записываются дельты этого воркера; дельты, которые другие
+    воркеры ещё держат в буфере, исправит следующая сверка.
+    """
+    system_counter_buffer.flush()
+    stored = dict(db.execute(select(SystemCounter.name, SystemCounter.value)).all())
+    for name in COUNTERS:
+        if name not in stored:
+            db.add(SystemCounter(name=name, value=0))
+    db.flush()
+
+    real = dict(db.execute(select(*(_real_count(name).label(name) for name in COUNTERS))).mappings().one())
+    drift = {name: real[name] - (stored.get(name) or 0) for name in COUNTERS if real[name] != (stored.get(name) or 0)}
+    for name in drift:
+        # Значение берём подзапросом в самом UPDATE, а не из прочитанного выше,
+        # чтобы не затереть изменения, закоммиченные между запросами
+        db.execute(update(SystemCounter).where(SystemCounter.name == name).values(value=_real_count(name)))
+    db.commit()
+
+    metrics.increment("system_counters.reconciliations")
+    if drift:
+        metrics.increment("system_counters.corrections", len(drift))
+        print(f"⚠️ Исправлены расхождения системных счётчиков: {drift}")
+    return drift
+
+
+def ensure_system_counters() -> None:
+    """Заполняет счётчики при старте, если их ещё нет или они разошлись."""
+    db = SessionLocal()
+    try:
+        reconcile_system_counters(db)
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Не удалось проверить системные счётчики: {e}")
+    finally:
+        db.close()
+
+
+def _reconcile() -> Dict[str, int]:
+    db = SessionLocal()
+    try:
+        return reconcile_system_counters(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+counters_reconciler = PeriodicTask("system-counters", settings.system_counters_reconcile_interval, _reconcile)
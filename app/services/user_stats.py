@@ -1,58 +1,99 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app.models.book import ReadingSession, Review, Book
-from app.models.user import User
-from datetime import datetime
-from typing import Optional
+from sqlalchemy import Boolean, case, delete, func, insert, literal_column, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from app.models.book import Author, ReadingSession, Review, Book, book_authors
+from app.models.user import user_favorites
+from app.services.system_counters import adjust_system_counter
+from datetime import datetime, timezone
+from typing import List, Optional
+
+
+def _span_seconds(dialect_name: str):
+    """Длительность сессии чтения в секундах (только у завершённых есть end_time)."""
+    if dialect_name == "sqlite":
+        return (func.julianday(ReadingSession.end_time) - func.julianday(ReadingSession.start_time)) * 86400
+    return func.extract("epoch", ReadingSession.end_time - ReadingSession.start_time)
+
+
+_EMPTY_STATS = {
+    "completed_books": 0,
+    "reading_books": 0,
+    "total_pages": 0,
+    "reviews_count": 0,
+    "favorites_count": 0,
+    "reading_time_hours": 0
+}
+
+
+def _reading_stats_statement(user_id: int, dialect_name: str):
+    reviews_count = select(func.count()).select_from(Review).where(
+        Review.user_id == user_id
+    ).scalar_subquery()
+    favorites_count = select(func.count()).select_from(user_favorites).where(
+        user_favorites.c.user_id == user_id
+    ).scalar_subquery()
+
+    return select(
+        func.coalesce(func.sum(case((ReadingSession.is_completed == True, 1), else_=0)), 0).label("completed"),
+        func.coalesce(func.sum(case((ReadingSession.is_completed == False, 1), else_=0)), 0).label("reading"),
+        func.coalesce(func.sum(ReadingSession.pages_read), 0).label("pages"),
+        func.coalesce(func.sum(_span_seconds(dialect_name)), 0).label("seconds"),
+        reviews_count.label("reviews"),
+        favorites_count.label("favorites"),
+    ).where(ReadingSession.user_id == user_id)
+
+
+def _reading_stats(row) -> dict:
+    return {
+        "completed_books": int(row.completed),
+        "reading_books": int(row.reading),
+        "total_pages": int(row.pages),
+        "reviews_count": row.reviews or 0,
+        "favorites_count": row.favorites or 0,
+        # Суммарная длительность завершённых сессий (от start_time до end_time)
+        "reading_time_hours": round(max(float(row.seconds), 0.0) / 3600, 1)
+    }
 
 
 def get_user_reading_stats(db: Session, user_id: int):
-    """Получить статистику чтения пользователя"""
-    try:
-        # Количество завершенных книг
-        completed_books = db.query(ReadingSession).filter(
-            ReadingSession.user_id == user_id,
-            ReadingSession.is_completed == True
-        ).count()
-
-        # Книги в процессе чтения
-        reading_books = db.query(ReadingSession).filter(
-            ReadingSession.user_id == user_id,
-            ReadingSession.is_completed == False
-        ).count()
-
-        # Всего прочитанных страниц
-        total_pages = db.query(func.sum(ReadingSession.pages_read)).filter(
-            ReadingSession.user_id == user_id
-        ).scalar() or 0
-
-        # Количество рецензий
-        reviews_count = db.query(Review).filter(Review.user_id == user_id).count()
-
-        # Время чтения (в часах) - упрощенная версия
-        reading_time_hours = completed_books * 2 + reading_books * 1
-
-        user = db.query(User).filter(User.id == user_id).first()
-        favorites_count = len(user.favorites) if user else 0
+    """Получить статистику чтения пользователя одним запросом.
 
-        return {
-            "completed_books": completed_books,
-            "reading_books": reading_books,
-            "total_pages": total_pages,
-            "reviews_count": reviews_count,
-            "favorites_count": favorites_count,
-            "reading_time_hours": reading_time_hours
-        }
+    Счётчики сессий считаются условной агрегацией по индексу
+    ix_reading_sessions_user_state, рецензии и избранное — подзапросами.
+    """
+    try:
+        return _reading_stats(db.execute(_reading_stats_statement(user_id, db.get_bind().dialect.name)).one())
     except Exception as e:
         print(f"Ошибка в get_user_reading_stats: {e}")
-        return {
-            "completed_books": 0,
-            "reading_books": 0,
-            "total_pages": 0,
-            "reviews_count": 0,
-            "favorites_count": 0,
-            "reading_time_hours": 0
-        }
+        return dict(_EMPTY_STATS)
+
+
+async def get_user_reading_stats_async(db: AsyncSession, user_id: int):
+    try:
+        row = (await db.execute(_reading_stats_statement(user_id, db.get_bind().dialect.name))).one()
+        return _reading_stats(row)
+    except Exception as e:
+        print(f"Ошибка в get_user_reading_stats_async: {e}")
+        return dict(_EMPTY_STATS)
+
+
+def _active_session_statement(user_id: int, book_id: int):
+    return select(ReadingSession).where(
+        ReadingSession.user_id == user_id,
+        ReadingSession.book_id == book_id,
+        ReadingSession.is_completed == False,
+    ).limit(1)
+
+
+def get_active_reading_session(db: Session, user_id: int, book_id: int) -> Optional[ReadingSession]:
+    """Активная сессия чтения книги (индекс ix_reading_sessions_user_book)."""
+    return db.scalar(_active_session_statement(user_id, book_id))
+
+
+async def get_active_reading_session_async(db: AsyncSession, user_id: int, book_id: int) -> Optional[ReadingSession]:
+    return await db.scalar(_active_session_statement(user_id, book_id))
 
 
 def ensure_reading_session(db: Session, user_id: int, book_id: int) -> ReadingSession:
@@ -61,11 +102,7 @@ def ensure_reading_session(db: Session, user_id: int, book_id: int) -> ReadingSe
     Если активной сессии (is_completed == False) нет, создаём новую и возвращаем её.
     """
     try:
-        session = db.query(ReadingSession).filter(
-            ReadingSession.user_id == user_id,
-            ReadingSession.book_id == book_id,
-            ReadingSession.is_completed == False,
-        ).first()
+        session = get_active_reading_session(db, user_id, book_id)
 
         if not session:
             session = ReadingSession(
@@ -76,7 +113,12 @@ def ensure_reading_session(db: Session, user_id: int, book_id: int) -> ReadingSe
                 is_completed=False,
             )
             db.add(session)
-            db.commit()
+            try:
+                db.commit()
+            except IntegrityError:
+                # Параллельный запрос уже создал активную сессию (uq_reading_sessions_active)
+                db.rollback()
+                return get_active_reading_session(db, user_id, book_id)
             db.refresh(session)
 
         return session
@@ -86,6 +128,65 @@ def ensure_reading_session(db: Session, user_id: int, book_id: int) -> ReadingSe
         raise
 
 
+def _dialect_insert(db: Session):
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def _progress_upsert(db: Session, rows: List[dict], update_pages: bool):
+    """INSERT ... ON CONFLICT DO UPDATE для незавершённых сессий (одна или несколько строк)."""
+    statement = _dialect_insert(db)(ReadingSession).values(rows)
+    changes = {
+        "progress_percentage": statement.excluded.progress_percentage,
+        "is_completed": statement.excluded.is_completed,
+        "end_time": statement.excluded.end_time,
+    }
+    if update_pages:
+        changes["pages_read"] = statement.excluded.pages_read
+    return statement.on_conflict_do_update(
+        index_elements=[ReadingSession.user_id, ReadingSession.book_id],
+        index_where=ReadingSession.is_completed == False,
+        set_=changes,
+    )
+
+
+# В PostgreSQL у строки, только что вставленной upsert'ом, xmax = 0,
+# а у обновлённой — id текущей транзакции
+_INSERTED = literal_column("(xmax = 0)", Boolean).label("inserted")
+
+
+def _count_active_sessions(db: Session, rows: List[dict]) -> int:
+    pairs = [(row["user_id"], row["book_id"]) for row in rows]
+    return db.scalar(
+        select(func.count()).select_from(ReadingSession).where(
+            ReadingSession.is_completed == False,
+            tuple_(ReadingSession.user_id, ReadingSession.book_id).in_(pairs),
+        )
+    )
+
+
+def _run_progress_upsert(db: Session, rows: List[dict], update_pages: bool, *returning):
+    """Выполняет upsert прогресса; возвращает строки RETURNING и число вставленных сессий.
+
+    Вставку отличает xmax в PostgreSQL. В SQLite его нет, и вставленные
+    строки считаются по числу активных сессий этих пар до и после upsert:
+    частичный уникальный индекс допускает не больше одной на пару.
+    """
+    statement = _progress_upsert(db, rows, update_pages)
+    options = {"populate_existing": True}
+    if db.get_bind().dialect.name == "postgresql":
+        result = db.execute(statement.returning(*returning, _INSERTED), execution_options=options).all()
+        return [row[:-1] for row in result], sum(1 for row in result if row.inserted)
+
+    before = _count_active_sessions(db, rows)
+    result = db.execute(statement.returning(*returning), execution_options=options).all()
+    if len(rows) == 1:
+        # Одна пара: вставка, если активной сессии до upsert не было
+        return result, int(before == 0)
+    return result, _count_active_sessions(db, rows) - before
+
+
 def update_reading_progress(
     db: Session,
     user_id: int,
@@ -94,66 +195,200 @@ def update_reading_progress(
     pages_read: Optional[int] = None,
     is_completed: Optional[bool] = None,
 ) -> ReadingSession:
-    """Обновить прогресс чтения книги для пользователя."""
-    session = ensure_reading_session(db, user_id, book_id)
+    """Обновить прогресс чтения книги для пользователя.
 
+    Сохранение — одна инструкция и один COMMIT: INSERT ... ON CONFLICT DO
+    UPDATE ... RETURNING по частичному уникальному индексу активных сессий
+    (в PostgreSQL и SQLite синтаксис одинаковый).
+    """
     normalized_progress = max(0, min(100, progress_percentage))
-    session.progress_percentage = normalized_progress
-    if pages_read is not None:
-        session.pages_read = max(0, pages_read)
-
     completed = normalized_progress >= 100
     if is_completed is not None:
         completed = is_completed
 
-    session.is_completed = completed
-    session.end_time = datetime.utcnow() if completed else None
+    now = datetime.now(timezone.utc)
+    changes = {
+        "progress_percentage": normalized_progress,
+        "is_completed": completed,
+        "end_time": now if completed else None,
+    }
+    if pages_read is not None:
+        changes["pages_read"] = max(0, pages_read)
+    # start_time задаётся только при вставке
+    new_row = {"user_id": user_id, "book_id": book_id, "start_time": now, "pages_read": 0, **changes}
 
-    db.add(session)
+    active = ReadingSession.is_completed == False
+    if completed:
+        # Завершённая строка не подпадает под частичный индекс, поэтому ON CONFLICT
+        # её не найдёт: закрываем активную сессию UPDATE'ом, а вставляем только
+        # если её не было
+        session = db.scalars(
+            update(ReadingSession)
+            .where(ReadingSession.user_id == user_id, ReadingSession.book_id == book_id, active)
+            .values(**changes)
+            .returning(ReadingSession),
+            execution_options={"populate_existing": True},
+        ).one_or_none()
+        inserted = session is None
+        if inserted:
+            session = db.scalars(
+                insert(ReadingSession).values(**new_row).returning(ReadingSession)
+            ).one()
+    else:
+        rows, inserted = _run_progress_upsert(
+            db, [new_row], pages_read is not None, ReadingSession
+        )
+        session = rows[0][0]
+
+    if inserted:
+        adjust_system_counter(db, "reading_sessions", 1)
+    # Отвязываем объект до COMMIT, чтобы его поля не истекли и не перечитывались
+    db.expunge(session)
     db.commit()
-    db.refresh(session)
     return session
 
 
-def get_user_reading_sessions(db: Session, user_id: int, active_only: bool = False):
-    """Получить сессии чтения пользователя"""
+def write_progress_batch(db: Session, entries: List[dict]) -> int:
+    """Записывает пачку незавершённого прогресса многострочными upsert'ами.
+
+    entries — словари с user_id, book_id, progress_percentage и pages_read
+    (None — страницы не менялись). Строки с страницами и без них идут
+    двумя инструкциями, так как набор обновляемых столбцов у них разный.
+    Возвращает число записанных строк.
+    """
+    started_at = datetime.now(timezone.utc)
+    inserted = 0
+    for update_pages in (True, False):
+        rows = [
+            {
+                "user_id": entry["user_id"],
+                "book_id": entry["book_id"],
+                "start_time": started_at,
+                "progress_percentage": entry["progress_percentage"],
+                "pages_read": entry["pages_read"] if update_pages else 0,
+                "is_completed": False,
+                "end_time": None,
+            }
+            for entry in entries
+            if (entry["pages_read"] is not None) == update_pages
+        ]
+        if not rows:
+            continue
+        _, batch_inserted = _run_progress_upsert(db, rows, update_pages, ReadingSession.id)
+        inserted += batch_inserted
+
+    adjust_system_counter(db, "reading_sessions", inserted)
+    db.commit()
+    return len(entries)
+
+
+def session_progress(session: ReadingSession) -> dict:
+    """Прогресс сессии в формате ответов API."""
+    return {
+        "id": session.id,
+        "book_id": session.book_id,
+        "progress_percentage": session.progress_percentage,
+        "pages_read": session.pages_read,
+        "is_completed": session.is_completed,
+    }
+
+
+def remove_duplicate_active_sessions(connection) -> int:
+    """Оставляет по одной (последней) активной сессии на пару пользователь-книга.
+
+    Нужно перед созданием uq_reading_sessions_active в базе, где дубликаты
+    уже успели появиться. Возвращает число удалённых строк.
+    """
+    latest = (
+        select(func.max(ReadingSession.id))
+        .where(ReadingSession.is_completed == False)
+        .group_by(ReadingSession.user_id, ReadingSession.book_id)
+    )
+    result = connection.execute(
+        delete(ReadingSession)
+        .where(ReadingSession.is_completed == False, ReadingSession.id.not_in(latest))
+    )
+    return result.rowcount or 0
+
+
+def _reading_sessions_filter(user_id: int, active_only: bool):
+    conditions = [ReadingSession.user_id == user_id]
+    if active_only:
+        conditions.append(ReadingSession.is_completed == False)
+    return conditions
+
+
+def _count_sessions_statement(user_id: int, active_only: bool):
+    return select(func.count()).select_from(ReadingSession).where(*_reading_sessions_filter(user_id, active_only))
+
+
+def count_user_reading_sessions(db: Session, user_id: int, active_only: bool = False) -> int:
+    """Количество сессий чтения пользователя (для пагинации)."""
+    return db.execute(_count_sessions_statement(user_id, active_only)).scalar_one()
+
+
+async def count_user_reading_sessions_async(db: AsyncSession, user_id: int, active_only: bool = False) -> int:
+    return (await db.execute(_count_sessions_statement(user_id, active_only))).scalar_one()
+
+
+def _reading_sessions_statement(user_id: int, active_only: bool, skip: int, limit: int):
+    first_author_id = (
+        select(func.min(book_authors.c.author_id))
+        .where(book_authors.c.book_id == Book.id)
+        .correlate(Book)
+        .scalar_subquery()
+    )
+    return (
+        select(ReadingSession, Book.title, Book.cover_url, Author.first_name, Author.last_name)
+        .join(Book, Book.id == ReadingSession.book_id)
+        .outerjoin(Author, Author.id == first_author_id)
+        .where(*_reading_sessions_filter(user_id, active_only))
+        .order_by(ReadingSession.start_time.desc(), ReadingSession.id.desc())
+        .offset(skip)
+        .limit(limit)
+    )
+
+
+def _reading_sessions(rows) -> List[dict]:
+    # Преобразуем сессии в удобный формат
+    result = []
+    for session, title, cover_url, first_name, last_name in rows:
+        result.append({
+            "id": session.id,
+            "book": {
+                "id": session.book_id,
+                "title": title,
+                "author": f"{first_name} {last_name}" if first_name is not None else "Неизвестный автор",
+                "cover_url": cover_url or "/static/images/book-placeholder.jpg"
+            },
+            "progress_percentage": session.progress_percentage or 0,
+            "pages_read": session.pages_read or 0,
+            "start_time": session.start_time.isoformat() if session.start_time else None,
+            "end_time": session.end_time.isoformat() if session.end_time else None,
+            "is_completed": session.is_completed or False
+        })
+    return result
+
+
+def get_user_reading_sessions(db: Session, user_id: int, active_only: bool = False, skip: int = 0, limit: int = 50):
+    """Получить страницу сессий чтения пользователя.
+
+    Книга и её первый автор подтягиваются в том же запросе, LIMIT/OFFSET
+    выполняются в БД по индексу ix_reading_sessions_user_state.
+    """
     try:
-        query = db.query(ReadingSession).filter(ReadingSession.user_id == user_id)
-        
-        if active_only:
-            query = query.filter(ReadingSession.is_completed == False)
-        
-        sessions = query.order_by(ReadingSession.start_time.desc()).all()
-        
-        # Преобразуем сессии в удобный формат
-        result = []
-        for session in sessions:
-            result.append({
-                "id": session.id,
-                "book": {
-                    "id": session.book.id,
-                    "title": session.book.title,
-                    "author": get_book_author(session.book),
-                    "cover_url": session.book.cover_url or "/static/images/book-placeholder.jpg"
-                },
-                "progress_percentage": session.progress_percentage or 0,
-                "pages_read": session.pages_read or 0,
-                "start_time": session.start_time.isoformat() if session.start_time else None,
-                "end_time": session.end_time.isoformat() if session.end_time else None,
-                "is_completed": session.is_completed or False
-            })
-        
-        return result
+        return _reading_sessions(db.execute(_reading_sessions_statement(user_id, active_only, skip, limit)).all())
     except Exception as e:
         print(f"Ошибка в get_user_reading_sessions: {e}")
         return []
 
-def get_book_author(book):
-    """Вспомогательная функция для получения автора книги"""
+
+async def get_user_reading_sessions_async(
+    db: AsyncSession, user_id: int, active_only: bool = False, skip: int = 0, limit: int = 50
+):
     try:
-        if book.authors and len(book.authors) > 0:
-            author = book.authors[0]
-            return f"{author.first_name} {author.last_name}"
-        return "Неизвестный автор"
-    except:
-        return "Неизвестный автор"
+        rows = (await db.execute(_reading_sessions_statement(user_id, active_only, skip, limit))).all()
+        return _reading_sessions(rows)
+    except Exception as e:
+        print(f"Ошибка в get_user_reading_sessions_async: {e}")
+        return []
@@ -0,0 +1,130 @@
+"""Пропускная способность чтения каталога: sync-эндпоинты на Session против
+async-эндпоинтов на AsyncSession при большом числе одновременных клиентов.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.bench_async_db --clients 500 --requests 5000
+
+Кэш ответов обходится: обе версии каждого маршрута читают из БД на каждом
+запросе. Без DATABASE_URL используется временная SQLite-база (aiosqlite);
+для PostgreSQL задайте DATABASE_URL — async-вариант пойдёт через asyncpg.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{Path(tempfile.gettempdir()) / 'library_bench.db'}")
+os.environ.setdefault("SECRET_KEY", "bench-secret-key")
+# 500 клиентов на пул из 15 соединений ждут дольше рабочего DB_POOL_TIMEOUT
+os.environ.setdefault("DB_POOL_TIMEOUT", "120")
+
+import httpx  # noqa: E402
+from fastapi import Depends, FastAPI  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app.models import SessionLocal, dispose_async_engine, get_async_db, get_db, init_db  # noqa: E402
+from app.models.book import Book  # noqa: E402
+from app.schemas.book import BookSearch  # noqa: E402
+from app.services.book import (  # noqa: E402
+    get_book, get_book_async, get_books, get_books_async, search_books, search_books_async,
+)
+
+bench = FastAPI()
+
+
+@bench.get("/sync/books")
+def sync_books(db: Session = Depends(get_db)):
+    return [book.id for book in get_books(db, limit=20, sort="newest")]
+
+
+@bench.get("/async/books")
+async def async_books(db: AsyncSession = Depends(get_async_db)):
+    return [book.id for book in await get_books_async(db, limit=20, sort="newest")]
+
+
+@bench.get("/sync/books/{book_id}")
+def sync_book(book_id: int, db: Session = Depends(get_db)):
+    book = get_book(db, book_id)
+    return {"id": book.id, "authors": [author.id for author in book.authors]}
+
+
+@bench.get("/async/books/{book_id}")
+async def async_book(book_id: int, db: AsyncSession = Depends(get_async_db)):
+    book = await get_book_async(db, book_id)
+    return {"id": book.id, "authors": [author.id for author in book.authors]}
+
+
+@bench.get("/sync/search")
+def sync_search(db: Session = Depends(get_db)):
+    return [book.id for book in search_books(db, BookSearch(language="ru"), limit=20)]
+
+
+@bench.get("/async/search")
+async def async_search(db: AsyncSession = Depends(get_async_db)):
+    return [book.id for book in await search_books_async(db, BookSearch(language="ru"), limit=20)]
+
+
+def seed(count: int) -> int:
+    db = SessionLocal()
+    try:
+        missing = count - db.query(Book).count()
+        db.add_all(
+            Book(title=f"Книга для замера {index}", language="ru", publication_year=1900 + index % 120)
+            for index in range(max(missing, 0))
+        )
+        db.commit()
+        return db.query(Book.id).order_by(Book.id).first()[0]
+    finally:
+        db.close()
+
+
+async def measure(path: str, total: int, clients: int) -> tuple:
+    transport = httpx.ASGITransport(app=bench)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits) as client:
+        queue = iter(range(total))
+        latencies = []
+
+        async def worker():
+            for _ in queue:
+                started = time.perf_counter()
+                response = await client.get(path)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        await client.get(path)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        return total / elapsed, latencies[int(len(latencies) * 0.99) - 1] * 1000
+
+
+async def main(total: int, clients: int, book_id: int) -> None:
+    paths = ["/books", f"/books/{book_id}", "/search"]
+    print(f"{clients} одновременных клиентов, {total} запросов на маршрут")
+    print(f"{'path':<16}{'sync':>14}{'p99':>10}{'async':>14}{'p99':>10}{'gain':>8}")
+    for path in paths:
+        sync_rps, sync_p99 = await measure(f"/sync{path}", total, clients)
+        async_rps, async_p99 = await measure(f"/async{path}", total, clients)
+        print(
+            f"{path:<16}{sync_rps:>10.0f} r/s{sync_p99:>7.0f} ms"
+            f"{async_rps:>10.0f} r/s{async_p99:>7.0f} ms{async_rps / sync_rps:>7.2f}x"
+        )
+    await dispose_async_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--books", type=int, default=1000)
+    args = parser.parse_args()
+
+    init_db()
+    first_id = seed(args.books)
+    asyncio.run(main(args.requests, args.clients, first_id))
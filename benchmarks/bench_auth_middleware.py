@@ -0,0 +1,88 @@
+"""Сравнение пропускной способности старого BaseHTTPMiddleware и AuthStateMiddleware.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.bench_auth_middleware --requests 3000
+
+Без DATABASE_URL используется временная SQLite-база с демонстрационными данными.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{Path(tempfile.gettempdir()) / 'library_bench.db'}")
+os.environ.setdefault("SECRET_KEY", "bench-secret-key")
+
+import httpx  # noqa: E402
+from starlette.middleware import Middleware  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+
+from app.core.middleware import AuthStateMiddleware  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import init_db  # noqa: E402
+from app.services.principal import anonymous_state, resolve_principal  # noqa: E402
+
+PATHS = ["/static/css/style.css", "/api/books"]
+
+
+async def legacy_add_user_to_request(request, call_next):
+    """Прежний middleware: пользователь определяется для каждого запроса."""
+    principal = resolve_principal(request.cookies.get("access_token"))
+    request.state.user = principal.as_state() if principal else anonymous_state()
+    return await call_next(request)
+
+
+def use_middleware(middleware: Middleware) -> None:
+    app.user_middleware = [
+        item for item in app.user_middleware if item.cls is not AuthStateMiddleware
+        and item.cls is not BaseHTTPMiddleware
+    ]
+    app.user_middleware.append(middleware)
+    app.middleware_stack = None
+
+
+async def measure(path: str, total: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        queue = iter(range(total))
+
+        async def worker():
+            for _ in queue:
+                response = await client.get(path)
+                response.raise_for_status()
+
+        await client.get(path)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - started)
+
+
+async def main(total: int, concurrency: int) -> None:
+    variants = {
+        "BaseHTTPMiddleware": Middleware(BaseHTTPMiddleware, dispatch=legacy_add_user_to_request),
+        "AuthStateMiddleware": Middleware(AuthStateMiddleware),
+    }
+    results = {}
+    for name, middleware in variants.items():
+        use_middleware(middleware)
+        for path in PATHS:
+            results[(name, path)] = await measure(path, total, concurrency)
+
+    print(f"{'path':<28}{'BaseHTTPMiddleware':>22}{'AuthStateMiddleware':>22}{'gain':>9}")
+    for path in PATHS:
+        before = results[("BaseHTTPMiddleware", path)]
+        after = results[("AuthStateMiddleware", path)]
+        print(f"{path:<28}{before:>18.0f} r/s{after:>18.0f} r/s{after / before:>8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    init_db()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,90 @@
+"""Задержка глубокой страницы каталога: OFFSET против курсора (keyset).
+
+Запуск из корня проекта (по умолчанию 1 000 000 книг во временной SQLite-базе):
+
+    python -m benchmarks.bench_pagination --books 1000000 --page 1000 --limit 100
+
+Для PostgreSQL передайте DATABASE_URL отдельной (пустой) базы.
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DB_PATH = Path(tempfile.gettempdir()) / "library_pagination_bench.db"
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{BENCH_DB_PATH}")
+os.environ.setdefault("SECRET_KEY", "bench-secret-key")
+
+from sqlalchemy import insert, text  # noqa: E402
+
+from app.models import Base, SessionLocal, engine  # noqa: E402
+from app.models import book as book_models  # noqa: E402,F401
+from app.models import user as user_models  # noqa: E402,F401
+from app.models.book import Book  # noqa: E402
+from app.services.book import encode_cursor, get_books  # noqa: E402
+
+
+def populate(total: int, batch: int = 20_000) -> None:
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        existing = db.query(Book).count()
+        if existing >= total:
+            return
+        for start in range(existing, total, batch):
+            rows = [
+                {
+                    "title": f"Книга {number}",
+                    "language": "ru",
+                    "view_count": (number * 7919) % 10_000,
+                    "download_count": (number * 104_729) % 1_000,
+                    "rating": (number % 50) / 10,
+                    "is_active": True,
+                }
+                for number in range(start, min(start + batch, total))
+            ]
+            db.execute(insert(Book), rows)
+            db.commit()
+
+        # Разносим даты создания, чтобы порядок newest не состоял из сплошных совпадений
+        if engine.dialect.name == "sqlite":
+            db.execute(text("UPDATE books SET created_at = datetime('2020-01-01', '+' || id || ' seconds')"))
+        else:
+            db.execute(text("UPDATE books SET created_at = TIMESTAMP '2020-01-01' + id * INTERVAL '1 second'"))
+        db.commit()
+
+
+def timed(func, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main(total: int, page: int, limit: int, repeats: int) -> None:
+    populate(total)
+    skip = (page - 1) * limit
+    print(f"books={total} page={page} limit={limit} (offset {skip}), best of {repeats}")
+    print(f"{'sort':<10}{'offset, ms':>14}{'cursor, ms':>14}")
+    with SessionLocal() as db:
+        for sort in [None, "newest", "popular"]:
+            # Курсор предыдущей страницы: строка прямо перед нужной страницей
+            previous = get_books(db, skip=skip - 1, limit=1, sort=sort)[0]
+            cursor = encode_cursor(previous, sort)
+            by_offset = timed(lambda: get_books(db, skip=skip, limit=limit, sort=sort), repeats)
+            by_cursor = timed(lambda: get_books(db, limit=limit, sort=sort, cursor=cursor), repeats)
+            assert [b.id for b in get_books(db, skip=skip, limit=limit, sort=sort)] == \
+                [b.id for b in get_books(db, limit=limit, sort=sort, cursor=cursor)]
+            print(f"{sort or 'id':<10}{by_offset:>14.2f}{by_cursor:>14.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=1_000_000)
+    parser.add_argument("--page", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    main(args.books, args.page, args.limit, args.repeats)
@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+from test_app_smoke import create_client
+from test_catalog import ensure_books, login_admin
+
+
+@contextmanager
+def async_routes_client():
+    """Клиент, у которого маршруты чтения работают на AsyncSession."""
+    from app.core.config import settings
+
+    previous = settings.async_db_routes
+    settings.async_db_routes = True
+    try:
+        with create_client() as client:
+            yield client
+    finally:
+        settings.async_db_routes = previous
+
+
+def test_async_database_url_uses_async_drivers():
+    from app.models import async_database_url
+
+    assert async_database_url("postgresql://u:p@db/library") == "postgresql+asyncpg://u:p@db/library"
+    assert async_database_url("postgresql+psycopg2://u:p@db/library") == "postgresql+asyncpg://u:p@db/library"
+    assert async_database_url("sqlite:////tmp/library.db") == "sqlite+aiosqlite:////tmp/library.db"
+
+
+def test_async_endpoints_match_sync_services():
+    from app.core.response_cache import catalog_cache
+    from app.models import SessionLocal
+    from app.schemas.book import BookSearch
+    from app.services.book import get_books, get_search_facets, search_books
+    from app.services.system_counters import get_system_counters
+
+    with create_client() as client:
+        login_admin(client)
+        ensure_books(client, 3)
+    catalog_cache.clear()
+
+    with async_routes_client() as client:
+        db = SessionLocal()
+        try:
+            first_page = client.get("/api/books", params={"sort": "newest", "limit": 2})
+            assert [book["id"] for book in first_page.json()] == [
+                book.id for book in get_books(db, limit=2, sort="newest")
+            ]
+            cursor = first_page.headers["X-Next-Cursor"]
+            second_page = client.get("/api/books", params={"sort": "newest", "limit": 2, "cursor": cursor})
+            assert [book["id"] for book in second_page.json()] == [
+                book.id for book in get_books(db, limit=2, sort="newest", cursor=cursor)
+            ]
+
+            found = client.get("/api/books/search", params={"query": "каталожная", "facets": "true"}).json()
+            search = BookSearch(query="каталожная")
+            assert [book["id"] for book in found["items"]] == [book.id for book in search_books(db, search)]
+            assert found["facets"] == get_search_facets(db, search)
+
+            book = client.get(f"/api/books/{found['items'][0]['id']}").json()
+            assert book["title"].startswith("Каталожная книга")
+            assert client.get("/api/books/999999").status_code == 404
+
+            counters = get_system_counters(db)
+            assert client.get("/api/books/stats").json()["total_books"] == counters["books"]
+        finally:
+            db.close()
+
+
+def test_async_me_routes_resolve_user_without_sync_session():
+    from app.models import SessionLocal, get_db
+    from app.services.user_stats import count_user_reading_sessions, get_user_reading_stats
+
+    def no_sync_session():
+        raise AssertionError("async-маршрут открыл синхронную Session")
+
+    with async_routes_client() as client:
+        login_admin(client)
+        user_id = client.get("/api/auth/me").json()["id"]
+        client.app.dependency_overrides[get_db] = no_sync_session
+        try:
+            stats = client.get("/api/users/me/stats")
+            sessions = client.get("/api/users/me/reading-sessions")
+            headers = {"Authorization": f"Bearer {client.cookies['access_token']}"}
+            client.cookies.clear()
+            by_bearer = client.get("/api/users/me/stats", headers=headers)
+            assert client.get("/api/users/me/stats").status_code == 401
+        finally:
+            client.app.dependency_overrides.pop(get_db)
+
+    db = SessionLocal()
+    try:
+        assert stats.json() == by_bearer.json() == get_user_reading_stats(db, user_id)
+        assert sessions.json()["total"] == count_user_reading_sessions(db, user_id)
+    finally:
+        db.close()
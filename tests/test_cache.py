@@ -0,0 +1,61 @@
+from app.core.cache import InMemoryBackend, TwoTierCache
+
+
+class BrokenBackend(InMemoryBackend):
+    def get(self, key):
+        raise ConnectionError("L2 недоступен")
+
+
+def test_two_tier_cache_invalidates_other_workers():
+    backend = InMemoryBackend()
+    first = TwoTierCache("books", maxsize=10, ttl=60, backend=backend)
+    second = TwoTierCache("books", maxsize=10, ttl=60, backend=backend)
+    other = TwoTierCache("users", maxsize=10, ttl=60, backend=backend)
+
+    first.set(("book", 1), {"title": "Мастер и Маргарита"})
+    # Второй воркер получает значение из L2 и кладёт его в свой L1
+    assert second.get(("book", 1)) == {"title": "Мастер и Маргарита"}
+    assert len(second) == 1
+
+    other.set(("book", 1), "чужое пространство имён")
+    first.delete(("book", 1))
+    assert second.get(("book", 1)) is None
+    assert other.get(("book", 1)) == "чужое пространство имён"
+
+    second.set("page", [1, 2, 3])
+    assert first.get("page") == [1, 2, 3]
+    generation = second.generation
+    first.clear()
+    assert first.generation == second.generation == generation + 1
+    assert first.get("page") is None
+    assert second.get("page") is None
+
+    # Значение, построенное до очистки, не попадает в новое поколение
+    first.set("late", "устаревшее", generation=generation)
+    assert second.get("late") is None
+
+
+def test_two_tier_cache_falls_back_to_local_tier_when_l2_fails():
+    cache = TwoTierCache("broken", maxsize=10, ttl=60, backend=BrokenBackend())
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    assert cache.get("missing") is None
+
+
+def test_l2_errors_are_counted_each_time_but_logged_rarely(capsys):
+    from app.core.metrics import metrics
+
+    class FlakyBackend(InMemoryBackend):
+        # Подключение удалось, а чтения падают, например по таймауту
+        def get(self, key):
+            if key.endswith(":generation"):
+                return None
+            raise TimeoutError("L2 не отвечает")
+
+    cache = TwoTierCache("flaky", maxsize=10, ttl=60, backend=FlakyBackend())
+    errors = metrics.counter("cache.flaky.l2_errors")
+    for index in range(5):
+        assert cache.get(f"missing-{index}") is None
+
+    assert metrics.counter("cache.flaky.l2_errors") == errors + 5
+    assert capsys.readouterr().out.count("ошибка L2") == 1
@@ -0,0 +1,371 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from test_app_smoke import create_client, login_user, register_user
+
+
+def login_admin(client):
+    register_user(client, "admin_user", "admin@example.com")
+    assert login_user(client, "admin_user").status_code == 200
+
+
+def ensure_books(client, count=7):
+    for index in range(count):
+        response = client.post(
+            "/api/admin/books",
+            json={
+                "title": f"Каталожная книга {index}",
+                "publication_year": 1990 + index,
+                "language": "ru",
+            },
+        )
+        assert response.status_code == 200
+
+
+@contextmanager
+def count_queries():
+    from app.models import engine, get_async_engine
+
+    statements = []
+    engines = (engine, get_async_engine().sync_engine)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for target in engines:
+        event.listen(target, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for target in engines:
+            event.remove(target, "before_cursor_execute", before_cursor_execute)
+
+
+def walk_with_cursor(client, params, path="/api/books"):
+    ids, cursor = [], None
+    while True:
+        query = dict(params, limit=3)
+        if cursor:
+            query["cursor"] = cursor
+        response = client.get(path, params=query)
+        assert response.status_code == 200, response.text
+        ids.extend(book["id"] for book in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return ids
+
+
+def test_cursor_pagination_matches_offset_for_every_sort():
+    with create_client() as client:
+        login_admin(client)
+        ensure_books(client)
+
+        for sort in [None, "newest", "popular"]:
+            params = {"sort": sort} if sort else {}
+            expected = [book["id"] for book in client.get("/api/books", params=dict(params, limit=1000)).json()]
+            assert walk_with_cursor(client, dict(params)) == expected
+
+        expected = [book["id"] for book in client.get("/api/books/search", params={"language": "ru"}).json()]
+        assert len(expected) >= 7
+        assert walk_with_cursor(client, {"language": "ru"}, "/api/books/search") == expected
+
+        assert client.get("/api/books", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_upgrade_schema_drops_only_retired_indexes():
+    from sqlalchemy import inspect, text
+    from app.models import engine, upgrade_schema
+
+    with engine.begin() as connection:
+        connection.execute(text("CREATE INDEX ix_books_active_popular ON books (is_active, view_count, id)"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_custom ON books (language)"))
+
+    upgrade_schema()
+
+    indexes = {index["name"] for index in inspect(engine).get_indexes("books")}
+    assert "ix_books_active_popular" not in indexes
+    # Индекс, добавленный оператором вручную, остаётся
+    assert "ix_custom" in indexes
+    assert {"ix_books_active_newest", "ix_books_active_popularity"} <= indexes
+
+
+def test_full_text_search_ranks_and_follows_author_rename():
+    with create_client() as client:
+        login_admin(client)
+        author = client.post("/api/admin/authors", params={"first_name": "Фёдор", "last_name": "Достоевский"}).json()
+        created = client.post(
+            "/api/admin/books",
+            json={
+                "title": "Преступление и наказание",
+                "description": "Роман о студенте",
+                "author_ids": [author["id"]],
+                "language": "ru",
+            },
+        )
+        assert created.status_code == 200
+        book_id = created.json()["id"]
+        client.post("/api/admin/books", json={"title": "Студенческие годы", "language": "ru"})
+
+        def search_ids(text):
+            response = client.get("/api/books/search", params={"query": text})
+            assert response.status_code == 200
+            return [book["id"] for book in response.json()]
+
+        assert book_id in search_ids("преступлен")
+        assert book_id in search_ids("федор")
+        # Совпадение в названии весит больше, чем в описании
+        results = search_ids("студен")
+        assert results.index(book_id) == len(results) - 1
+
+        renamed = client.put(
+            f"/api/admin/authors/{author['id']}",
+            params={"first_name": "Фёдор", "last_name": "Dostoevsky"},
+        )
+        assert renamed.status_code == 200
+        assert book_id in search_ids("Dostoevsky")
+        assert book_id not in search_ids("Достоевский")
+
+
+def test_in_memory_index_matches_database_search_and_updates_incrementally():
+    from app.models import SessionLocal
+    from app.models.book import Book
+    from app.schemas.book import BookSearch
+    from app.services.book import search_books
+    from app.services.search_index import CatalogIndex
+
+    with create_client() as client:
+        login_admin(client)
+        ensure_books(client, 3)
+
+    db = SessionLocal()
+    try:
+        index = CatalogIndex()
+        index.rebuild(db)
+
+        for params in [
+            {},
+            {"language": "ru"},
+            {"year_min": 1992, "year_max": 1994},
+            {"query": "каталожная"},
+            {"query": "Каталож книга", "year_min": 1995},
+            {"category_id": 1},
+        ]:
+            search = BookSearch(**params)
+            expected = {book.id for book in search_books(db, search, limit=1000)}
+            assert set(index.search(search)) == expected, params
+
+        book = db.query(Book).filter(Book.title == "Каталожная книга 0").first()
+        index.remove_book(book.id)
+        assert book.id not in index.search(BookSearch(query="каталожная"))
+        index.add_book(book)
+        assert book.id in index.search(BookSearch(query="каталожная"))
+        assert index.memory_bytes() > 0
+    finally:
+        db.close()
+
+
+def test_in_memory_index_follows_author_and_category_renames(monkeypatch):
+    from app.core.config import settings
+    from app.models import SessionLocal
+    from app.services.search_index import catalog_index
+
+    with create_client() as client:
+        login_admin(client)
+        author = client.post("/api/admin/authors", params={"first_name": "Иван", "last_name": "Гончаров"}).json()
+        category = client.post("/api/admin/categories", params={"name": "Классика"}).json()
+        book_id = client.post(
+            "/api/admin/books",
+            json={"title": "Обломов", "author_ids": [author["id"]], "category_ids": [category["id"]]},
+        ).json()["id"]
+
+        monkeypatch.setattr(settings, "search_backend", "memory")
+        monkeypatch.setattr(catalog_index, "ready", False)
+        db = SessionLocal()
+        try:
+            catalog_index.rebuild(db)
+        finally:
+            db.close()
+
+        def search_ids(text):
+            return [book["id"] for book in client.get("/api/books/search", params={"query": text}).json()]
+
+        assert book_id in search_ids("Гончаров")
+        client.put(f"/api/admin/authors/{author['id']}", params={"first_name": "Иван", "last_name": "Goncharov"})
+        assert book_id in search_ids("Goncharov")
+        assert book_id not in search_ids("Гончаров")
+
+        client.put(f"/api/admin/categories/{category['id']}", params={"name": "Русская проза"})
+        assert book_id in search_ids("проза")
+        assert book_id not in search_ids("Классика")
+
+
+def test_in_memory_cursor_handles_aware_times_evicted_books_and_garbage(monkeypatch):
+    import base64
+    import json
+    from datetime import datetime, timezone
+    from app.core.config import settings
+    from app.models import SessionLocal
+    from app.services.search_index import catalog_index
+
+    def make_cursor(values):
+        raw = json.dumps({"s": "newest", "k": values}).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    with create_client() as client:
+        login_admin(client)
+        ensure_books(client)
+        monkeypatch.setattr(settings, "search_backend", "memory")
+        monkeypatch.setattr(catalog_index, "ready", False)
+        db = SessionLocal()
+        try:
+            catalog_index.rebuild(db)
+        finally:
+            db.close()
+
+        params = {"language": "ru", "limit": 2}
+        first_page = client.get("/api/books/search", params=params)
+        cursor = first_page.headers["X-Next-Cursor"]
+        expected = [book["id"] for book in client.get("/api/books/search", params=dict(params, cursor=cursor)).json()]
+
+        created_at, last_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))["k"]
+        aware = datetime.fromisoformat(created_at["dt"]).replace(tzinfo=timezone.utc).isoformat()
+        aware_page = client.get("/api/books/search", params=dict(params, cursor=make_cursor([{"dt": aware}, last_id])))
+        assert aware_page.status_code == 200
+        assert [book["id"] for book in aware_page.json()] == expected
+
+        # Книга выпала из индекса после выдачи курсора
+        catalog_index.remove_book(expected[0])
+        evicted_page = client.get("/api/books/search", params=dict(params, cursor=cursor))
+        assert evicted_page.status_code == 200
+        assert expected[0] not in [book["id"] for book in evicted_page.json()]
+
+        garbage = client.get("/api/books/search", params=dict(params, cursor=make_cursor(["вчера", last_id])))
+        assert garbage.status_code == 400
+
+
+def test_in_memory_index_pages_candidates_and_counts_truncated_prefixes(monkeypatch):
+    from datetime import datetime, timedelta
+    from types import SimpleNamespace
+    from app.core.metrics import metrics
+    from app.schemas.book import BookSearch
+    from app.services import search_index
+
+    index = search_index.CatalogIndex()
+    started = datetime(2024, 1, 1)
+    for book_id, (title, language) in enumerate(
+        [("Альфа", "ru"), ("Альбом", "ru"), ("Beta", "en"), ("Альпы", "ru"), ("Gamma", "en")], start=1
+    ):
+        index.add_book(SimpleNamespace(
+            id=book_id, title=title, subtitle=None, authors=[], categories=[], is_active=True,
+            language=language, publication_year=2000 + book_id, created_at=started + timedelta(days=book_id),
+        ))
+
+    assert index.search(BookSearch(language="ru")) == [4, 2, 1]
+    assert index.search(BookSearch(language="ru"), limit=2) == [4, 2]
+    assert index.search(BookSearch(language="ru"), limit=2, before=index.order_key(4)) == [2, 1]
+    assert index.search(BookSearch(), limit=2) == [5, 4]
+    assert index.search(BookSearch(year_max=2003), limit=2, before=index.order_key(3)) == [2, 1]
+
+    truncated = metrics.counter("search_index.prefix_truncated")
+    monkeypatch.setattr(search_index, "_MAX_PREFIX_EXPANSION", 2)
+    # «альфа» — третий по алфавиту термин и в развёртку не попадает
+    assert index.search(BookSearch(query="аль")) == [4, 2]
+    assert metrics.counter("search_index.prefix_truncated") == truncated + 1
+
+
+def test_search_facets_count_current_filter_set_in_one_query():
+    from app.models import SessionLocal
+    from app.schemas.book import BookSearch
+    from app.services.book import get_search_facets
+
+    with create_client() as client:
+        login_admin(client)
+        category = client.post("/api/admin/categories", params={"name": "Фасетная категория"}).json()
+        author = client.post("/api/admin/authors", params={"first_name": "Фасет", "last_name": "Автор"}).json()
+        for year, language in [(1961, "ru"), (1968, "ru"), (1975, "en")]:
+            created = client.post(
+                "/api/admin/books",
+                json={
+                    "title": f"Фасетная книга {year}",
+                    "publication_year": year,
+                    "language": language,
+                    "category_ids": [category["id"]],
+                    "author_ids": [author["id"]],
+                },
+            )
+            assert created.status_code == 200
+
+        response = client.get(
+            "/api/books/search",
+            params={"category_id": category["id"], "facets": "true", "limit": 2},
+        )
+        assert response.status_code == 200, response.text
+        body = response.json()
+        assert len(body["items"]) == 2
+        facets = body["facets"]
+        # Собственный фильтр к своей группировке не применяется: видны и другие категории
+        assert {"value": category["id"], "label": "Фасетная категория", "count": 3} in facets["categories"]
+        assert len(facets["categories"]) > 1
+        assert facets["authors"] == [{"value": author["id"], "label": "Фасет Автор", "count": 3}]
+        assert {item["value"]: item["count"] for item in facets["languages"]} == {"ru": 2, "en": 1}
+        assert {item["value"]: item["count"] for item in facets["decades"]} == {1960: 2, 1970: 1}
+        assert facets["decades"][0]["label"] == "1960-е"
+
+        # Без facets ответ остаётся списком книг
+        assert isinstance(client.get("/api/books/search", params={"category_id": category["id"]}).json(), list)
+
+    db = SessionLocal()
+    try:
+        with count_queries() as statements:
+            facets = get_search_facets(db, BookSearch(query="фасетная", language="ru"))
+    finally:
+        db.close()
+    assert len(statements) == 1
+    assert {item["value"]: item["count"] for item in facets["decades"]} == {1960: 2}
+    assert {item["value"]: item["count"] for item in facets["languages"]} == {"ru": 2, "en": 1}
+
+
+def test_book_listings_run_constant_number_of_queries():
+    from app.core.response_cache import catalog_cache
+
+    with create_client() as client:
+        login_admin(client)
+        category = client.post("/api/admin/categories", params={"name": "Категория N+1"}).json()
+        author = client.post("/api/admin/authors", params={"first_name": "Иван", "last_name": "Запросов"}).json()
+        book_ids = []
+        for index in range(4):
+            created = client.post(
+                "/api/admin/books",
+                json={
+                    "title": f"Книга без N+1 {index}",
+                    "language": "ru",
+                    "category_ids": [category["id"]],
+                    "author_ids": [author["id"]],
+                },
+            )
+            assert created.status_code == 200
+            book_ids.append(created.json()["id"])
+
+        def queries_for(path, **params):
+            # Считаем запросы без кэша ответов
+            catalog_cache.clear()
+            with count_queries() as statements:
+                response = client.get(path, params=params)
+            assert response.status_code == 200, response.text
+            return len(statements)
+
+        # Прогрев: кэш пользователя и служебные запросы первого обращения
+        queries_for("/api/books", limit=1)
+
+        for path, params in [
+            ("/api/books", {}),
+            ("/api/books", {"sort": "newest"}),
+            ("/api/books/search", {"author_id": author["id"]}),
+            ("/api/books/search", {"query": "книга"}),
+        ]:
+            assert queries_for(path, limit=1, **params) == queries_for(path, limit=1000, **params), path
+
+        client.post(f"/api/users/me/favorites/{book_ids[0]}")
+        single = queries_for("/api/users/me/favorites")
+        for book_id in book_ids[1:]:
+            client.post(f"/api/users/me/favorites/{book_id}")
+        assert queries_for("/api/users/me/favorites") == single
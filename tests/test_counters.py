@@ -0,0 +1,42 @@
+from test_app_smoke import create_client
+from test_catalog import count_queries, ensure_books, login_admin
+
+
+def test_page_views_are_buffered_and_flushed_in_one_batch():
+    from app.models import SessionLocal
+    from app.models.book import Book
+    from app.services.counters import book_counters
+
+    with create_client() as client:
+        # Сбрасываем вручную, чтобы фоновый поток не вмешивался в проверки
+        book_counters.stop()
+        login_admin(client)
+        ensure_books(client, 2)
+        book_ids = [book["id"] for book in client.get("/api/books", params={"sort": "newest", "limit": 2}).json()]
+        book_counters.flush()
+
+        db = SessionLocal()
+        try:
+            before = {book_id: db.get(Book, book_id).view_count or 0 for book_id in book_ids}
+        finally:
+            db.close()
+
+        with count_queries() as statements:
+            for _ in range(3):
+                for book_id in book_ids:
+                    assert client.get(f"/book/{book_id}").status_code == 200
+        # Просмотр страницы не пишет в books
+        assert not [statement for statement in statements if statement.lstrip().upper().startswith("UPDATE")]
+        assert book_counters.pending(book_ids[0]) == {"view_count": 3}
+
+        with count_queries() as statements:
+            assert book_counters.flush() == 2
+        assert len([statement for statement in statements if statement.lstrip().upper().startswith("UPDATE")]) == 1
+        assert book_counters.pending(book_ids[0]) == {}
+
+    db = SessionLocal()
+    try:
+        for book_id in book_ids:
+            assert db.get(Book, book_id).view_count == before[book_id] + 3
+    finally:
+        db.close()
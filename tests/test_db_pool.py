@@ -0,0 +1,101 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+import pytest
+from test_app_smoke import create_client
+from test_async_db import async_routes_client
+
+
+def test_pools_use_settings_and_report_gauges():
+    from app.core.config import settings
+    from app.core.metrics import metrics
+    from app.models import engine, get_async_engine
+
+    for pool in (engine.pool, get_async_engine().sync_engine.pool):
+        assert pool.size() == settings.db_pool_size
+        assert pool.timeout() == settings.db_pool_timeout
+        assert not pool._pre_ping
+
+    with create_client() as client:
+        assert client.get("/api/books", params={"limit": 1, "skip": 1}).status_code == 200
+    with async_routes_client() as client:
+        assert client.get("/api/books", params={"limit": 1, "skip": 2}).status_code == 200
+        assert client.get("/api/users/me/stats").status_code == 401
+
+    snapshot = metrics.snapshot()
+    assert snapshot["timings"]["db.pool.async.checkout_wait"]["count"] > 0
+    assert snapshot["timings"]["db.pool.sync.checkout_wait"]["count"] > 0
+    for name in ("sync", "async"):
+        # Все соединения возвращены в пул
+        assert snapshot["gauges"][f"db.pool.{name}.in_use"] == 0
+        assert snapshot["gauges"][f"db.pool.{name}.overflow"] == 0
+
+
+def test_pool_gauges_follow_overflow_connections(monkeypatch, tmp_path):
+    from sqlalchemy import create_engine
+    from app.core.config import settings
+    from app.core.db_pool import instrument_engine, pool_kwargs
+    from app.core.metrics import metrics
+
+    monkeypatch.setattr(settings, "db_pool_size", 1)
+    monkeypatch.setattr(settings, "db_max_overflow", 1)
+    url = f"sqlite:///{tmp_path / 'pool.db'}"
+    probe = create_engine(url, **pool_kwargs(url, "probe"))
+    instrument_engine(probe, "probe")
+
+    def gauges():
+        snapshot = metrics.snapshot()["gauges"]
+        return snapshot["db.pool.probe.in_use"], snapshot["db.pool.probe.overflow"]
+
+    try:
+        first, second = probe.connect(), probe.connect()
+        assert gauges() == (2, 1)
+        # Возвращённое соединение ложится в пустую очередь, сверхлимитное
+        # закрывается только при возврате в заполненный пул
+        second.close()
+        assert gauges() == (1, 1)
+        first.close()
+        assert gauges() == (0, 0)
+        assert metrics.snapshot()["timings"]["db.pool.probe.checkout_wait"]["count"] == 2
+    finally:
+        probe.dispose()
+
+
+def fake_postgres(max_connections: int, superuser_reserved: int = 3):
+    values = {"SHOW max_connections": max_connections, "SHOW superuser_reserved_connections": superuser_reserved}
+
+    @contextmanager
+    def connect():
+        yield SimpleNamespace(exec_driver_sql=lambda sql: SimpleNamespace(scalar=lambda: str(values[sql])))
+
+    return SimpleNamespace(dialect=SimpleNamespace(name="postgresql"), connect=connect)
+
+
+def test_connection_budget_must_fit_max_connections(monkeypatch):
+    from app.core.config import settings
+    from app.core.db_pool import check_connection_budget, connection_budget
+
+    monkeypatch.setattr(settings, "web_concurrency", 4)
+    monkeypatch.setattr(settings, "db_pool_size", 10)
+    monkeypatch.setattr(settings, "db_max_overflow", 5)
+    monkeypatch.setattr(settings, "db_reserved_connections", 10)
+    monkeypatch.setattr(settings, "async_db_routes", True)
+    assert connection_budget() == 4 * 2 * 15
+
+    check_connection_budget(fake_postgres(max_connections=200))
+    with pytest.raises(RuntimeError, match="max_connections=100"):
+        check_connection_budget(fake_postgres(max_connections=100))
+
+
+def test_connection_budget_skips_async_pool_without_async_routes(monkeypatch):
+    from app.core.config import settings
+    from app.core.db_pool import check_connection_budget, connection_budget
+
+    monkeypatch.setattr(settings, "web_concurrency", 4)
+    monkeypatch.setattr(settings, "db_pool_size", 10)
+    monkeypatch.setattr(settings, "db_max_overflow", 5)
+    monkeypatch.setattr(settings, "db_reserved_connections", 10)
+    monkeypatch.setattr(settings, "async_db_routes", False)
+    assert connection_budget() == 4 * 15
+
+    # 60 соединений помещаются туда, где двум пулам (120) места не хватило бы
+    check_connection_budget(fake_postgres(max_connections=100))
@@ -0,0 +1,64 @@
+from pathlib import Path
+from uuid import uuid4
+from test_app_smoke import create_client
+from test_catalog import login_admin
+
+
+def test_download_supports_ranges_conditional_requests_and_counts_downloads():
+    from app.services.counters import book_counters
+
+    content = bytes(range(256)) * 40
+    books_dir = Path("static") / "books"
+    books_dir.mkdir(parents=True, exist_ok=True)
+    path = books_dir / f"test-{uuid4().hex}.pdf"
+    path.write_bytes(content)
+
+    try:
+        with create_client() as client:
+            book_counters.stop()
+            login_admin(client)
+            created = client.post(
+                "/api/admin/books",
+                json={"title": "Книга для скачивания", "file_url": f"/static/books/{path.name}"},
+            )
+            assert created.status_code == 200
+            book_id = created.json()["id"]
+            url = f"/api/books/{book_id}/download"
+
+            full = client.get(url)
+            assert full.status_code == 200
+            assert full.content == content
+            assert full.headers["accept-ranges"] == "bytes"
+            assert full.headers["content-type"] == "application/pdf"
+            etag = full.headers["etag"]
+
+            partial = client.get(url, headers={"Range": "bytes=10-19"})
+            assert partial.status_code == 206
+            assert partial.content == content[10:20]
+            assert partial.headers["content-range"] == f"bytes 10-19/{len(content)}"
+
+            suffix = client.get(url, headers={"Range": "bytes=-5"})
+            assert suffix.status_code == 206
+            assert suffix.content == content[-5:]
+
+            assert client.get(url, headers={"Range": f"bytes={len(content)}-"}).status_code == 416
+            assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+            # Файл изменился с момента первой части — If-Range не совпал, отдаём целиком
+            stale = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+            assert stale.status_code == 200
+            assert stale.content == content
+
+            # Читалка загружает файл без attachment — это не скачивание
+            assert book_counters.pending(book_id) == {}
+
+            download = f"{url}?attachment=true"
+            assert client.get(download).status_code == 200
+            assert client.get(download, headers={"Range": "bytes=10-19"}).status_code == 206
+            assert client.get(download, headers={"Range": "bytes=0-9", "If-Range": '"other"'}).status_code == 200
+            # Считаются только ответы с начала файла: первый запрос и полный ответ после If-Range
+            assert book_counters.pending(book_id) == {"download_count": 2}
+
+            client.put(f"/api/admin/books/{book_id}", json={"file_url": "/static/../app/main.py"})
+            assert client.get(url).status_code == 404
+    finally:
+        path.unlink(missing_ok=True)
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from pathlib import Path
+from test_app_smoke import create_client
+from test_catalog import login_admin
+
+
+def test_loop_block_detector_reports_slow_callbacks():
+    from app.core.loop_monitor import enable_loop_block_detector
+    from app.core.metrics import metrics
+
+    async def blocking_handler():
+        enable_loop_block_detector(asyncio.get_running_loop(), 0.01)
+        await asyncio.sleep(0)
+        time.sleep(0.05)
+        await asyncio.sleep(0)
+
+    before = metrics.counter("event_loop.slow_callbacks")
+    asyncio.run(blocking_handler())
+    assert metrics.counter("event_loop.slow_callbacks") > before
+
+
+def test_blocking_routes_run_off_the_event_loop_and_uploads_stream_to_disk():
+    from app.main import book_detail
+
+    # Синхронные обработчики FastAPI выполняет в пуле потоков
+    assert not asyncio.iscoroutinefunction(book_detail)
+
+    content = b"%PDF-1.4\n" + bytes(range(256)) * 8192
+    with create_client() as client:
+        login_admin(client)
+        response = client.post(
+            "/api/admin/upload/book-file",
+            files={"file": ("большая книга.pdf", content, "application/pdf")},
+        )
+    assert response.status_code == 200
+    url = response.json()["url"]
+    assert url.startswith("/static/books/") and url.endswith(".pdf")
+
+    path = Path(url.lstrip("/"))
+    try:
+        assert path.read_bytes() == content
+    finally:
+        path.unlink(missing_ok=True)
+
+
+def test_html_pages_resolve_the_user_off_the_event_loop(monkeypatch):
+    from app.core import middleware
+    from app.services.principal import principal_cache
+
+    resolved_in_loop = []
+    resolve_principal = middleware.resolve_principal
+
+    def recording_resolve(token, db=None):
+        try:
+            asyncio.get_running_loop()
+            resolved_in_loop.append(True)
+        except RuntimeError:
+            resolved_in_loop.append(False)
+        return resolve_principal(token, db)
+
+    monkeypatch.setattr(middleware, "resolve_principal", recording_resolve)
+    with create_client() as client:
+        login_admin(client)
+        for path in ["/", "/catalog", "/profile", "/admin", "/admin/add-book", "/login"]:
+            # Промах кэша: пользователь загружается из БД
+            principal_cache.clear()
+            response = client.get(path, follow_redirects=False)
+            assert response.status_code in (200, 302)
+
+    assert resolved_in_loop and not any(resolved_in_loop)
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+from test_app_smoke import create_client
+from test_catalog import login_admin
+
+
+def positions(client, book_ids):
+    ranked = [book["id"] for book in client.get("/api/books", params={"sort": "popular", "limit": 100}).json()]
+    return [ranked.index(book_id) for book_id in book_ids]
+
+
+def test_recent_events_raise_popularity_with_time_decay():
+    from app.core.config import settings
+    from app.core.response_cache import catalog_cache
+    from app.models import SessionLocal
+    from app.services.counters import book_counters
+    from app.services.popularity import decay_boost, popularity_ranker, update_popularity
+
+    with create_client() as client:
+        popularity_ranker.stop()
+        book_counters.stop()
+        login_admin(client)
+        book_ids = [
+            client.post("/api/admin/books", json={"title": f"Популярность {index}"}).json()["id"]
+            for index in range(2)
+        ]
+        first, second = book_ids
+
+        book_counters.add(second, "view_count", 2)
+        book_counters.flush()
+        catalog_cache.clear()
+        first_position, second_position = positions(client, book_ids)
+        assert second_position < first_position
+
+        # Дочитанная книга весит больше пары просмотров
+        progress = client.post(f"/api/users/me/reading-sessions/{first}/progress", json={"progress_percentage": 100})
+        assert progress.status_code == 200
+        db = SessionLocal()
+        try:
+            update_popularity(db, datetime.utcnow() + timedelta(seconds=1))
+        finally:
+            db.close()
+        catalog_cache.clear()
+        first_position, second_position = positions(client, book_ids)
+        assert first_position < second_position
+
+        # Блок «популярные книги» админки читает тот же рейтинг
+        top = [book["id"] for book in client.get("/api/admin/stats").json()["popular_books"]]
+        ranked = [book["id"] for book in client.get("/api/books", params={"sort": "popular", "limit": 5}).json()]
+        assert top == ranked
+
+    # Событие, случившееся на период полураспада раньше, весит вдвое меньше
+    now = datetime.utcnow()
+    half_life = timedelta(hours=settings.popularity_half_life_hours)
+    assert abs(decay_boost(now) / decay_boost(now - half_life) - 2.0) < 1e-9
+
+
+def test_scores_are_renormalized_and_rebuilt_after_half_life_change(monkeypatch):
+    from app.core.config import settings
+    from app.models import SessionLocal
+    from app.models.book import Book
+    from app.services.counters import book_counters
+    from app.services.popularity import RENORMALIZE_AFTER, load_clock, popularity_ranker, update_popularity
+
+    with create_client() as client:
+        popularity_ranker.stop()
+        book_counters.stop()
+        login_admin(client)
+        book_id = client.post("/api/admin/books", json={"title": "Перенормировка"}).json()["id"]
+        book_counters.add(book_id, "view_count", 3)
+        book_counters.flush()
+
+    def ranking(db):
+        return [book_id for book_id, in db.query(Book.id).order_by(Book.popularity_score.desc(), Book.id.desc())]
+
+    db = SessionLocal()
+    try:
+        update_popularity(db)
+        clock = load_clock(db)
+        before = ranking(db)
+        max_score = max(score for score, in db.query(Book.popularity_score))
+
+        # Множитель ушёл далеко вперёд: рейтинги делятся на него, порядок сохраняется
+        later = clock.epoch + timedelta(hours=clock.half_life_hours * (RENORMALIZE_AFTER + 1))
+        update_popularity(db, later)
+        renormalized = load_clock(db)
+        assert renormalized.epoch == later
+        assert ranking(db) == before
+        assert max(score for score, in db.query(Book.popularity_score)) < max_score
+
+        # Смена периода полураспада в настройках пересчитывает рейтинг
+        monkeypatch.setattr(settings, "popularity_half_life_hours", clock.half_life_hours * 2)
+        update_popularity(db, later + timedelta(hours=1))
+        assert load_clock(db).half_life_hours == clock.half_life_hours * 2
+    finally:
+        db.close()
@@ -0,0 +1,143 @@
+import hashlib
+import secrets
+
+from test_app_smoke import create_client, login_user, register_user
+
+
+def login_admin(client):
+    register_user(client, "admin_user", "admin@example.com")
+    response = login_user(client, "admin_user")
+    assert response.status_code == 200
+    return response
+
+
+def test_role_change_and_deactivation_reach_cached_principal():
+    with create_client() as admin_client, create_client() as reader_client:
+        login_admin(admin_client)
+
+        register_response = register_user(reader_client, "cached_reader", "cached@example.com")
+        assert register_response.status_code == 200
+        user_id = register_response.json()["id"]
+        assert login_user(reader_client, "cached_reader").status_code == 200
+
+        me_response = reader_client.get("/api/auth/me")
+        assert me_response.status_code == 200
+        assert me_response.json()["role"] == "reader"
+
+        role_response = admin_client.patch(f"/api/admin/users/{user_id}/role?new_role=librarian")
+        assert role_response.status_code == 200
+        assert reader_client.get("/api/auth/me").json()["role"] == "librarian"
+
+        status_response = admin_client.patch(f"/api/admin/users/{user_id}/status?is_active=false")
+        assert status_response.status_code == 200
+        assert reader_client.get("/api/auth/me").status_code == 401
+
+        # Повторная активация не возвращает силу старому токену
+        admin_client.patch(f"/api/admin/users/{user_id}/status?is_active=true")
+        assert reader_client.get("/api/auth/me").status_code == 401
+        assert login_user(reader_client, "cached_reader").status_code == 200
+        assert reader_client.get("/api/auth/me").status_code == 200
+
+
+def test_tokens_without_uid_are_cached_by_username():
+    from app.core.security import create_access_token
+    from app.services.principal import principal_cache, resolve_principal
+
+    with create_client() as admin_client, create_client() as reader_client:
+        login_admin(admin_client)
+        user_id = register_user(reader_client, "legacy_token_reader", "legacy_token@example.com").json()["id"]
+
+        legacy_token = create_access_token({"sub": "legacy_token_reader"})
+        assert resolve_principal(legacy_token).id == user_id
+        assert principal_cache.get("sub:legacy_token_reader").id == user_id
+
+        admin_client.patch(f"/api/admin/users/{user_id}/role?new_role=librarian")
+        assert principal_cache.get("sub:legacy_token_reader") is None
+        assert resolve_principal(legacy_token).role == "librarian"
+
+
+def test_verified_token_cache_and_legacy_signature_counter():
+    from app.core import security
+    from app.core.metrics import metrics
+
+    token = security.create_access_token({"sub": "cache_probe"})
+    hits_before = metrics.counter("auth.token_cache.hits")
+    assert security.verify_token(token)["sub"] == "cache_probe"
+    assert security.verify_token(token)["sub"] == "cache_probe"
+    assert metrics.counter("auth.token_cache.hits") == hits_before + 1
+
+    header, payload, _ = token.split(".")
+    legacy_token = f"{header}.{payload}.{security._build_legacy_signature(f'{header}.{payload}')}"
+    legacy_before = metrics.counter("auth.legacy_signature_hits")
+    assert security.verify_token(legacy_token)["sub"] == "cache_probe"
+    assert metrics.counter("auth.legacy_signature_hits") == legacy_before + 1
+
+
+def test_role_bitmasks_match_permission_lists():
+    from app.core.acl import ROLE_PERMISSIONS, Permission, get_user_permissions, has_permission
+    from app.schemas.user import Principal
+
+    for role, permissions in ROLE_PERMISSIONS.items():
+        principal = Principal(
+            id=1, username="probe", email="probe@example.com", role=role.value,
+            is_active=True, is_verified=False, created_at="2025-01-01T00:00:00",
+        )
+        assert set(get_user_permissions(principal)) == set(permissions)
+        for permission in Permission:
+            assert has_permission(principal, permission) == (permission in permissions)
+
+    assert get_user_permissions(None) == [Permission.VIEW_BOOKS]
+
+
+def test_legacy_password_hash_is_upgraded_on_login():
+    from app.core.security import PEPPER, password_needs_rehash, verify_password
+    from app.models import SessionLocal
+    from app.models.user import User
+
+    salt = secrets.token_hex(8)
+    legacy_hash = "sha256${}${}".format(
+        salt, hashlib.sha256(f"{PEPPER}legacy-pass{salt}".encode()).hexdigest()
+    )
+    db = SessionLocal()
+    try:
+        db.add(User(username="legacy_user", email="legacy@example.com", hashed_password=legacy_hash))
+        db.commit()
+    finally:
+        db.close()
+
+    with create_client() as client:
+        assert login_user(client, "legacy_user", "legacy-pass").status_code == 200
+        assert login_user(client, "legacy_user", "wrong-pass").status_code == 401
+
+    db = SessionLocal()
+    try:
+        stored_hash = db.query(User).filter(User.username == "legacy_user").one().hashed_password
+    finally:
+        db.close()
+    assert stored_hash.startswith("pbkdf2_sha256$")
+    assert not password_needs_rehash(stored_hash)
+    assert verify_password("legacy-pass", stored_hash)
+
+
+def test_full_password_hash_queue_returns_503(monkeypatch):
+    from app.core.hashing import password_hasher
+    from app.core.metrics import metrics
+
+    with create_client() as client:
+        assert register_user(client, "queued_user", "queued@example.com").status_code == 200
+
+        # Очередь KDF заполнена операциями других запросов
+        monkeypatch.setattr(password_hasher, "_pending", password_hasher.max_pending)
+        rejected = metrics.counter("password_hash.rejected")
+
+        login_response = login_user(client, "queued_user")
+        assert login_response.status_code == 503
+        assert login_response.headers["Retry-After"] == "1"
+        register_response = register_user(client, "queued_user_2", "queued2@example.com")
+        assert register_response.status_code == 503
+        assert metrics.counter("password_hash.rejected") == rejected + 2
+
+        monkeypatch.setattr(password_hasher, "_pending", 0)
+        assert login_user(client, "queued_user").status_code == 200
+        # Отклонённая регистрация не создала пользователя
+        assert register_user(client, "queued_user_2", "queued2@example.com").status_code == 200
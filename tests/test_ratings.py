@@ -0,0 +1,66 @@
+from decimal import Decimal
+from sqlalchemy import update
+from test_app_smoke import create_client
+from test_catalog import login_admin
+
+
+def book_aggregates(book_id):
+    from app.models import SessionLocal
+    from app.models.book import Book
+
+    db = SessionLocal()
+    try:
+        book = db.query(Book).filter(Book.id == book_id).one()
+        return book.rating_sum, book.rating_count, book.rating_histogram, Decimal(book.rating)
+    finally:
+        db.close()
+
+
+def test_rating_aggregates_follow_review_create_approve_and_delete():
+    from app.models import SessionLocal
+    from app.models.book import Book, Review
+    from app.services.ratings import reconcile_book_ratings
+
+    with create_client() as client:
+        login_admin(client)
+        user_id = client.get("/api/auth/me").json()["id"]
+        book_id = client.post("/api/admin/books", json={"title": "Книга с оценками"}).json()["id"]
+
+        db = SessionLocal()
+        try:
+            reviews = [
+                Review(book_id=book_id, user_id=user_id, rating=rating, content="Отзыв", is_approved=approved)
+                for rating, approved in [(5, True), (3, True), (1, False)]
+            ]
+            db.add_all(reviews)
+            db.commit()
+            review_ids = [review.id for review in reviews]
+        finally:
+            db.close()
+        assert book_aggregates(book_id) == (8, 2, {1: 0, 2: 0, 3: 1, 4: 0, 5: 1}, Decimal("4.00"))
+
+        approved = client.patch(f"/api/admin/reviews/{review_ids[2]}/approval", params={"is_approved": "true"})
+        assert approved.status_code == 200
+        assert book_aggregates(book_id) == (9, 3, {1: 1, 2: 0, 3: 1, 4: 0, 5: 1}, Decimal("3.00"))
+
+        db = SessionLocal()
+        try:
+            db.query(Review).filter(Review.id == review_ids[1]).one().rating = 4
+            db.commit()
+        finally:
+            db.close()
+        assert book_aggregates(book_id) == (10, 3, {1: 1, 2: 0, 3: 0, 4: 1, 5: 1}, Decimal("3.33"))
+
+        assert client.delete(f"/api/admin/reviews/{review_ids[0]}").status_code == 200
+        assert book_aggregates(book_id) == (5, 2, {1: 1, 2: 0, 3: 0, 4: 1, 5: 0}, Decimal("2.50"))
+
+    # Расхождение (например, после ручной правки базы) исправляется сверкой
+    db = SessionLocal()
+    try:
+        db.execute(update(Book).where(Book.id == book_id).values(rating_sum=0, rating_5_count=7))
+        db.commit()
+        assert reconcile_book_ratings(db) == 1
+        assert reconcile_book_ratings(db) == 0
+    finally:
+        db.close()
+    assert book_aggregates(book_id) == (5, 2, {1: 1, 2: 0, 3: 0, 4: 1, 5: 0}, Decimal("2.50"))
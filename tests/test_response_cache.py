@@ -0,0 +1,45 @@
+from test_app_smoke import create_client
+from test_catalog import count_queries, ensure_books, login_admin
+
+
+def test_catalog_responses_are_cached_with_etag_until_catalog_changes():
+    with create_client() as client:
+        login_admin(client)
+        ensure_books(client, 3)
+
+        first = client.get("/api/books/categories")
+        assert first.status_code == 200
+        etag = first.headers["ETag"]
+
+        with count_queries() as statements:
+            not_modified = client.get("/api/books/categories", headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.headers["ETag"] == etag
+        assert statements == []
+
+        created = client.post("/api/admin/categories", params={"name": "Категория для ETag"})
+        assert created.status_code == 200
+        changed = client.get("/api/books/categories", headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["ETag"] != etag
+        assert "Категория для ETag" in {category["name"] for category in changed.json()}
+
+        # Порядок параметров не влияет на ключ, курсор кэшируется вместе с телом
+        listing = client.get("/api/books?sort=newest&limit=2")
+        assert listing.status_code == 200
+        with count_queries() as statements:
+            cached = client.get("/api/books?limit=2&sort=newest")
+        assert statements == []
+        assert cached.json() == listing.json()
+        assert cached.headers["X-Next-Cursor"] == listing.headers["X-Next-Cursor"]
+
+        book_id = listing.json()[0]["id"]
+        detail = client.get(f"/api/books/{book_id}")
+        assert detail.status_code == 200
+        updated = client.put(f"/api/admin/books/{book_id}", json={"title": "Новое название для ETag"})
+        assert updated.status_code == 200
+        refreshed = client.get(f"/api/books/{book_id}", headers={"If-None-Match": detail.headers["ETag"]})
+        assert refreshed.status_code == 200
+        assert refreshed.json()["title"] == "Новое название для ETag"
+
+        assert client.get("/api/books/999999").status_code == 404
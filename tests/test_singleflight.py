@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+from app.core.metrics import metrics
+from app.core.singleflight import SingleFlight
+
+
+def test_concurrent_threads_share_one_load():
+    flight = SingleFlight("test_sync")
+    calls = []
+    started = threading.Event()
+
+    def loader():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return "результат"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", loader)))
+    leader.start()
+    started.wait()
+    waiters = [threading.Thread(target=lambda: results.append(flight.do("key", loader))) for _ in range(5)]
+    for thread in waiters:
+        thread.start()
+    for thread in [leader, *waiters]:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["результат"] * 6
+    assert metrics.counter("singleflight.test_sync.coalesced") == 5
+    assert not flight.in_flight("key")
+
+
+def test_async_waiters_share_result_and_errors():
+    flight = SingleFlight("test_async")
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 42
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise ValueError("ошибка загрузки")
+
+    async def scenario():
+        assert await asyncio.gather(*(flight.do_async("key", loader) for _ in range(10))) == [42] * 10
+        errors = await asyncio.gather(*(flight.do_async("bad", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(error, ValueError) for error in errors)
+
+    asyncio.run(scenario())
+    assert calls == [1]
+    assert metrics.counter("singleflight.test_async.coalesced") == 11
+
+
+def test_stale_catalog_response_is_refreshed_in_background():
+    from app.core.response_cache import catalog_cache
+    from test_app_smoke import create_client
+
+    refreshes = metrics.counter("response_cache.background_refreshes")
+    soft_ttl, catalog_cache.soft_ttl = catalog_cache.soft_ttl, 0
+    try:
+        with create_client() as client:
+            assert client.get("/api/books/authors").status_code == 200
+            assert client.get("/api/books/authors").status_code == 200
+            deadline = time.monotonic() + 5
+            while metrics.counter("response_cache.background_refreshes") == refreshes:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+    finally:
+        catalog_cache.soft_ttl = soft_ttl
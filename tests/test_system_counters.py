@@ -0,0 +1,74 @@
+from sqlalchemy import update
+from test_app_smoke import create_client
+from test_catalog import count_queries, login_admin
+
+
+def real_counts():
+    from app.models import SessionLocal
+    from app.models.book import Book, Category
+    from app.models.user import User
+    from app.models.book import Author, ReadingSession, Review
+
+    db = SessionLocal()
+    try:
+        return {
+            "users": db.query(User).count(),
+            "books": db.query(Book).filter(Book.is_active == True).count(),
+            "authors": db.query(Author).count(),
+            "categories": db.query(Category).filter(Category.is_active == True).count(),
+            "reviews": db.query(Review).count(),
+            "reading_sessions": db.query(ReadingSession).count(),
+        }
+    finally:
+        db.close()
+
+
+def test_stats_read_maintained_counters_in_one_query():
+    from app.core.response_cache import catalog_cache
+    from app.models import SessionLocal
+    from app.models.system import SystemCounter
+    from app.services.progress import progress_buffer
+    from app.services.system_counters import get_system_counters, reconcile_system_counters, system_counter_buffer
+
+    with create_client() as client:
+        login_admin(client)
+        # Пишущие транзакции не трогают общие строки счётчиков
+        with count_queries() as statements:
+            created = client.post("/api/admin/books", json={"title": "Книга для счётчиков"}).json()
+        assert not [statement for statement in statements if "system_counters" in statement]
+        client.post(f"/api/users/me/reading-sessions/{created['id']}/progress", json={"progress_percentage": 10})
+        assert client.post("/api/admin/categories", params={"name": "Категория для счётчиков"}).status_code == 200
+        assert client.delete(f"/api/admin/books/{created['id']}").status_code == 200
+
+        # Дельты закоммиченных транзакций записываются пачкой из буфера
+        progress_buffer.flush()
+        system_counter_buffer.flush()
+        assert not system_counter_buffer.pending()
+
+        db = SessionLocal()
+        try:
+            assert get_system_counters(db) == real_counts()
+        finally:
+            db.close()
+
+        catalog_cache.clear()
+        with count_queries() as statements:
+            books_stats = client.get("/api/books/stats").json()
+            admin_stats = client.get("/api/admin/stats").json()
+        assert not [statement for statement in statements if "count(" in statement.lower()]
+        counts = real_counts()
+        assert books_stats["total_books"] == counts["books"]
+        assert books_stats["total_categories"] == counts["categories"]
+        assert admin_stats["total_users"] == counts["users"]
+        assert admin_stats["total_reading_sessions"] == counts["reading_sessions"]
+
+    # Расхождение (например, после ручной правки базы) исправляется сверкой
+    db = SessionLocal()
+    try:
+        db.execute(update(SystemCounter).where(SystemCounter.name == "reviews").values(value=SystemCounter.value + 5))
+        db.commit()
+        assert reconcile_system_counters(db) == {"reviews": -5}
+        assert get_system_counters(db) == real_counts()
+        assert reconcile_system_counters(db) == {}
+    finally:
+        db.close()
@@ -0,0 +1,303 @@
+from datetime import timedelta
+from test_app_smoke import create_client, login_user, register_user
+from test_catalog import count_queries, login_admin
+
+
+def test_reading_stats_are_one_query_with_real_reading_time():
+    from app.models import SessionLocal
+    from app.models.book import ReadingSession
+    from app.services.progress import progress_buffer
+    from app.services.user_stats import get_user_reading_stats
+
+    with create_client() as client:
+        # Первый зарегистрированный пользователь становится администратором
+        login_admin(client)
+        book_ids = [
+            client.post("/api/admin/books", json={"title": f"Статистика {index}"}).json()["id"]
+            for index in range(2)
+        ]
+        register_user(client, "stats_reader", "stats_reader@example.com")
+        assert login_user(client, "stats_reader").status_code == 200
+        user_id = client.get("/api/auth/me").json()["id"]
+
+        for book_id in book_ids:
+            client.post(f"/api/users/me/reading-sessions/{book_id}/progress", json={"progress_percentage": 50, "pages_read": 20})
+        client.post(f"/api/users/me/reading-sessions/{book_ids[0]}/progress", json={"progress_percentage": 100, "pages_read": 40})
+        client.post(f"/api/users/me/favorites/{book_ids[0]}")
+        client.post(f"/api/books/{book_ids[0]}/reviews", json={"rating": 5, "content": "Отличная книга"})
+        # Незавершённый прогресс пишется в БД при сбросе буфера
+        progress_buffer.flush()
+
+        # Завершённая сессия длилась ровно полтора часа
+        db = SessionLocal()
+        try:
+            session = db.query(ReadingSession).filter(
+                ReadingSession.user_id == user_id,
+                ReadingSession.is_completed == True,
+            ).one()
+            session.start_time = session.end_time - timedelta(hours=1, minutes=30)
+            db.commit()
+
+            with count_queries() as statements:
+                stats = get_user_reading_stats(db, user_id)
+            assert len(statements) == 1
+        finally:
+            db.close()
+
+        assert stats == {
+            "completed_books": 1,
+            "reading_books": 1,
+            "total_pages": 60,
+            "reviews_count": 1,
+            "favorites_count": 1,
+            "reading_time_hours": 1.5,
+        }
+        assert client.get("/api/users/me/stats").json() == stats
+
+
+def test_reading_sessions_are_paginated_in_sql_with_authors_in_one_query():
+    from app.services.progress import progress_buffer
+
+    with create_client() as client:
+        login_admin(client)
+        author_id = client.post("/api/admin/authors", params={"first_name": "Анна", "last_name": "Ахматова"}).json()["id"]
+        book_ids = [
+            client.post("/api/admin/books", json={"title": f"Сессии {index}", "author_ids": [author_id]}).json()["id"]
+            for index in range(3)
+        ]
+
+        register_user(client, "sessions_reader", "sessions_reader@example.com")
+        assert login_user(client, "sessions_reader").status_code == 200
+        for book_id in book_ids:
+            client.post(f"/api/users/me/reading-sessions/{book_id}/progress", json={"progress_percentage": 10})
+        progress_buffer.flush()
+
+        with count_queries() as statements:
+            page = client.get("/api/users/me/reading-sessions", params={"skip": 1, "limit": 2}).json()
+        assert page["total"] == 3
+        assert len(page["sessions"]) == 2
+        assert {session["book"]["author"] for session in page["sessions"]} == {"Анна Ахматова"}
+        # Страница и COUNT — по одному запросу, без догрузки книг и авторов по строкам
+        session_queries = [statement for statement in statements if "reading_sessions" in statement]
+        assert len(session_queries) == 2
+        assert not [statement for statement in statements if "FROM authors" in statement and "reading_sessions" not in statement]
+
+        full = client.get("/api/users/me/reading-sessions", params={"limit": 10}).json()["sessions"]
+        assert [session["id"] for session in full[1:3]] == [session["id"] for session in page["sessions"]]
+
+
+def test_reader_gets_current_progress_inline_and_by_book_lookup():
+    with create_client() as client:
+        login_admin(client)
+        book_id = client.post(
+            "/api/admin/books",
+            json={"title": "Книга для читалки", "file_url": "/static/demo-book.txt"},
+        ).json()["id"]
+        register_user(client, "progress_reader", "progress_reader@example.com")
+        assert login_user(client, "progress_reader").status_code == 200
+
+        assert client.get(f"/api/users/me/reading-sessions/{book_id}").status_code == 404
+        client.post(f"/api/users/me/reading-sessions/{book_id}/progress", json={"progress_percentage": 42})
+
+        session = client.get(f"/api/users/me/reading-sessions/{book_id}").json()
+        assert session["book_id"] == book_id
+        assert session["progress_percentage"] == 42
+
+        page = client.get(f"/book/{book_id}", params={"read": "true"})
+        assert page.status_code == 200
+        assert 'value="42"' in page.text
+        assert "/api/users/me/reading-sessions?active=true" not in page.text
+
+
+def test_progress_save_is_one_upsert_and_keeps_one_active_session():
+    from concurrent.futures import ThreadPoolExecutor
+    from app.models import SessionLocal
+    from app.models.book import ReadingSession
+    from app.services.user_stats import update_reading_progress
+
+    with create_client() as client:
+        login_admin(client)
+        book_id = client.post("/api/admin/books", json={"title": "Книга для upsert"}).json()["id"]
+        user_id = client.get("/api/auth/me").json()["id"]
+
+    def save(progress):
+        db = SessionLocal()
+        try:
+            return update_reading_progress(db, user_id, book_id, progress).id
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        ids = set(pool.map(save, [10, 20, 30, 40, 50, 60, 70, 80]))
+    assert len(ids) == 1
+
+    db = SessionLocal()
+    try:
+        with count_queries() as statements:
+            session = update_reading_progress(db, user_id, book_id, 55, pages_read=12)
+        # Один upsert; SQLite без xmax перед ним считает активную сессию пары
+        upserts = [statement for statement in statements if statement.lstrip().upper().startswith("INSERT")]
+        assert len(upserts) == 1
+        assert len(statements) == (1 if db.get_bind().dialect.name == "postgresql" else 2)
+        assert (session.progress_percentage, session.pages_read, session.is_completed) == (55, 12, False)
+
+        completed = update_reading_progress(db, user_id, book_id, 100)
+        assert completed.id == session.id and completed.is_completed and completed.end_time is not None
+        assert db.query(ReadingSession).filter(
+            ReadingSession.user_id == user_id,
+            ReadingSession.book_id == book_id,
+        ).count() == 1
+    finally:
+        db.close()
+
+
+def test_progress_saves_are_coalesced_and_flushed_in_batches():
+    from app.models import SessionLocal
+    from app.models.book import ReadingSession
+    from app.services.progress import progress_buffer
+
+    with create_client() as client:
+        progress_buffer.stop()
+        login_admin(client)
+        book_ids = [
+            client.post("/api/admin/books", json={"title": f"Буфер прогресса {index}"}).json()["id"]
+            for index in range(3)
+        ]
+        register_user(client, "buffered_reader", "buffered_reader@example.com")
+        assert login_user(client, "buffered_reader").status_code == 200
+        user_id = client.get("/api/auth/me").json()["id"]
+
+        with count_queries() as statements:
+            for progress in (5, 15, 25):
+                client.post(f"/api/users/me/reading-sessions/{book_ids[0]}/progress", json={"progress_percentage": progress})
+            batch = client.post(
+                "/api/users/me/reading-sessions/progress",
+                json={"items": [
+                    {"book_id": book_ids[1], "progress_percentage": 30, "pages_read": 9},
+                    {"book_id": book_ids[2], "progress_percentage": 100},
+                ]},
+            )
+        assert batch.status_code == 200
+        # Ползунок не пишет в reading_sessions; завершение записано сразу
+        writes = [statement for statement in statements if "reading_sessions" in statement
+                  and statement.lstrip().upper().startswith(("INSERT", "UPDATE"))]
+        assert len(writes) == 2
+        assert batch.json()["sessions"][1]["is_completed"] is True
+
+        # Читатель сразу видит своё последнее значение
+        assert client.get(f"/api/users/me/reading-sessions/{book_ids[0]}").json()["progress_percentage"] == 25
+
+        with count_queries() as statements:
+            assert progress_buffer.flush() == 2
+        assert len([statement for statement in statements if statement.lstrip().upper().startswith("INSERT")]) == 2
+
+        missing = client.post(
+            "/api/users/me/reading-sessions/progress",
+            json={"items": [{"book_id": 10 ** 9, "progress_percentage": 1}]},
+        )
+        assert missing.status_code == 404
+
+    db = SessionLocal()
+    try:
+        rows = {
+            session.book_id: session
+            for session in db.query(ReadingSession).filter(ReadingSession.user_id == user_id)
+        }
+    finally:
+        db.close()
+    assert rows[book_ids[0]].progress_percentage == 25
+    assert (rows[book_ids[1]].progress_percentage, rows[book_ids[1]].pages_read) == (30, 9)
+    assert rows[book_ids[2]].is_completed
+
+
+def test_progress_flush_drops_bad_rows_and_buffer_is_bounded(monkeypatch):
+    from types import SimpleNamespace
+    from sqlalchemy.exc import IntegrityError, OperationalError
+    from app.core.metrics import metrics
+    from app.services import progress
+
+    written, failure = [], {}
+
+    def write_progress_batch(db, entries):
+        if "error" in failure:
+            raise failure["error"]
+        if any(entry["book_id"] == 13 for entry in entries):
+            raise IntegrityError("INSERT INTO reading_sessions", {}, Exception("FOREIGN KEY constraint failed"))
+        written.extend(entry["book_id"] for entry in entries)
+        return len(entries)
+
+    monkeypatch.setattr(progress, "write_progress_batch", write_progress_batch)
+    buffer = progress.ProgressBuffer(flush_interval=60, max_pending=100, max_buffered=3)
+
+    # Строка с постоянной ошибкой отбрасывается, остальные из пачки записываются
+    for book_id in (11, 12, 13):
+        buffer.save(None, 1, book_id, 10)
+    dropped = metrics.counter("progress.dropped")
+    assert buffer.flush() == 2
+    assert sorted(written) == [11, 12]
+    assert metrics.counter("progress.dropped") == dropped + 1
+    assert buffer.pending(1, 13) is None
+
+    # Временная ошибка возвращает пачку в буфер, а заполненный буфер пишет новые пары сразу
+    failure["error"] = OperationalError("INSERT INTO reading_sessions", {}, Exception("connection lost"))
+    for book_id in (21, 22, 23):
+        buffer.save(None, 1, book_id, 10)
+    assert buffer.flush() == 0
+    assert buffer.pending(1, 21)["progress_percentage"] == 10
+
+    monkeypatch.setattr(
+        progress, "update_reading_progress",
+        lambda db, user_id, book_id, percentage, **_: SimpleNamespace(
+            id=7, book_id=book_id, progress_percentage=percentage, pages_read=0, is_completed=False,
+        ),
+    )
+    assert buffer.save(None, 1, 24, 10)["id"] == 7
+    assert buffer.pending(1, 24) is None
+    assert len(buffer.pending_for_user(1)) == 3
+
+
+def test_progress_pages_read_is_validated():
+    with create_client() as client:
+        login_admin(client)
+        book_id = client.post("/api/admin/books", json={"title": "Проверка страниц"}).json()["id"]
+        for pages_read in (-1, 10 ** 12):
+            response = client.post(
+                f"/api/users/me/reading-sessions/{book_id}/progress",
+                json={"progress_percentage": 10, "pages_read": pages_read},
+            )
+            assert response.status_code == 422
+
+
+def test_progress_upserts_count_only_inserted_sessions():
+    from app.models import SessionLocal
+    from app.services import user_stats
+    from app.services.system_counters import get_system_counters, system_counter_buffer
+
+    with create_client() as client:
+        login_admin(client)
+        user_id = client.get("/api/auth/me").json()["id"]
+        book_ids = [
+            client.post("/api/admin/books", json={"title": f"Книга для счётчика {index}"}).json()["id"]
+            for index in range(3)
+        ]
+
+    def sessions_counter(db):
+        system_counter_buffer.flush()
+        return get_system_counters(db)["reading_sessions"]
+
+    db = SessionLocal()
+    try:
+        before = sessions_counter(db)
+        user_stats.update_reading_progress(db, user_id, book_ids[0], 10)
+        user_stats.update_reading_progress(db, user_id, book_ids[0], 20)
+        assert sessions_counter(db) == before + 1
+
+        entries = [
+            {"user_id": user_id, "book_id": book_id, "progress_percentage": 30, "pages_read": None}
+            for book_id in book_ids
+        ]
+        assert user_stats.write_progress_batch(db, entries) == 3
+        assert user_stats.write_progress_batch(db, entries) == 3
+        assert sessions_counter(db) == before + 3
+    finally:
+        db.close()